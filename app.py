@@ -1,40 +1,187 @@
 # app.py
-import os, random
+import os, random, time
 from datetime import datetime
+from functools import wraps
 from flask import (
-    Flask, render_template, request,
-    redirect, url_for, session, flash
+    Flask, render_template, request, make_response, g,
+    redirect, url_for, session, flash, before_render_template, template_rendered
 )
 from werkzeug.utils import secure_filename
 
+try:
+    from PIL import Image  # optional: upload checks
+except ImportError:
+    Image = None
+
 from finalcode import (
-    load_all, save_all, username_exists, find_user,
+    load_all, save_changes, username_exists, db_pool, id_allocator, change_feed, file_journal, metrics, changes,
     Account, RegisteredUser, ProfessionalUser,
     Message, NormalPost, ProductPost,
-    JobPost, Media, Like, Comment
+    JobPost, Media, MediaPipeline, MediaStore, FEED_PAGE_SIZE, MARKET_SORTS, USER_SEARCH_LIMIT,
+    MESSAGE_PAGE_SIZE, SHUFFLE_PAGE_SIZE, shuffle_seed, shuffle_window, shuffled_page
 )
 
 app = Flask(__name__)
 app.secret_key = 'YOUR_SECRET_KEY'
 
 # Load data once
-users, posts, messages, marketplace = load_all()
-for p in posts:
-    if isinstance(p.author, str):
-        real = find_user(users, p.author)
-        if real: p.author = real
+repo = load_all()
+app.logger.info("load_all: %s", ", ".join(f"{k}={v*1000:.0f}ms" for k, v in repo.load_timings.items()))
+
+media_pipeline = MediaPipeline(app.static_folder, app.static_url_path)
+media_store = MediaStore(os.path.join(app.static_folder, 'media'), app.static_url_path + '/media')
+repo.attach_media_store(media_store)
+
+@app.template_filter('variant')
+def media_variant(media, name):
+    return media_pipeline.resolve(media, name)
+
+def is_image(f):
+    # the header has to parse, or the media pool could never read it either
+    if Image is None:
+        return True
+    try:
+        with Image.open(f.stream) as img:
+            img.verify()
+        return True
+    except Exception:
+        return False
+    finally:
+        f.stream.seek(0)
+
+def save_upload(f, media_type=None):
+    # store the upload by content hash and let the media pool make the small
+    # variants; None (with a flash) when an image upload is not an image
+    if media_type is None:
+        media_type = 'image' if f.mimetype.startswith('image') else 'video'
+    if media_type == 'image' and not is_image(f):
+        flash('That file is not an image we can read.', 'danger')
+        return None
+    url = media_store.put(f.stream, secure_filename(f.filename))
+    media = Media(None, media_type, url)
+    media_pipeline.submit(media)
+    return media
+
+# — Metrics —
+
+metrics.describe('blex_http_request_seconds', 'Request latency by route, method and status.')
+metrics.describe('blex_http_sql_seconds', 'Time a request spent in SQL statements.')
+metrics.describe('blex_template_render_seconds', 'Template render time.')
+metrics.describe('blex_objects', 'Objects held in memory by this worker.')
+for kind, count in {
+    'users': lambda: len(repo.users),
+    'posts': lambda: len(repo.posts),
+    'messages': lambda: len(repo.message_store),
+    'products': lambda: len(repo.marketplace.products),
+    'jobs': lambda: len(repo.job_board.jobs),
+    'follow_edges': lambda: repo.graph.edge_count(),
+    'pending_changes': lambda: len(changes.pending) + len(changes.edges),
+}.items():
+    metrics.gauge('blex_objects', count, type=kind)
+metrics.gauge('blex_db_pool_connections', lambda: db_pool.open, state='open')
+metrics.gauge('blex_db_pool_connections', lambda: db_pool.idle.qsize(), state='idle')
+for name, source in (('db_pool', db_pool), ('change_feed', change_feed),
+                     ('media_pipeline', media_pipeline), ('media_store', media_store), ('journal', file_journal)):
+    for event in source.counters:
+        metrics.counter_fn(f'blex_{name}_events_total', lambda s=source, e=event: s.counters[e], event=event)
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    metrics.reset_sql_time()
+
+@app.after_request
+def record_request(resp):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = dict(route=route, method=request.method, status=resp.status_code)
+    metrics.observe('blex_http_request_seconds', time.perf_counter() - g.request_start, **labels)
+    metrics.observe('blex_http_sql_seconds', metrics.sql_time(), route=route)
+    return resp
+
+def template_started(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+def template_finished(sender, template, context, **extra):
+    if 'render_start' in g:
+        metrics.observe('blex_template_render_seconds', time.perf_counter() - g.render_start, template=template.name)
+
+before_render_template.connect(template_started, app)
+template_rendered.connect(template_finished, app)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    resp = make_response(metrics.render())
+    resp.mimetype = 'text/plain'
+    resp.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return resp
+
+# One pooled DB connection per request, checked out on first use
+@app.before_request
+def begin_db_scope():
+    db_pool.begin_scope()
+    # pick up writes made by other workers (throttled inside poll)
+    change_feed.poll(repo)
+
+@app.teardown_request
+def end_db_scope(exc):
+    db_pool.end_scope()
+
+# — HTTP caching —
+
+# hash-named media never change; legacy uploads may be replaced in place
+STATIC_MAX_AGE = {'/static/media/': 365 * 24 * 3600, '/static/uploads/': 7 * 24 * 3600}
+
+@app.after_request
+def static_cache_headers(resp):
+    for prefix, max_age in STATIC_MAX_AGE.items():
+        if request.path.startswith(prefix) and resp.status_code in (200, 304):
+            resp.cache_control.no_cache = None
+            resp.cache_control.public = True
+            resp.cache_control.max_age = max_age
+            if prefix == '/static/media/':
+                resp.cache_control.immutable = True
+    return resp
+
+def conditional_get(*collections):
+    # Answers 304 when the client's ETag still matches the data versions of
+    # `collections` for this user and URL; otherwise renders and tags the page.
+    # The nav shows the unread count, so messages always count.
+    names = collections + ('messages',)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            username = session.get('username')
+            if not username or session.get('_flashes'):
+                return view(*args, **kwargs)
+            # random listings reorder when the shuffle window rolls over
+            etag = repo.etag(names, username, request.full_path, shuffle_window())
+            if request.if_none_match.contains(etag):
+                resp = make_response('', 304)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag)
+            resp.cache_control.private = True
+            resp.cache_control.no_cache = True
+            return resp
+        return wrapper
+    return decorator
 
 # Context processors for templates
 @app.context_processor
 def inject_helpers():
+    username = session.get('username')
     return {
+        'unread_messages': repo.message_store.unread_count(username) if username else 0,
         'current_year': datetime.now().year,
-        'find_user': find_user,
-        'users': users
+        'find_user': repo.find_user
     }
 
 def current_user():
-    return find_user(users, session.get('username',''))
+    # find_user also resolves display names stored by older sessions
+    return repo.find_user(session.get('username',''))
 
 
 # — Registration, Login, Logout —
@@ -48,14 +195,15 @@ def register():
             request.form['password'],
             request.form['role']
         )
-        if username_exists(u):
+        if username_exists(u, repo):
             flash('Username taken.', 'danger')
         else:
             acc = Account(u,p,r)
             cls = ProfessionalUser if r=='professional' else RegisteredUser
-            user = cls(len(users)+1, name, '', '', acc)
-            users.append(user)
-            save_all(users, posts, messages, marketplace)
+            user = cls(id_allocator.next_id('users'), name, '', '', acc)
+            repo.add_user(user)
+            user.mark_new()
+            save_changes(repo)
             flash('Registered – please log in.', 'success')
             return redirect(url_for('login'))
     return render_template('register.html')
@@ -64,9 +212,10 @@ def register():
 def login():
     if request.method=='POST':
         u,p = request.form['username'], request.form['password']
-        user = find_user(users, u)
+        user = repo.find_user(u)
         if user and user.account.login(p):
-            session['username'] = u
+            # the session always holds the username, even when logging in by display name
+            session['username'] = user.account.username
             flash('Logged in.', 'success')
             return redirect(url_for('dashboard'))
         flash('Invalid credentials.', 'danger')
@@ -81,18 +230,13 @@ def logout():
 # — Dashboard — 
 
 @app.route('/dashboard')
+@conditional_get('posts', 'users')
 def dashboard():
     if 'username' not in session:
         return redirect(url_for('login'))
     user = current_user()
-    regular = [p for p in posts if isinstance(p, NormalPost)]
-    for p in regular:
-        p.likes = sum(isinstance(i, Like) for i in p.interactions)
-        p.comments = [
-            {'author': i.user.name, 'text': i.content}
-            for i in p.interactions if isinstance(i, Comment)
-        ]
-    return render_template('dashboard.html', user=user, posts=regular)
+    page, next_cursor = repo.feed_page(request.args.get('cursor'), FEED_PAGE_SIZE)
+    return render_template('dashboard.html', user=user, posts=page, next_cursor=next_cursor)
 
 # — Create Post — 
 
@@ -104,20 +248,16 @@ def create_post():
         cap = request.form['caption']
         f   = request.files.get('media')
         if f and f.filename:
-            up = os.path.join(app.static_folder,'uploads')
-            os.makedirs(up, exist_ok=True)
-            fn = secure_filename(f.filename)
-            f.save(os.path.join(up,fn))
-            murl = url_for('static', filename=f'uploads/{fn}')
-            mtype = 'image' if f.mimetype.startswith('image') else 'video'
-            media = Media(None, mtype, murl)
+            media = save_upload(f)
+            if media is None:
+                return redirect(url_for('create_post'))
         else:
             media = Media(None,'','')
         author = current_user()
-        nid = max([p.post_id for p in posts]+[0]) + 1
-        new = NormalPost(cap, media, author, post_id=nid)
-        posts.append(new)
-        save_all(users, posts, messages, marketplace)
+        new = NormalPost(cap, media, author, id_allocator.next_id('posts'))
+        repo.add_post(new)
+        new.mark_new()
+        save_changes(repo)
         flash('Post created.', 'success')
         return redirect(url_for('dashboard'))
     return render_template('create_post.html', user=current_user())
@@ -128,36 +268,64 @@ def create_post():
 def like_post(post_id):
     if 'username' not in session:
         return redirect(url_for('login'))
-    post = next((p for p in posts if p.post_id==post_id), None)
+    post = repo.get_post(post_id)
     if post:
         user = current_user()
         user.like_post(post)          # uses User.like_post(...) :contentReference[oaicite:2]{index=2}
-        save_all(users, posts, messages, marketplace)
+        save_changes(repo)
     return redirect(url_for('dashboard'))
 
 @app.route('/post/<int:post_id>/comment', methods=['POST'])
 def comment_post(post_id):
     if 'username' not in session:
         return redirect(url_for('login'))
-    post = next((p for p in posts if p.post_id==post_id), None)
+    post = repo.get_post(post_id)
     if post:
         text = request.form['comment']
         user = current_user()
         user.comment_on_post(post, text)  # uses User.comment_on_post(...) :contentReference[oaicite:3]{index=3}
-        save_all(users, posts, messages, marketplace)
+        save_changes(repo)
     return redirect(url_for('dashboard'))
 
 @app.route('/marketplace')
+@conditional_get('market', 'users')
 def marketplace_list():
     if 'username' not in session:
         return redirect(url_for('login'))
     user = current_user()
     q    = request.args.get('q','').lower()
-    items = marketplace.products[:]
-    if q:
-        items = [i for i in items if q in i.product_name.lower() or q in i.description.lower()]
-    random.shuffle(items)
-    return render_template('marketplace.html', user=user, items=items, search_query=q)
+    min_price = price_arg('min_price')
+    max_price = price_arg('max_price')
+    sort = request.args.get('sort', '')
+    if sort not in MARKET_SORTS:
+        sort = ''
+    page = page_arg()
+    items = repo.marketplace.query(q, min_price, max_price, sort)
+    if items is None:
+        items, has_more = shuffled_page(repo.marketplace.products, session_seed(), page, SHUFFLE_PAGE_SIZE)
+    else:
+        start = (page - 1) * SHUFFLE_PAGE_SIZE
+        has_more = len(items) > start + SHUFFLE_PAGE_SIZE
+        items = items[start:start + SHUFFLE_PAGE_SIZE]
+    # the pager links keep the search
+    filters = {k: request.args[k] for k in ('q', 'min_price', 'max_price', 'sort') if request.args.get(k)}
+    return render_template(
+        'marketplace.html', user=user, items=items, search_query=q,
+        min_price=request.args.get('min_price', ''), max_price=request.args.get('max_price', ''), sort=sort,
+        page=page, has_more=has_more, filters=filters
+    )
+
+def session_seed():
+    # one random order per session and shuffle window, stable across pages
+    if 'shuffle_seed' not in session:
+        session['shuffle_seed'] = random.getrandbits(32)
+    return shuffle_seed(session['shuffle_seed'])
+
+def price_arg(name):
+    try:
+        return float(request.args.get(name, ''))
+    except ValueError:
+        return None
 
 @app.route('/create-market-item', methods=['GET','POST'])
 def create_market_item():
@@ -171,35 +339,35 @@ def create_market_item():
         )
         f = request.files.get('image')
         if f and f.filename:
-            up = os.path.join(app.static_folder, 'uploads/marketplace')
-            os.makedirs(up, exist_ok=True)
-            fn = secure_filename(f.filename)
-            f.save(os.path.join(up, fn))
-            url = url_for('static', filename=f'uploads/marketplace/{fn}')
-            media = Media(None, 'image', url)
+            media = save_upload(f, 'image')
+            if media is None:
+                return redirect(url_for('create_market_item'))
         else:
             media = Media(None, '', '')
         author = current_user()
-        nid = max([p.post_id for p in posts]+[0]) + 1
-        item = ProductPost(name, price, desc, media, author, post_id=nid)
-        posts.append(item)
-        marketplace.add_product(item)
-        save_all(users, posts, messages, marketplace)
+        item = ProductPost(name, price, desc, media, author, id_allocator.next_id('posts'))
+        repo.add_post(item)
+        item.mark_new()
+        repo.marketplace.add_product(item)
+        save_changes(repo)
         flash('Listing added.', 'success')
         return redirect(url_for('marketplace_list'))
     return render_template('create_marketplace.html', user=current_user())
 
 @app.route('/jobs')
+@conditional_get('jobs', 'users')
 def jobs_list():
     if 'username' not in session:
         return redirect(url_for('login'))
     user = current_user()
     q = request.args.get('q','').lower()
-    job_posts = [p for p in posts if isinstance(p, JobPost)]
+    page, has_more = 1, False
     if q:
-        job_posts = [j for j in job_posts if q in j.job_title.lower() or q in j.company.lower()]
-    random.shuffle(job_posts)
-    return render_template('jobs.html', user=user, jobs=job_posts, search_query=q)
+        job_posts = repo.job_board.search(q)
+    else:
+        page = page_arg()
+        job_posts, has_more = shuffled_page(repo.job_board.jobs, session_seed(), page, SHUFFLE_PAGE_SIZE)
+    return render_template('jobs.html', user=user, jobs=job_posts, search_query=q, page=page, has_more=has_more)
 
 @app.route('/create-job', methods=['GET','POST'])
 def create_job():
@@ -217,18 +385,15 @@ def create_job():
         )
         f = request.files.get('media')
         if f and f.filename:
-            up = os.path.join(app.static_folder, 'uploads/jobs')
-            os.makedirs(up, exist_ok=True)
-            fn = secure_filename(f.filename)
-            f.save(os.path.join(up, fn))
-            url = url_for('static', filename=f'uploads/jobs/{fn}')
-            media = Media(None, 'image', url)
+            media = save_upload(f, 'image')
+            if media is None:
+                return redirect(url_for('create_job'))
         else:
             media = Media(None, '', '')
-        nid = max([p.post_id for p in posts]+[0]) + 1
-        job = JobPost(title, comp, reqs, media, user, post_id=nid)
-        posts.append(job)
-        save_all(users, posts, messages, marketplace)
+        job = JobPost(title, comp, reqs, media, user, id_allocator.next_id('posts'))
+        repo.add_post(job)
+        job.mark_new()
+        save_changes(repo)
         flash('Job posted.', 'success')
         return redirect(url_for('jobs_list'))
     return render_template('create_job.html', user=user)
@@ -238,47 +403,75 @@ def inbox():
     if 'username' not in session:
         return redirect(url_for('login'))
     user = current_user()
-    inbox_msgs = [m for m in messages if m.receiver==user]
-    return render_template('inbox.html', user=user, messages=inbox_msgs)
+    store = repo.message_store
+    username = user.account.username
+    unread = store.unread_count(username)
+    inbox_msgs, next_cursor = store.inbox(username, request.args.get('cursor'), MESSAGE_PAGE_SIZE)
+    if not request.args.get('cursor') and unread:
+        store.mark_read(username)
+        save_changes(repo)
+    return render_template('inbox.html', user=user, messages=inbox_msgs, unread=unread, next_cursor=next_cursor)
+
+@app.route('/messages/with/<username>')
+def conversation(username):
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    user = current_user()
+    other = repo.get_user(username)
+    if not other:
+        flash('User not found.', 'danger')
+        return redirect(url_for('inbox'))
+    thread, next_cursor = repo.message_store.conversation(
+        user.account.username, other.account.username, request.args.get('cursor'), MESSAGE_PAGE_SIZE
+    )
+    return render_template('conversation.html', user=user, other=other, messages=thread, next_cursor=next_cursor)
 
 @app.route('/messages/send', methods=['GET','POST'])
 def send_message():
     if 'username' not in session:
         return redirect(url_for('login'))
     user = current_user()
-    others = [u.account.username for u in users if u.account.username!=user.account.username]
+    # only a page of suggestions; any username can still be typed in
+    q = request.args.get('q','').strip()
+    suggestions, _ = repo.user_search.search(q, exclude=user.account.username)
     if request.method=='POST':
         to = request.form['to_username']
         txt = request.form['content']
-        rec = find_user(users, to)
+        rec = repo.find_user(to)
         if rec:
-            msg = Message(user, rec, txt)
-            messages.append(msg)
-            save_all(users, posts, messages, marketplace)
+            msg = Message(id_allocator.next_id('messages'), user, rec, txt)
+            repo.add_message(msg)
+            msg.mark_new()
+            save_changes(repo)
             flash('Message sent.', 'success')
             return redirect(url_for('inbox'))
         flash('Recipient not found.', 'danger')
-    return render_template('send_message.html', user=user, users=others)
+    return render_template(
+        'send_message.html', user=user, users=[u.account.username for u in suggestions],
+        to=request.args.get('to', ''), query=q
+    )
 
 @app.route('/user/<username>')
+@conditional_get('users', 'posts', 'graph')
 def profile(username):
     if 'username' not in session:
         return redirect(url_for('login'))
     current = current_user()
-    prof = find_user(users, username)
+    prof = repo.find_user(username)
     if not prof:
         flash('User not found.', 'danger')
         return redirect(url_for('dashboard'))
-    is_following = username in current.following
-    return render_template('profile.html', current=current, profile=prof, is_following=is_following)
+    is_following = repo.graph.is_following(current.account.username, prof.account.username)
+    return render_template('profile.html', current=current, profile=prof, is_following=is_following,
+                           likes_received=repo.likes_received(prof))
 
 @app.route('/user/<username>/follow', methods=['POST'])
 def follow(username):
     if 'username' not in session:
         return redirect(url_for('login'))
     user = current_user()
-    user.follow(username, users)
-    save_all(users, posts, messages, marketplace)
+    user.follow(username, repo)
+    save_changes(repo)
     return redirect(url_for('profile', username=username))
 
 @app.route('/user/<username>/unfollow', methods=['POST'])
@@ -286,8 +479,8 @@ def unfollow(username):
     if 'username' not in session:
         return redirect(url_for('login'))
     user = current_user()
-    user.unfollow(username, users)
-    save_all(users, posts, messages, marketplace)
+    user.unfollow(username, repo)
+    save_changes(repo)
     return redirect(url_for('profile', username=username))
 
 @app.route('/search-users')
@@ -296,19 +489,26 @@ def search_users():
         return redirect(url_for('login'))
     current = current_user()
     q = request.args.get('q','').strip()
-    if q:
-        matched = [u for u in users if q.lower() in u.name.lower()]
-    else:
-        matched = users
-    # exclude self
-    matched = [u for u in matched if u.account.username != current.account.username]
+    page = page_arg()
+    matched, has_more = repo.user_search.search(
+        q, limit=USER_SEARCH_LIMIT, offset=(page - 1) * USER_SEARCH_LIMIT,
+        exclude=current.account.username
+    )
     return render_template(
         'search_users.html',
         user=current,
         matched=matched,
-        query=q
+        query=q,
+        page=page,
+        has_more=has_more
     )
 
+def page_arg():
+    try:
+        return max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        return 1
+
 
 if __name__ == '__main__':
     app.run(debug=True)
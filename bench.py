@@ -0,0 +1,483 @@
+# bench.py
+# Benchmarks for the core data paths on seeded synthetic data. MySQL is
+# replaced by MemoryDB, an in-process stand-in that understands the SQL
+# finalcode.py sends, so runs need no server and are repeatable.
+#
+#   python bench.py --scale 10000
+#   python bench.py --scale 100000 --out new.json --compare bench_results.json
+#
+# Results are written as JSON (median/min seconds per benchmark); --compare
+# prints the ratio against an earlier file and exits 1 on regressions.
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import finalcode as fc
+
+# ===== Stand-in store =====
+WHERE_RE = re.compile(r"(\w+)\s*=\s*%s")
+IN_RE = re.compile(r"(\w+) IN \(([^)]*)\)")
+UPSERT_KEYS = {"users": "username", "id_sequences": "name", "message_reads": "username"}
+
+class MemoryCursor:
+    def __init__(self, db, dictionary=False):
+        self.db = db
+        self.dictionary = dictionary
+        self.rows = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=()):
+        sql = " ".join(sql.split())
+        params = list(params or ())
+        self.rows = []
+        handler = next((h for prefix, h in self.db.handlers if sql.startswith(prefix)), None)
+        if handler is None:
+            raise NotImplementedError(sql)
+        handler(self, sql, params)
+
+    def fetchall(self):
+        if self.dictionary:
+            return self.rows
+        return [tuple(r.values()) if isinstance(r, dict) else r for r in self.rows]
+
+    def fetchone(self):
+        rows = self.fetchall()
+        return rows[0] if rows else None
+
+    def close(self):
+        pass
+
+class MemoryDB:
+    # One shared set of tables; connect() hands out connection objects that
+    # all see it (no transactions, commit/rollback are no-ops).
+    def __init__(self):
+        self.tables = {}
+        self.last_insert_id = 0
+        self.statements = 0
+        self.handlers = [
+            ("CREATE TABLE", lambda c, s, p: None),
+            ("ALTER TABLE", lambda c, s, p: None),
+            ("SELECT * FROM", self.select_all),
+            ("SELECT COUNT(*) FROM", self.select_count),
+            ("SELECT COALESCE(MAX(change_id), 0)", lambda c, s, p: setattr(c, "rows", [(0,)])),
+            ("SELECT change_id", lambda c, s, p: None),
+            ("SELECT LAST_INSERT_ID()", lambda c, s, p: setattr(c, "rows", [(self.last_insert_id,)])),
+            ("SELECT", self.select_columns),
+            ("INSERT INTO", self.insert),
+            ("UPDATE id_sequences", self.lease),
+            ("UPDATE", self.update),
+            ("DELETE FROM", self.delete),
+        ]
+
+    def connect(self):
+        return MemoryConnection(self)
+
+    def table(self, name):
+        return self.tables.setdefault(name, [])
+
+    def matcher(self, sql, params):
+        # "a=%s AND b=%s" / "a=%s OR b=%s" / "a IN (%s, ...)"; anything else
+        # matches every row
+        if " WHERE " not in sql:
+            return lambda row: True
+        where = sql.split(" WHERE ", 1)[1]
+        m = IN_RE.search(where)
+        if m:
+            col, values = m.group(1), set(params[-m.group(2).count("%s"):])
+            return lambda row: row.get(col) in values
+        cols = WHERE_RE.findall(where)
+        values = params[-len(cols):] if cols else []
+        if not cols:
+            return lambda row: False
+        pairs = list(zip(cols, values))
+        if " OR " in where:
+            return lambda row: any(row.get(c) == v for c, v in pairs)
+        return lambda row: all(row.get(c) == v for c, v in pairs)
+
+    def select_all(self, cursor, sql, params):
+        name = sql.split()[3]
+        match = self.matcher(sql, params)
+        cursor.rows = [dict(r) for r in self.table(name) if match(r)]
+
+    def select_columns(self, cursor, sql, params):
+        m = re.match(r"SELECT (?:DISTINCT )?(.+?) FROM (\w+)", sql)
+        cols = [c.strip() for c in m.group(1).split(",")]
+        match = self.matcher(sql, params)
+        cursor.rows = [{c: r.get(c) for c in cols} for r in self.table(m.group(2)) if match(r)]
+
+    def select_count(self, cursor, sql, params):
+        name = sql.split()[3]
+        match = self.matcher(sql, params)
+        cursor.rows = [(sum(1 for r in self.table(name) if match(r)),)]
+
+    def insert(self, cursor, sql, params):
+        m = re.match(r"INSERT INTO (\w+) \(([^)]*)\)", sql)
+        name, cols = m.group(1), [c.strip() for c in m.group(2).split(",")]
+        rows = self.table(name)
+        key = UPSERT_KEYS.get(name) if "ON DUPLICATE KEY" in sql else None
+        index = {r[key]: r for r in rows} if key else None
+        for i in range(0, len(params), len(cols)):
+            row = dict(zip(cols, params[i:i + len(cols)]))
+            if index is not None and row[key] in index:
+                old = index[row[key]]
+                if name == "id_sequences":
+                    old["next_id"] = max(old["next_id"], row["next_id"])
+                else:
+                    old.update(row)
+                continue
+            rows.append(row)
+            if index is not None:
+                index[row[key]] = row
+        cursor.rowcount = len(params) // len(cols)
+
+    def lease(self, cursor, sql, params):
+        step, name = params
+        for row in self.table("id_sequences"):
+            if row["name"] == name:
+                row["next_id"] += step
+                self.last_insert_id = row["next_id"]
+
+    def update(self, cursor, sql, params):
+        m = re.match(r"UPDATE (\w+) SET (.+?) WHERE", sql)
+        cols = WHERE_RE.findall(m.group(2))
+        match = self.matcher(sql, params)
+        for row in self.table(m.group(1)):
+            if match(row):
+                row.update(zip(cols, params[:len(cols)]))
+
+    def delete(self, cursor, sql, params):
+        name = sql.split()[2]
+        match = self.matcher(sql, params)
+        self.tables[name] = [r for r in self.table(name) if not match(r)]
+
+class MemoryConnection:
+    in_transaction = False
+
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, dictionary=False, **kwargs):
+        self.db.statements += 1
+        return MemoryCursor(self.db, dictionary)
+
+    def start_transaction(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def reconnect(self, attempts=1, delay=0):
+        pass
+
+    def close(self):
+        pass
+
+# ===== Synthetic data =====
+WORDS = ("bike", "laptop", "desk", "chair", "phone", "camera", "guitar", "lamp", "shoes", "jacket",
+         "python", "java", "design", "sales", "remote", "senior", "junior", "data", "cloud", "mobile",
+         "vintage", "new", "used", "red", "blue", "wooden", "steel", "fast", "quiet", "compact")
+FIRST = ("mazen", "rami", "sara", "lina", "omar", "nour", "ali", "maya", "karim", "yara", "zaid", "dana")
+LAST = ("haddad", "khoury", "saleh", "nasser", "aziz", "farah", "hawli", "issa")
+
+# share of `scale` rows per table
+MIX = {"users": 0.05, "posts": 0.20, "likes": 0.30, "comments": 0.15, "followers": 0.15, "messages": 0.15}
+
+def phrase(rnd, n):
+    return " ".join(rnd.choice(WORDS) for _ in range(n))
+
+def generate(scale, seed):
+    # Builds a Repository with about `scale` rows in total, same data for the
+    # same (scale, seed).
+    rnd = random.Random(seed)
+    counts = {table: max(10, int(scale * share)) for table, share in MIX.items()}
+    start = datetime(2024, 1, 1)
+    span = 365 * 24 * 3600
+    repo = fc.Repository()
+    pw_hash = fc.Account("bench", "bench", "regular").hash_password("bench")
+
+    users = []
+    for i in range(counts["users"]):
+        first, last = rnd.choice(FIRST), rnd.choice(LAST)
+        role = "professional" if rnd.random() < 0.3 else "regular"
+        acc = fc.Account(f"{first}{i}", "", role, password_hash=pw_hash)
+        cls = fc.ProfessionalUser if role == "professional" else fc.RegisteredUser
+        user = cls(i + 1, f"{first.title()} {last.title()}", phrase(rnd, 4), "", acc)
+        repo.add_user(user)
+        users.append(user)
+    pros = [u for u in users if u.account.role == "professional"] or users
+
+    posts = []
+    for i in range(counts["posts"]):
+        ts = start + timedelta(seconds=rnd.randrange(span))
+        media = fc.Media(None, "", "")
+        kind = rnd.random()
+        if kind < 0.60:
+            post = fc.NormalPost(phrase(rnd, 8), media, rnd.choice(users), post_id=i + 1, timestamp=ts)
+        elif kind < 0.85:
+            post = fc.ProductPost(phrase(rnd, 2), round(rnd.uniform(1, 2000), 2), phrase(rnd, 10), media,
+                                  rnd.choice(pros), post_id=i + 1, timestamp=ts)
+        else:
+            post = fc.JobPost(phrase(rnd, 2), rnd.choice(LAST).title() + " Inc", phrase(rnd, 6), media,
+                              rnd.choice(pros), post_id=i + 1, timestamp=ts)
+        repo.add_post(post)
+        if isinstance(post, fc.ProductPost):
+            repo.marketplace.add_product(post)
+        posts.append(post)
+
+    for _ in range(counts["likes"]):
+        post = rnd.choice(posts)
+        post.add_like(fc.Like(rnd.choice(users), post, timestamp=post.timestamp + timedelta(minutes=rnd.randrange(600))))
+    for _ in range(counts["comments"]):
+        post = rnd.choice(posts)
+        post.add_comment(fc.Comment(rnd.choice(users), post, phrase(rnd, 6),
+                                    timestamp=post.timestamp + timedelta(minutes=rnd.randrange(600))))
+    for _ in range(counts["followers"]):
+        a, b = rnd.choice(users), rnd.choice(users)
+        repo.graph.follow(a.account.username, b.account.username)
+    for _ in range(counts["messages"]):
+        a, b = rnd.choice(users), rnd.choice(users)
+        repo.add_message(fc.Message(fc.id_allocator.next_id("messages"), a, b, phrase(rnd, 7), timestamp=start + timedelta(seconds=rnd.randrange(span))))
+    fc.changes.reset()
+    return repo
+
+# ===== Timing =====
+def timed(results, name, fn, repeat, ops=1):
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    results[name] = {
+        "median": statistics.median(runs),
+        "min": min(runs),
+        "runs": runs,
+        "ops": ops,
+    }
+    per_op = results[name]["median"] / ops
+    print(f"  {name:<34} {results[name]['median'] * 1000:10.2f} ms  ({per_op * 1e6:9.1f} us/op, {ops} ops)")
+
+def load_text_files():
+    repo = fc.Repository(users=fc.load_users_file())
+    for p in fc.load_posts_file(repo):
+        repo.add_post(p)
+    fc.load_followers_file(repo)
+    return repo
+
+def bench_store(results, repo, repeat):
+    print("store")
+    timed(results, "save_all", lambda: fc.save_all(repo), repeat)
+    timed(results, "load_all.serial", lambda: fc.load_all(parallel=False), repeat)
+    timed(results, "load_all.parallel", lambda: fc.load_all(parallel=True), repeat)
+
+    timed(results, "snapshot.write", lambda: fc.write_snapshot(repo, "bench.snap"), repeat)
+    timed(results, "snapshot.load", lambda: fc.load_snapshot("bench.snap"), repeat)
+    os.remove("bench.snap")
+    # the pipe-separated text files older versions kept, for comparison
+    fc.save_users_file(repo.users)
+    fc.save_posts_file(repo.posts)
+    fc.save_followers_file(repo.graph)
+    timed(results, "text_files.load", lambda: load_text_files(), repeat)
+    for name in ("users.txt", "posts.txt", "followers.txt"):
+        os.remove(name)
+    bench_journal(results, repo, repeat)
+
+    rows = fc.fetch_tables(False, {})
+    timed(results, "load_users_db", lambda: fc.load_users_db(rows["users"]), repeat, len(rows["users"]))
+    loaded = fc.Repository(users=fc.load_users_db(rows["users"]))
+    timed(results, "load_posts_db", lambda: fc.load_posts_db(loaded, rows["posts"]), repeat, len(rows["posts"]))
+    for p in fc.load_posts_db(loaded, rows["posts"]):
+        loaded.add_post(p)
+    timed(results, "load_messages_db", lambda: fc.load_messages_db(loaded, rows["messages"]), repeat, len(rows["messages"]))
+    timed(results, "load_followers_db", lambda: fc.load_followers_db(loaded, rows["followers"]), repeat, len(rows["followers"]))
+    timed(results, "load_likes_db", lambda: fc.load_likes_db(loaded, rows["likes"]), repeat, len(rows["likes"]))
+    timed(results, "load_comments_db", lambda: fc.load_comments_db(loaded, rows["comments"]), repeat, len(rows["comments"]))
+    timed(results, "load_marketplace_db", lambda: fc.load_marketplace_db(loaded.posts, rows["marketplace"]),
+          repeat, len(rows["marketplace"]))
+
+def bench_journal(results, repo, repeat):
+    # one save_changes() worth of journal appends vs the old full file rewrite
+    journal = fc.Journal("bench.journal", "bench.base", fsync_interval=0.5, compact_bytes=1 << 40)
+    users = repo.users[:1000]
+    entries = [("user", "upsert", dict(zip(fc.USER_COLUMNS, fc.user_row(u)))) for u in users]
+    timed(results, "journal.append", lambda: [journal.append([e]) for e in entries], repeat, len(entries))
+    timed(results, "text_files.rewrite", lambda: (fc.save_users_file(repo.users, "bench.users.txt"),
+                                                  fc.save_posts_file(repo.posts, "bench.posts.txt"),
+                                                  fc.save_followers_file(repo.graph, "bench.followers.txt")), repeat)
+    # folding needs a base; every run after the first would find nothing to fold
+    fc.write_snapshot(repo, "bench.base")
+    timed(results, "journal.compact", journal.compact, 1, len(entries) * repeat)
+    journal.close()
+    for name in ["bench.base", "bench.users.txt", "bench.posts.txt", "bench.followers.txt",
+                 "bench.journal.lock", "bench.journal.compact"] + journal.segments():
+        if os.path.exists(name):
+            os.remove(name)
+
+def bench_lookups(results, repo, repeat, seed):
+    print("lookups")
+    rnd = random.Random(seed)
+    names = [rnd.choice(repo.users).account.username for _ in range(2000)]
+    few = names[:100]   # the list-scanning helper is O(n) per call
+    timed(results, "find_user.scan", lambda: [fc.find_user(repo.users, n) for n in few], repeat, len(few))
+    timed(results, "find_user.indexed", lambda: [repo.find_user(n) for n in names], repeat, len(names))
+
+    market = repo.marketplace
+    keywords = [phrase(rnd, rnd.choice((1, 2))) for _ in range(500)]
+    prefixes = [rnd.choice(WORDS)[:3] for _ in range(500)]
+    ranges = [sorted((rnd.uniform(1, 2000), rnd.uniform(1, 2000))) for _ in range(500)]
+    timed(results, "marketplace.search_by_keyword",
+          lambda: [market.search_by_keyword(k, 20) for k in keywords], repeat, len(keywords))
+    timed(results, "marketplace.search_by_prefix",
+          lambda: [market.search_by_keyword(k, 20) for k in prefixes], repeat, len(prefixes))
+    timed(results, "marketplace.filter_by_price",
+          lambda: [market.filter_by_price(lo, hi) for lo, hi in ranges], repeat, len(ranges))
+
+    store = repo.interactions
+    sample = [rnd.choice(repo.posts) for _ in range(2000)]
+    timed(results, "interactions.has_liked",
+          lambda: [p.has_liked(repo.users[i % len(repo.users)]) for i, p in enumerate(sample)], repeat, len(sample))
+    timed(results, "interactions.like_counts", store.like_counts, repeat, len(store.likes))
+    timed(results, "interactions.top_liked", lambda: store.top_liked(20), repeat)
+    timed(results, "interactions.likes_by_author", repo.likes_by_author, repeat, len(store.likes))
+
+    # the dataset spreads likes evenly; a viral post puts them all on one chain
+    user_ids = [u.user_id for u in repo.users]
+    now = datetime.now()
+    hot = fc.InteractionStore()
+    def load_hot():
+        hot.clear_likes()
+        for user_id in user_ids:
+            hot.add_like(1, user_id, now)
+    timed(results, "interactions.load_likes.hot", load_hot, repeat, len(user_ids))
+    checks = [rnd.choice(user_ids) for _ in range(2000)]
+    timed(results, "interactions.has_liked.hot",
+          lambda: [hot.has_like(1, user_id) for user_id in checks], repeat, len(checks))
+    timed(results, "interactions.unlike_relike.hot",
+          lambda: [hot.remove_like(1, user_id) and hot.add_like(1, user_id, now) for user_id in checks[:500]],
+          repeat, 500)
+
+def bench_http(results, repeat, seed, requests_per_route):
+    print("http")
+    import app as web   # loads its own repo from the stand-in store
+    rnd = random.Random(seed)
+    store = web.repo.message_store
+    user = max(web.repo.users, key=lambda u: len(store.by_receiver.get(u.account.username, fc.MessageList()).keys))
+    client = web.app.test_client()
+    with client.session_transaction() as sess:
+        sess["username"] = user.account.username
+    queries = [rnd.choice(FIRST)[:3] for _ in range(requests_per_route)]
+    routes = {
+        "/dashboard": lambda i: "/dashboard",
+        "/marketplace": lambda i: "/marketplace",
+        "/jobs": lambda i: "/jobs",
+        "/inbox": lambda i: "/inbox",
+        "/search-users": lambda i: f"/search-users?q={queries[i]}",
+    }
+    for route, url in routes.items():
+        def run():
+            for i in range(requests_per_route):
+                resp = client.get(url(i))
+                if resp.status_code != 200:
+                    raise RuntimeError(f"{route}: HTTP {resp.status_code}")
+        timed(results, f"http{route}", run, repeat, requests_per_route)
+
+# ===== Comparison =====
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline["meta"]["scale"] != results["meta"]["scale"]:
+        print(f"warning: baseline scale {baseline['meta']['scale']} != {results['meta']['scale']}")
+    print(f"\n{'benchmark':<36}{'before':>12}{'after':>12}{'ratio':>8}")
+    regressions = []
+    for name, now in results["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if not before:
+            continue
+        ratio = now["median"] / before["median"] if before["median"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"{name:<36}{before['median'] * 1000:10.2f}ms{now['median'] * 1000:10.2f}ms{ratio:8.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Blex data path benchmarks")
+    parser.add_argument("--scale", type=int, default=10000, help="approximate total rows (10k .. 1M)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=20, help="requests per route in the HTTP benchmarks")
+    parser.add_argument("--only", choices=("store", "lookups", "http"), action="append")
+    parser.add_argument("--footprint", action="store_true", help="report memory per entity type for the dataset")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown before flagging (0.2 = 20%%)")
+    args = parser.parse_args()
+    out = os.path.abspath(args.out)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    db = MemoryDB()
+    fc.get_db_connection = db.connect
+    # save_all/load_all also write and read the flat files in the cwd
+    os.chdir(tempfile.mkdtemp(prefix="blex-bench-"))
+
+    t0 = time.perf_counter()
+    repo = generate(args.scale, args.seed)
+    print(f"generated {args.scale} rows (seed {args.seed}) in {time.perf_counter() - t0:.1f}s")
+    fc.save_all(repo)
+
+    footprint = None
+    if args.footprint:
+        report = fc.memory_footprint(repo)
+        fc.print_footprint(report)
+        footprint = {name: {"objects": count, "bytes": size} for name, (count, size) in report.items()}
+
+    benchmarks = {}
+    only = args.only or ("store", "lookups", "http")
+    if "store" in only:
+        bench_store(benchmarks, repo, args.repeat)
+    if "lookups" in only:
+        bench_lookups(benchmarks, repo, args.repeat, args.seed)
+    if "http" in only:
+        bench_http(benchmarks, args.repeat, args.seed, args.requests)
+
+    results = {
+        "meta": {
+            "scale": args.scale,
+            "seed": args.seed,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": datetime.now().isoformat(timespec="seconds"),
+        },
+        "benchmarks": benchmarks,
+    }
+    if footprint:
+        results["footprint"] = footprint
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nwrote {out}")
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
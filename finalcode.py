@@ -2,8 +2,202 @@ import mysql.connector
 from datetime import datetime, timedelta
 from abc import ABC, abstractmethod
 import os
+import sys
 import hashlib# import hashlib for secure hashing
 import random
+import threading
+import queue
+import time
+import bisect
+import heapq
+import re
+import math
+import json
+import gc
+import glob
+import atexit
+import logging
+import struct
+import zlib
+import mmap
+import socket
+from array import array
+from collections import Counter
+from itertools import islice
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps  # optional: resized media variants
+except ImportError:
+    Image = None
+
+try:
+    import fcntl  # optional: journal locking between processes
+except ImportError:
+    fcntl = None
+
+# ===== Metrics =====
+# In-process latency histograms, counters and gauges, rendered in the
+# Prometheus text format (app.py serves them at /metrics). Every SQL
+# statement on a pooled connection, every persistence phase and every web
+# request is timed.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?: IF NOT EXISTS)?)\s+(\w+)", re.IGNORECASE)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.counts):
+            self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}   # name -> {labels: Histogram}
+        self.counters = {}     # name -> {labels: value}
+        self.callbacks = {}    # name -> (type, {labels: callable}), read at scrape time
+        self.help = {}         # name -> help text
+        self.local = threading.local()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def gauge(self, name, fn, **labels):
+        self.callbacks.setdefault(name, ("gauge", {}))[1][tuple(sorted(labels.items()))] = fn
+
+    def counter_fn(self, name, fn, **labels):
+        # a counter kept elsewhere (e.g. ConnectionPool.counters)
+        self.callbacks.setdefault(name, ("counter", {}))[1][tuple(sorted(labels.items()))] = fn
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    # time spent in SQL by the current thread, for per-request breakdowns
+    def reset_sql_time(self):
+        self.local.sql_time = 0.0
+
+    def sql_time(self):
+        return getattr(self.local, "sql_time", 0.0)
+
+    def add_sql_time(self, seconds):
+        self.local.sql_time = self.sql_time() + seconds
+
+    def render(self):
+        lines = []
+
+        def head(name, kind):
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self.lock:
+            histograms = {n: {k: (list(h.counts), h.sum, h.count, h.buckets) for k, h in s.items()}
+                          for n, s in self.histograms.items()}
+            counters = {n: dict(s) for n, s in self.counters.items()}
+        for name in sorted(histograms):
+            head(name, "histogram")
+            for key, (counts, total, count, buckets) in sorted(histograms[name].items()):
+                running = 0
+                for bound, n in zip(buckets, counts):
+                    running += n
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', repr(bound)),))} {running}")
+                lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{format_labels(key)} {total!r}")
+                lines.append(f"{name}_count{format_labels(key)} {count}")
+        for name in sorted(counters):
+            head(name, "counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{format_labels(key)} {value}")
+        for name in sorted(self.callbacks):
+            kind, series = self.callbacks[name]
+            head(name, kind)
+            for key, fn in sorted(series.items()):
+                try:
+                    value = fn()
+                except Exception:
+                    continue
+                lines.append(f"{name}{format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(key):
+    if not key:
+        return ""
+    def escape(v):
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in key) + "}"
+
+metrics = Metrics()
+metrics.describe("blex_sql_seconds", "SQL statement latency by statement type and table.")
+metrics.describe("blex_persistence_seconds", "Duration of load/save phases.")
+
+def sql_labels(sql):
+    words = sql.split(None, 1)
+    match = SQL_TABLE_RE.search(sql)
+    return {"statement": words[0].lower() if words else "", "table": match.group(1).lower() if match else ""}
+
+class TimedCursor:
+    # wraps a DB-API cursor; only execute/executemany are timed
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def _timed(self, method, sql, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(sql, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe("blex_sql_seconds", elapsed, **sql_labels(sql))
+            metrics.add_sql_time(elapsed)
+
+    def execute(self, sql, *args, **kwargs):
+        return self._timed(self.cursor.execute, sql, *args, **kwargs)
+
+    def executemany(self, sql, *args, **kwargs):
+        return self._timed(self.cursor.executemany, sql, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+class TimedConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self.conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
 
 # ===== MySQL Connection =====
 DB_CONFIG = {
@@ -13,28 +207,353 @@ DB_CONFIG = {
     "database": "socialmediadb"
 }
 
+DB_POOL_SIZE = int(os.environ.get("BLEX_DB_POOL_SIZE", "5"))
+DB_POOL_TIMEOUT = 30  # seconds to wait for a free connection
+DB_BATCH_SIZE = int(os.environ.get("BLEX_DB_BATCH_SIZE", "1000"))  # rows per multi-row INSERT
+ID_BLOCK_SIZE = int(os.environ.get("BLEX_ID_BLOCK_SIZE", "50"))  # ids leased per trip to the DB
+# BLEX_BACKEND=files keeps everything in the flat files (a base snapshot plus
+# the journal) and never connects to MySQL; the default is the database
+FILES_BACKEND = os.environ.get("BLEX_BACKEND", "mysql") == "files"
+
 def get_db_connection():
     return mysql.connector.connect(**DB_CONFIG)
 
-def username_exists(username):
-    db = get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("SELECT COUNT(*) FROM users WHERE username = %s", (username,))
-    exists = cursor.fetchone()[0] > 0
-    db.close()
+class ConnectionPool:
+    # Keeps up to `size` open connections. A thread keeps the connection it
+    # checked out until its outermost connection()/scope() block ends, so all
+    # helpers called during one request or unit of work share one connection.
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.open = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {"checkouts": 0, "reuses": 0, "waits": 0, "reconnects": 0, "discarded": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _new_connection(self):
+        with self.lock:
+            if self.open >= self.size:
+                return None
+            self.open += 1
+        try:
+            return TimedConnection(get_db_connection())
+        except Exception:
+            with self.lock:
+                self.open -= 1
+            raise
+
+    def _checkout(self):
+        self._count("checkouts")
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = self._new_connection()
+                if conn is not None:
+                    return conn
+                self._count("waits")
+                try:
+                    conn = self.idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise RuntimeError(f"No free database connection after {self.timeout}s (pool size {self.size})")
+            if self._healthy(conn):
+                return conn
+
+    def _healthy(self, conn):
+        # health check on checkout: one reconnect attempt, otherwise the
+        # connection is dropped and the caller opens a fresh one
+        try:
+            if not conn.is_connected():
+                conn.reconnect(attempts=1, delay=0)
+                self._count("reconnects")
+            return True
+        except Exception:
+            self._discard(conn)
+            return False
+
+    def _discard(self, conn):
+        self._count("discarded")
+        with self.lock:
+            self.open -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _checkin(self, conn):
+        try:
+            # end any open transaction so the next user starts clean
+            # (and does not keep reading an old snapshot)
+            if getattr(conn, "in_transaction", False):
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        self.idle.put(conn)
+
+    def _enter(self):
+        self.local.depth = getattr(self.local, "depth", 0) + 1
+
+    def _exit(self):
+        self.local.depth -= 1
+        if self.local.depth == 0 and getattr(self.local, "conn", None) is not None:
+            conn, self.local.conn = self.local.conn, None
+            self._checkin(conn)
+
+    @contextmanager
+    def connection(self):
+        self._enter()
+        try:
+            if getattr(self.local, "conn", None) is None:
+                self.local.conn = self._checkout()
+            else:
+                self._count("reuses")
+            yield self.local.conn
+        finally:
+            self._exit()
+
+    # scope(): lazily hold one connection for a whole request / unit of work
+    def begin_scope(self):
+        self._enter()
+
+    def end_scope(self):
+        self._exit()
+
+    @contextmanager
+    def scope(self):
+        self.begin_scope()
+        try:
+            yield
+        finally:
+            self.end_scope()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["size"] = self.size
+            stats["open"] = self.open
+        stats["idle"] = self.idle.qsize()
+        stats["in_use"] = stats["open"] - stats["idle"]
+        return stats
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+db_pool = ConnectionPool()
+
+def fetch_rows(sql, params=()):
+    with db_pool.connection() as db:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+def insert_many(cursor, head, rows, tail="", batch_size=None):
+    # Sends rows as multi-row "head VALUES (..),(..) tail" statements of at
+    # most batch_size rows each, instead of one round trip per row.
+    batch_size = batch_size or DB_BATCH_SIZE
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            _insert_batch(cursor, head, batch, tail)
+            batch = []
+    if batch:
+        _insert_batch(cursor, head, batch, tail)
+
+def _insert_batch(cursor, head, batch, tail):
+    placeholders = "(" + ",".join(["%s"] * len(batch[0])) + ")"
+    sql = f"{head} VALUES " + ",".join([placeholders] * len(batch))
+    if tail:
+        sql += " " + tail
+    cursor.execute(sql, [value for row in batch for value in row])
+
+def username_exists(username, repo=None):
+    if FILES_BACKEND:
+        return repo is not None and repo.get_user(username) is not None
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT COUNT(*) FROM users WHERE username = %s", (username,))
+        exists = cursor.fetchone()[0] > 0
     return exists
 
+# --- Id allocation ---
+class IdAllocator:
+    # Hands out user and post ids. Each process leases a block of ids from the
+    # id_sequences table with one atomic UPDATE, so concurrent workers never
+    # get the same id and most allocations never touch the database. Leftover
+    # ids of a block are simply skipped when the process exits.
+    CREATE = ("CREATE TABLE IF NOT EXISTS id_sequences ("
+              "name VARCHAR(32) PRIMARY KEY, next_id BIGINT NOT NULL)")
+    SEED = ("INSERT INTO id_sequences (name, next_id) VALUES (%s, %s) "
+            "ON DUPLICATE KEY UPDATE next_id = GREATEST(next_id, VALUES(next_id))")
+    LEASE = "UPDATE id_sequences SET next_id = LAST_INSERT_ID(next_id + %s) WHERE name = %s"
+
+    def __init__(self, block_size=ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self.blocks = {}   # name -> [next, end)
+        self.floors = {}   # name -> lowest id not used by loaded data
+        self.lock = threading.Lock()
+        self.ready = False
+
+    def _run(self, statements):
+        # own connection: a lease must commit on its own, never inside
+        # (or on top of) a caller's open transaction
+        db = TimedConnection(get_db_connection())
+        try:
+            cursor = db.cursor()
+            if not self.ready:
+                cursor.execute(self.CREATE)
+                self.ready = True
+            result = None
+            for sql, params in statements:
+                cursor.execute(sql, params)
+                if sql.startswith("SELECT"):
+                    result = cursor.fetchone()[0]
+            db.commit()
+            return result
+        finally:
+            db.close()
+
+    def seed(self, name, floor):
+        # make sure the sequence starts above ids that already exist
+        with self.lock:
+            self.floors[name] = max(floor, self.floors.get(name, 1))
+            if FILES_BACKEND:
+                return
+            try:
+                self._run([(self.SEED, (name, self.floors[name]))])
+            except mysql.connector.Error as err:
+                print(f"Id sequence '{name}' not persisted: {err}")
+
+    def _lease(self, name):
+        end = None
+        if not FILES_BACKEND:
+            try:
+                end = self._run([
+                    (self.SEED, (name, self.floors.get(name, 1))),
+                    (self.LEASE, (self.block_size, name)),
+                    ("SELECT LAST_INSERT_ID()", ()),
+                ])
+            except mysql.connector.Error:
+                pass
+        if not end:
+            # no database (flat-file backend): single process, count locally
+            start = self.floors.get(name, 1)
+            end = start + self.block_size
+        start = int(end) - self.block_size
+        self.floors[name] = max(self.floors.get(name, 1), int(end))
+        return [start, int(end)]
+
+    def next_id(self, name):
+        with self.lock:
+            block = self.blocks.get(name)
+            if not block or block[0] >= block[1]:
+                block = self.blocks[name] = self._lease(name)
+            block[0] += 1
+            return block[0] - 1
+
+id_allocator = IdAllocator()
+
+# ===== Change Tracking =====
+# Domain objects remember whether they are new, dirty or deleted and register
+# themselves with the module level `changes` set. save_changes() then writes
+# only those rows instead of wiping and re-inserting every table.
+CLEAN, NEW, DIRTY, DELETED = "clean", "new", "dirty", "deleted"
+
+class Tracked:
+    # The hot domain classes below use __slots__ (no per-instance __dict__),
+    # so every class in their hierarchy, mixins included, declares slots.
+    __slots__ = ("_state",)
+
+    def __new__(cls, *args, **kwargs):
+        obj = super().__new__(cls)
+        obj._state = CLEAN
+        return obj
+
+    def mark_new(self):
+        self._state = NEW
+        changes.register(self)
+
+    def mark_dirty(self):
+        if self._state == CLEAN:
+            self._state = DIRTY
+            changes.register(self)
+
+    def mark_deleted(self):
+        if self._state == NEW:
+            # never reached the database, just forget about it
+            self._state = CLEAN
+            changes.discard(self)
+        else:
+            self._state = DELETED
+            changes.register(self)
+
+    def mark_clean(self):
+        self._state = CLEAN
+
+class ChangeSet:
+    def __init__(self):
+        self.pending = {}   # id(obj) -> obj, keeps registration order
+        self.edges = []     # ("add"/"remove", follower_username, followed_username)
+        self.lock = threading.RLock()
+
+    def register(self, obj):
+        with self.lock:
+            self.pending[id(obj)] = obj
+
+    def discard(self, obj):
+        with self.lock:
+            self.pending.pop(id(obj), None)
+
+    def add_edge(self, follower, followed):
+        with self.lock:
+            self.edges.append(("add", follower, followed))
+
+    def remove_edge(self, follower, followed):
+        with self.lock:
+            self.edges.append(("remove", follower, followed))
+
+    def is_empty(self):
+        return not self.pending and not self.edges
+
+    def reset(self):
+        with self.lock:
+            for obj in self.pending.values():
+                obj.mark_clean()
+            self.pending.clear()
+            self.edges.clear()
+
+changes = ChangeSet()
+
 # ===== Account =====
 class Account:
+    __slots__ = ("username", "role", "__password_hash", "session_expiry")
+
     def __init__(self, username, password, role, password_hash=None):
         self.username = username
         self.role = role
         self.__password_hash = password_hash if password_hash else self.hash_password(password)
-        # alias for backward compatibility( i did this so i dont have to change every code block in the program that uses self._password_hash before making it private)
-        self._password_hash = self.__password_hash
-
         self.session_expiry = None
 
+    # older code reads/writes _password_hash; keep it as a view of the private field
+    @property
+    def _password_hash(self):
+        return self.__password_hash
+
+    @_password_hash.setter
+    def _password_hash(self, value):
+        self.__password_hash = value
+
     def login(self, password):
         # now compares against the private field
         if self.hash_password(password) == self.__password_hash:
@@ -58,14 +577,13 @@ class Account:
 
 
 # ===== User, RegisteredUser, ProfessionalUser =====
-class User:
+class User(Tracked):
+    __slots__ = ("_followers", "_following", "user_id", "name", "bio", "profile_pic", "account")
+
     def __init__(self, user_id, name, bio, profile_pic, account, **kwargs):
-        # — truly protected internals
-        self._followers = []
-        self._following = []
-        # — aliases for backward compatibility
-        self.followers = self._followers
-        self.following = self._following
+        # — truly protected internals (username sets, shared with the SocialGraph)
+        self._followers = set()
+        self._following = set()
 
         # public attributes
         self.user_id = user_id
@@ -73,96 +591,415 @@ class User:
         self.bio = bio
         self.profile_pic = profile_pic
         self.account= account
-        self.posts = []
-        self.comments = []
-        self.likes = []
-
-    def follow(self, username, users):
-        target = next((u for u in users if u.account.username == username), None)
-        if target and username != self.account.username:
-            if username not in self.following:
-                self.following.append(username)
-                target.followers.append(self.account.username)
+
+    # read access for templates and older callers
+    @property
+    def followers(self):
+        return self._followers
+
+    @property
+    def following(self):
+        return self._following
+
+    def follow(self, username, repo):
+        target = repo.get_user(username)
+        if target and target is not self:
+            username = target.account.username
+            if repo.graph.follow(self.account.username, username):
+                changes.add_edge(self.account.username, username)
                 print(f"You are now following {username}.")
             else:
                 print("You already follow this user.")
         else:
             print("User not found.")
 
-    def unfollow(self, username, users):
-        target = next((u for u in users if u.account.username == username), None)
-        if target and username in self.following:
-            self.following.remove(username)
-            target.followers.remove(self.account.username)
+    def unfollow(self, username, repo):
+        target = repo.get_user(username)
+        if target and repo.graph.unfollow(self.account.username, target.account.username):
+            username = target.account.username
+            changes.remove_edge(self.account.username, username)
             print(f"You unfollowed {username}.")
         else:
             print("User not found or not in following list.")
 
     def like_post(self, post):
-        for i in getattr(post, "interactions", []):
-            if isinstance(i, Like) and i.user == self:
-                print("You already liked this post.")
-                return
-        post.interactions.append(Like(self, post))
+        if post.has_liked(self):
+            print("You already liked this post.")
+            return
+        like = Like(self, post)
+        post.add_like(like)
+        like.mark_new()
         print("You liked the post.")
 
     def comment_on_post(self, post, content):
-        post.interactions.append(Comment(self, post, content))
+        comment = Comment(self, post, content)
+        post.add_comment(comment)
+        comment.mark_new()
         print("Comment added.")
 
 
 class RegisteredUser(User):
+    __slots__ = ()
+
     def __init__(self, user_id, name, bio, profile_pic, account, **kwargs):
         super().__init__(user_id, name, bio, profile_pic, account, **kwargs)
 
 class ProfessionalUser(RegisteredUser):
+    __slots__ = ()
+
     def __init__(self, user_id, name, bio, profile_pic, account, **kwargs):
         super().__init__(user_id, name, bio, profile_pic, account, **kwargs)
-        self.product_posts = []
-        self.job_posts = []
 
 # ===== Media =====
 class Media:
+    __slots__ = ("media_id", "media_type", "url", "width", "height", "size", "variants", "status")
+
     def __init__(self, media_id, media_type, url):
         self.media_id = media_id
         self.media_type = media_type
         self.url = url
+        # filled in by MediaPipeline; not stored in the database
+        self.width = None
+        self.height = None
+        self.size = None
+        self.variants = None   # variant name -> url, created on first variant
+        self.status = None     # None (not looked at), "pending", "ready", "failed"
+
+    def variant_url(self, name):
+        # falls back to the original until the variant exists
+        return self.variants.get(name, self.url) if self.variants else self.url
+
+    def add_variant(self, name, url):
+        if self.variants is None:
+            self.variants = {}
+        self.variants[name] = url
 
     def __str__(self):
         return f"{self.media_type}: {self.url}"
 
+# ===== Media Processing =====
+# Uploads are saved as-is by the request and then handed to a small thread
+# pool that records the image size and writes downscaled JPEG variants next
+# to the original ("photo.png" -> "photo.thumb.jpg", "photo.web.jpg"). The
+# variants are found again by that naming convention, so nothing extra is
+# stored in the database and every worker sees them. Every image gets every
+# variant (small ones are just re-encoded), so a Media is "ready" exactly
+# when all of its variant files exist.
+MEDIA_VARIANTS = {"thumb": 480, "web": 1280}   # variant -> longest edge in px
+MEDIA_QUALITY = 82
+MEDIA_WORKERS = int(os.environ.get("BLEX_MEDIA_WORKERS", "2"))
+
+log = logging.getLogger("blex")
+metrics.describe("blex_media_failures_total", "Media processing failures by error type.")
+
+class MediaPipeline:
+    def __init__(self, root, url_prefix, workers=MEDIA_WORKERS):
+        self.root = root                       # directory behind url_prefix
+        self.url_prefix = url_prefix.rstrip("/") + "/"
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="media")
+        self.lock = threading.Lock()
+        self.counters = {"processed": 0, "failed": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def path_for(self, url):
+        if url and url.startswith(self.url_prefix):
+            return os.path.join(self.root, *url[len(self.url_prefix):].split("/"))
+        return None
+
+    def variant_name(self, url, name):
+        return os.path.splitext(url)[0] + f".{name}.jpg"
+
+    def submit(self, media):
+        media.status = "pending"
+        return self.pool.submit(self.process, media)
+
+    def process(self, media):
+        path = self.path_for(media.url)
+        try:
+            media.size = os.path.getsize(path)
+            if Image is not None and media.media_type == "image":
+                with Image.open(path) as img:
+                    img = ImageOps.exif_transpose(img)
+                    media.width, media.height = img.size
+                    for name, edge in MEDIA_VARIANTS.items():
+                        vurl = self.variant_name(media.url, name)
+                        vpath = self.path_for(vurl)
+                        # hash-named originals never change, so an existing variant is current
+                        if not os.path.exists(vpath):
+                            self.write_variant(img, edge, vpath)
+                        media.add_variant(name, vurl)
+            self._count("processed")
+            media.status = "ready"
+        except Exception as err:
+            # pages keep showing the original; not retried, the file is bad
+            self._count("failed")
+            metrics.inc("blex_media_failures_total", error=type(err).__name__)
+            log.warning("Media processing failed for %s: %s", media.url, err)
+            media.status = "failed"
+
+    def write_variant(self, img, edge, path):
+        small = img.copy()
+        small.thumbnail((edge, edge))
+        if small.mode != "RGB":
+            # JPEG has no alpha; flatten onto white
+            background = Image.new("RGB", small.size, "white")
+            background.paste(small, mask=small.convert("RGBA").split()[-1])
+            small = background
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        small.save(tmp, "JPEG", quality=MEDIA_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp, path)
+
+    def resolve(self, media, name):
+        # url of a variant for templates. Media loaded from the database is
+        # looked up on disk once; when variants are missing (still being
+        # written elsewhere, or never made) it is processed here, and the
+        # variants show up once that finishes
+        if media.status is None and media.url:
+            path = self.path_for(media.url)
+            if Image is None or media.media_type != "image" or not path:
+                media.status = "ready"
+            else:
+                for variant in MEDIA_VARIANTS:
+                    vurl = self.variant_name(media.url, variant)
+                    if os.path.exists(self.path_for(vurl)):
+                        media.add_variant(variant, vurl)
+                if media.variants and len(media.variants) == len(MEDIA_VARIANTS):
+                    media.status = "ready"
+                elif os.path.exists(path):
+                    self.submit(media)
+                else:
+                    media.status = "failed"
+        return media.variant_url(name)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+# --- Content-addressed store ---
+# Uploads are stored once per distinct content as <root>/ab/cd/<sha256>.<ext>,
+# so equal files share one blob and names never collide. Blobs are immutable
+# and can be cached forever. Reference counts come from the posts that use a
+# url (rebuilt on load); a blob whose count drops to zero is deleted, with
+# its variants, by collect() after the post delete is committed, and only
+# if no row in the database still points at it. put() refreshes the blob's
+# mtime and collect() leaves recently touched blobs alone for
+# MEDIA_GRACE_SECONDS, since an upload only gains its reference (and its
+# posts row) once the post is added and committed, possibly in another worker.
+MEDIA_CHUNK = 1 << 20
+MEDIA_GRACE_SECONDS = float(os.environ.get("BLEX_MEDIA_GRACE", "600"))
+
+class MediaStore:
+    def __init__(self, root, url_prefix):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip("/") + "/"
+        self.refs = {}          # url -> number of posts using it
+        self.orphans = set()    # urls whose count reached zero
+        self.lock = threading.Lock()
+        self.counters = {"stored": 0, "deduplicated": 0, "freed": 0}
+
+    def owns(self, url):
+        return bool(url) and url.startswith(self.url_prefix)
+
+    def path_for(self, url):
+        return os.path.join(self.root, *url[len(self.url_prefix):].split("/"))
+
+    def put(self, stream, filename):
+        # stream to a temp file while hashing, then move into place
+        ext = os.path.splitext(filename)[1].lower()
+        ext = ext if re.fullmatch(r"\.[a-z0-9]{1,8}", ext) else ""
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp = os.path.join(tmp_dir, f"{os.getpid()}-{threading.get_ident()}-{random.getrandbits(32):08x}")
+        digest = hashlib.sha256()
+        with open(tmp, "wb") as out:
+            for chunk in iter(lambda: stream.read(MEDIA_CHUNK), b""):
+                digest.update(chunk)
+                out.write(chunk)
+        name = digest.hexdigest()
+        url = f"{self.url_prefix}{name[:2]}/{name[2:4]}/{name}{ext}"
+        path = self.path_for(url)
+        try:
+            os.utime(path)   # reusing it: restart the grace period
+            os.remove(tmp)
+            self.counters["deduplicated"] += 1
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+            self.counters["stored"] += 1
+        return url
+
+    def acquire(self, url):
+        if self.owns(url):
+            with self.lock:
+                self.refs[url] = self.refs.get(url, 0) + 1
+                self.orphans.discard(url)
+
+    def release(self, url):
+        if self.owns(url):
+            with self.lock:
+                count = self.refs.get(url, 0) - 1
+                if count > 0:
+                    self.refs[url] = count
+                else:
+                    self.refs.pop(url, None)
+                    self.orphans.add(url)
+
+    def rebuild(self, posts):
+        with self.lock:
+            self.refs.clear()
+            self.orphans.clear()
+        for post in posts:
+            self.acquire(post.media.url)
+
+    def still_referenced(self, urls):
+        # the urls a posts row still points at: other workers may have a post
+        # using the blob that we have not seen yet. One query per batch,
+        # served by the posts_media_url index (ensure_media_index)
+        if FILES_BACKEND:
+            return set()   # one process, its own counts are the whole story
+        found = set()
+        try:
+            with db_pool.connection() as db:
+                cursor = db.cursor()
+                for i in range(0, len(urls), DB_BATCH_SIZE):
+                    batch = urls[i:i + DB_BATCH_SIZE]
+                    cursor.execute("SELECT DISTINCT media_url FROM posts WHERE media_url IN (%s)"
+                                   % ", ".join(["%s"] * len(batch)), batch)
+                    found.update(url for (url,) in cursor.fetchall())
+        except mysql.connector.Error:
+            return set(urls)   # cannot tell, keep them all
+        return found
+
+    def recently_put(self, url):
+        try:
+            return time.time() - os.path.getmtime(self.path_for(url)) < MEDIA_GRACE_SECONDS
+        except FileNotFoundError:
+            return False
+
+    def collect(self):
+        with self.lock:
+            orphans = [url for url in self.orphans if url not in self.refs]
+            self.orphans.clear()
+        candidates = []
+        for url in orphans:
+            if self.recently_put(url):
+                # a new upload may be about to use it; look again next time
+                with self.lock:
+                    if url not in self.refs:
+                        self.orphans.add(url)
+            else:
+                candidates.append(url)
+        if not candidates:
+            return 0
+        referenced = self.still_referenced(candidates)
+        freed = 0
+        for url in candidates:
+            if url in referenced:
+                continue
+            stem = os.path.splitext(url)[0]
+            for path in [self.path_for(url)] + [self.path_for(f"{stem}.{v}.jpg") for v in MEDIA_VARIANTS]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.counters["freed"] += 1
+            freed += 1
+        return freed
+
 # ===== Post and Subclasses =====
-class Post(ABC):
-    _id_counter = 1
+class Post(Tracked, ABC):
+    __slots__ = ("post_id", "caption", "media", "author", "timestamp", "_store")
 
-    def __init__(self, caption, media, author, post_id=None, timestamp=None, **kwargs):
-        self.post_id = post_id if post_id else Post._id_counter
-        if post_id is None:
-            Post._id_counter += 1
+    def __init__(self, caption, media, author, post_id, timestamp=None, **kwargs):
+        # new posts get their id from id_allocator where they are created
+        self.post_id = post_id
 
         self.caption   = caption
         self.media     = media
         self.author    = author
         self.timestamp = timestamp if timestamp else datetime.now()
 
-        # — truly protected interactions list
-        self._interactions = []
-        # — alias for backward compatibility
-        self.interactions = self._interactions
+        # likes/comments live in an InteractionStore, the Repository's one
+        # once the post is added there
+        self._store = None
 
     @abstractmethod
     def display(self):
         pass
 
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = InteractionStore()   # not in a repository yet
+        return self._store
+
+    def attach(self, store):
+        if self._store is not None and self._store is not store:
+            self._store.move_post(int(self.post_id), store)
+        self._store = store
+
+    @property
+    def likes(self):
+        return self.store.likes_of(self)
+
+    @property
+    def liker_ids(self):
+        return self.store.liker_ids(int(self.post_id))
+
+    @property
+    def like_count(self):
+        return self.store.like_count(int(self.post_id))
+
+    @property
+    def comments(self):
+        return self.store.comments_of(self)
+
+    @property
+    def comment_count(self):
+        return self.store.comment_count(int(self.post_id))
+
+    @property
+    def interactions(self):
+        # likes followed by comments, built on demand
+        return self.likes + self.comments
+
+    def has_liked(self, user):
+        return self.store.has_like(int(self.post_id), user.user_id)
+
+    def add_like(self, like):
+        self.store.remember(like.user)
+        return self.store.add_like(int(self.post_id), like.user.user_id, like.timestamp)
+
+    def remove_like(self, user):
+        return self.store.remove_like(int(self.post_id), user.user_id)
+
+    def add_comment(self, comment):
+        self.store.remember(comment.user)
+        self.store.add_comment(int(self.post_id), comment.user.user_id, comment.content, comment.timestamp)
+
+    def mark_deleted(self):
+        # pending likes/comments on a deleted post must not be written either
+        with changes.lock:
+            for obj in list(changes.pending.values()):
+                if isinstance(obj, Interaction) and obj.post is self:
+                    changes.discard(obj)
+        super().mark_deleted()
+
 class NormalPost(Post):
-    def __init__(self, caption, media, author, post_id=None, timestamp=None, **kwargs):
+    __slots__ = ()
+
+    def __init__(self, caption, media, author, post_id, timestamp=None, **kwargs):
         super().__init__(caption, media, author, post_id=post_id, timestamp=timestamp, **kwargs)
 
     def display(self):
         return f"{self.author.name} posted: {self.caption} [{self.media}]"
 
 class ProductPost(Post):
-    def __init__(self, product_name, price, description, media, author, post_id=None, timestamp=None, **kwargs):
+    __slots__ = ("product_name", "price", "description")
+
+    def __init__(self, product_name, price, description, media, author, post_id, timestamp=None, **kwargs):
         caption = f"Buy: {product_name}"
         super().__init__(caption, media, author, post_id=post_id, timestamp=timestamp, **kwargs)
         self.product_name = product_name
@@ -173,7 +1010,9 @@ class ProductPost(Post):
         return f"Product: {self.product_name} (${self.price}) by {self.author.name} | {self.description} | Media: {self.media}"
 
 class JobPost(Post):
-    def __init__(self, job_title, company, requirements, media, author, post_id=None, timestamp=None, **kwargs):
+    __slots__ = ("job_title", "company", "requirements")
+
+    def __init__(self, job_title, company, requirements, media, author, post_id, timestamp=None, **kwargs):
         caption = f"Job: {job_title}"
         super().__init__(caption, media, author, post_id=post_id, timestamp=timestamp, **kwargs)
         self.job_title = job_title
@@ -184,7 +1023,9 @@ class JobPost(Post):
         return f"Job: {self.job_title} at {self.company} by {self.author.name} | Req: {self.requirements} | Media: {self.media}"
 
 # ===== Interaction and Subclasses =====
-class Interaction(ABC):
+class Interaction(Tracked, ABC):
+    __slots__ = ("user", "post", "timestamp")
+
     def __init__(self, user, post, timestamp=None, **kwargs):
         self.user = user
         self.post = post
@@ -195,6 +1036,8 @@ class Interaction(ABC):
         pass
 
 class InteractionMixin:
+    __slots__ = ()
+
     def get_actor(self):
         return self.user.name
 
@@ -202,6 +1045,8 @@ class InteractionMixin:
         return self.timestamp
 
 class Comment(Interaction, InteractionMixin):
+    __slots__ = ("content",)
+
     def __init__(self, user, post, content, timestamp=None, **kwargs):
         super().__init__(user, post, timestamp, **kwargs)
         self.content = content
@@ -210,49 +1055,1142 @@ class Comment(Interaction, InteractionMixin):
         return f"{self.user.name} commented: {self.content}"
 
 class Like(Interaction, InteractionMixin):
+    __slots__ = ()
+
     def __init__(self, user, post, timestamp=None, **kwargs):
         super().__init__(user, post, timestamp, **kwargs)
 
     def get_summary(self):
         return f"{self.user.name} liked this post."
 
+# ===== Interaction Store =====
+# Likes and comments are kept as parallel typed arrays rather than one object
+# per row: a like is (post_id, user_id, time) across three array('q') columns,
+# times in microseconds since 1970; comments add a column of interned text.
+# Deleting a row only marks it dead, compact() drops dead rows once they
+# outnumber the live ones. Like/Comment objects are built on demand.
+# Posts with more than HOT_POST_ROWS likes also get a user_id -> row dict, so
+# like lookups never walk a popular post's chain.
+INTERACTION_EPOCH = datetime(1970, 1, 1)
+DEAD_ROW = -1
+COMPACT_MIN_DEAD = 1024
+HOT_POST_ROWS = int(os.environ.get("BLEX_HOT_POST_ROWS", "32"))
+
+def to_micros(ts):
+    return (ts - INTERACTION_EPOCH) // timedelta(microseconds=1)
+
+def from_micros(us):
+    return INTERACTION_EPOCH + timedelta(microseconds=us)
+
+class InteractionTable:
+    # Rows of one post (and of one user) are chained newest first through the
+    # next_in_post/next_in_user columns, so the indexes cost one dict entry
+    # per post or user instead of a container each. The prev_* columns link
+    # back, so a row is unlinked without walking its chains.
+    def __init__(self, with_text=False, keyed=False):
+        self.post = array("q")
+        self.user = array("q")
+        self.time = array("q")
+        self.text = [] if with_text else None
+        self.next_in_post = array("q")
+        self.next_in_user = array("q")
+        self.prev_in_post = array("q")
+        self.prev_in_user = array("q")
+        self.head_by_post = {}    # post_id -> newest row
+        self.head_by_user = {}    # user_id -> newest row
+        self.count_by_post = {}   # post_id -> live rows
+        self.rows_by_hot_post = {} if keyed else None   # post_id -> {user_id: newest row}
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.post) - self.dead
+
+    def append(self, post_id, user_id, micros, text=None):
+        row = len(self.post)
+        self.post.append(post_id)
+        self.user.append(user_id)
+        self.time.append(micros)
+        if self.text is not None:
+            self.text.append(sys.intern(text or ""))
+        for key, heads, nexts, prevs in ((post_id, self.head_by_post, self.next_in_post, self.prev_in_post),
+                                         (user_id, self.head_by_user, self.next_in_user, self.prev_in_user)):
+            head = heads.get(key, DEAD_ROW)
+            nexts.append(head)
+            prevs.append(DEAD_ROW)
+            if head != DEAD_ROW:
+                prevs[head] = row
+            heads[key] = row
+        count = self.count_by_post[post_id] = self.count_by_post.get(post_id, 0) + 1
+        hot = self.rows_by_hot_post
+        if hot is not None:
+            if post_id in hot:
+                hot[post_id][user_id] = row
+            elif count > HOT_POST_ROWS:
+                hot[post_id] = {self.user[r]: r for r in self.rows_of_post(post_id)}
+        return row
+
+    def chain(self, row, links):
+        while row != DEAD_ROW:
+            yield row
+            row = links[row]
+
+    def rows_of_post(self, post_id):
+        # oldest first
+        rows = list(self.chain(self.head_by_post.get(post_id, DEAD_ROW), self.next_in_post))
+        rows.reverse()
+        return rows
+
+    def rows_of_user(self, user_id):
+        rows = list(self.chain(self.head_by_user.get(user_id, DEAD_ROW), self.next_in_user))
+        rows.reverse()
+        return rows
+
+    def count(self, post_id):
+        return self.count_by_post.get(post_id, 0)
+
+    def find(self, post_id, user_id, micros=None):
+        # newest live row of `user_id` on `post_id` (at `micros`, if given)
+        if micros is None and self.rows_by_hot_post is not None:
+            rows = self.rows_by_hot_post.get(post_id)
+            if rows is not None:
+                return rows.get(user_id)
+        user, time = self.user, self.time
+        for row in self.chain(self.head_by_post.get(post_id, DEAD_ROW), self.next_in_post):
+            if user[row] == user_id and (micros is None or time[row] == micros):
+                return row
+        return None
+
+    def unlink(self, row, key, heads, nexts, prevs):
+        prev, nxt = prevs[row], nexts[row]
+        if prev == DEAD_ROW:
+            if nxt == DEAD_ROW:
+                del heads[key]
+            else:
+                heads[key] = nxt
+        else:
+            nexts[prev] = nxt
+        if nxt != DEAD_ROW:
+            prevs[nxt] = prev
+
+    def kill(self, row):
+        # callers run maybe_compact() once they are done with row numbers
+        post_id, user_id = self.post[row], self.user[row]
+        self.unlink(row, post_id, self.head_by_post, self.next_in_post, self.prev_in_post)
+        self.unlink(row, user_id, self.head_by_user, self.next_in_user, self.prev_in_user)
+        if self.count_by_post[post_id] == 1:
+            del self.count_by_post[post_id]
+        else:
+            self.count_by_post[post_id] -= 1
+        hot = self.rows_by_hot_post.get(post_id) if self.rows_by_hot_post is not None else None
+        if hot is not None:
+            if post_id not in self.count_by_post:
+                del self.rows_by_hot_post[post_id]
+            elif hot.get(user_id) == row:
+                del hot[user_id]
+        self.post[row] = DEAD_ROW
+        if self.text is not None:
+            self.text[row] = ""
+        self.dead += 1
+
+    def maybe_compact(self):
+        if self.dead >= COMPACT_MIN_DEAD and self.dead > len(self):
+            self.compact()
+
+    def compact(self):
+        live = list(self.live_rows())
+        old = self.post, self.user, self.time, self.text
+        self.__init__(self.text is not None, self.rows_by_hot_post is not None)
+        for row in live:
+            self.append(old[0][row], old[1][row], old[2][row], old[3][row] if old[3] is not None else None)
+
+    def live_rows(self):
+        for row, post_id in enumerate(self.post):
+            if post_id != DEAD_ROW:
+                yield row
+
+    def counts_by_post(self):
+        return Counter(self.count_by_post)
+
+    def nbytes(self):
+        size = sum(sys.getsizeof(col) for col in
+                   (self.post, self.user, self.time, self.next_in_post, self.next_in_user,
+                    self.prev_in_post, self.prev_in_user))
+        for index in (self.head_by_post, self.head_by_user, self.count_by_post):
+            size += sys.getsizeof(index) + sum(sys.getsizeof(v) for v in index.values())
+        if self.rows_by_hot_post is not None:
+            size += sys.getsizeof(self.rows_by_hot_post)
+            for rows in self.rows_by_hot_post.values():
+                size += sys.getsizeof(rows) + sum(sys.getsizeof(v) for v in rows.values())
+        if self.text is not None:
+            size += sys.getsizeof(self.text)
+            size += sum(sys.getsizeof(t) for t in {id(t): t for t in self.text}.values())
+        return size
+
+class InteractionStore:
+    def __init__(self, users=None):
+        self.users = users if users is not None else {}   # user_id -> user, for building objects
+        self.owns_users = users is None
+        self.likes = InteractionTable(keyed=True)
+        self.comments = InteractionTable(with_text=True)
+
+    def remember(self, user):
+        # a Repository's store resolves through the repository's own index
+        if self.owns_users:
+            self.users.setdefault(user.user_id, user)
+
+    # --- likes ---
+    def has_like(self, post_id, user_id):
+        return self.likes.find(post_id, user_id) is not None
+
+    def add_like(self, post_id, user_id, timestamp):
+        if self.has_like(post_id, user_id):
+            return False
+        self.likes.append(post_id, user_id, to_micros(timestamp))
+        return True
+
+    def remove_like(self, post_id, user_id):
+        row = self.likes.find(post_id, user_id)
+        if row is None:
+            return False
+        self.likes.kill(row)
+        self.likes.maybe_compact()
+        return True
+
+    def like_count(self, post_id):
+        return self.likes.count(post_id)
+
+    def liker_ids(self, post_id):
+        return [self.likes.user[r] for r in self.likes.rows_of_post(post_id)]
+
+    def liked_post_ids(self, user_id):
+        return [self.likes.post[r] for r in self.likes.rows_of_user(user_id)]
+
+    def likes_of(self, post):
+        t = self.likes
+        out = []
+        for row in t.rows_of_post(int(post.post_id)):
+            user = self.users.get(t.user[row])
+            if user:
+                out.append(Like(user, post, timestamp=from_micros(t.time[row])))
+        return out
+
+    # --- comments ---
+    def add_comment(self, post_id, user_id, content, timestamp):
+        self.comments.append(post_id, user_id, to_micros(timestamp), content)
+
+    def edit_comment(self, post_id, user_id, timestamp, content):
+        row = self.comments.find(post_id, user_id, to_micros(timestamp))
+        if row is None:
+            return False
+        self.comments.text[row] = sys.intern(content or "")
+        return True
+
+    def remove_comment(self, post_id, user_id, timestamp):
+        row = self.comments.find(post_id, user_id, to_micros(timestamp))
+        if row is None:
+            return False
+        self.comments.kill(row)
+        self.comments.maybe_compact()
+        return True
+
+    def comment_count(self, post_id):
+        return self.comments.count(post_id)
+
+    def commented_post_ids(self, user_id):
+        return [self.comments.post[r] for r in self.comments.rows_of_user(user_id)]
+
+    def comments_of(self, post):
+        t = self.comments
+        out = []
+        for row in t.rows_of_post(int(post.post_id)):
+            user = self.users.get(t.user[row])
+            if user:
+                out.append(Comment(user, post, t.text[row], timestamp=from_micros(t.time[row])))
+        return out
+
+    # --- posts ---
+    def drop_post(self, post_id):
+        for t in (self.likes, self.comments):
+            for row in t.rows_of_post(post_id):
+                t.kill(row)
+            t.maybe_compact()
+
+    def move_post(self, post_id, other):
+        # hand a post's rows to `other`, e.g. when the post joins a Repository
+        for row in self.likes.rows_of_post(post_id):
+            other.add_like(post_id, self.likes.user[row], from_micros(self.likes.time[row]))
+        for row in self.comments.rows_of_post(post_id):
+            other.add_comment(post_id, self.comments.user[row], self.comments.text[row],
+                              from_micros(self.comments.time[row]))
+        for user_id, user in self.users.items():
+            other.users.setdefault(user_id, user)
+        self.drop_post(post_id)
+
+    def clear_likes(self):
+        self.likes = InteractionTable(keyed=True)
+
+    def clear_comments(self):
+        self.comments = InteractionTable(with_text=True)
+
+    # --- rows, for persistence ---
+    def iter_likes(self):
+        t = self.likes
+        for row in t.live_rows():
+            yield t.post[row], t.user[row], from_micros(t.time[row])
+
+    def iter_comments(self):
+        t = self.comments
+        for row in t.live_rows():
+            yield t.post[row], t.user[row], t.text[row], from_micros(t.time[row])
+
+    # --- aggregations ---
+    def like_counts(self):
+        return self.likes.counts_by_post()
+
+    def comment_counts(self):
+        return self.comments.counts_by_post()
+
+    def top_liked(self, n=10):
+        # [(post_id, likes)], most liked first
+        return heapq.nlargest(n, self.likes.count_by_post.items(), key=lambda kv: kv[1])
+
+    def author_totals(self, author_of):
+        # likes received per author; author_of maps post_id -> author key
+        totals = Counter()
+        for post_id, count in self.likes.count_by_post.items():
+            author = author_of(post_id)
+            if author is not None:
+                totals[author] += count
+        return totals
+
+    def nbytes(self):
+        return sys.getsizeof(self) + self.likes.nbytes() + self.comments.nbytes()
+
 # ===== Message =====
-class Message:
-    def __init__(self, sender, receiver, content, timestamp=None):
+class Message(Tracked):
+    __slots__ = ("message_id", "sender", "receiver", "content", "timestamp")
+
+    def __init__(self, message_id, sender, receiver, content, timestamp=None):
+        self.message_id = message_id   # persisted; breaks timestamp ties in cursors
         self.sender = sender
         self.receiver = receiver
         self.content = content
         self.timestamp = timestamp if timestamp else datetime.now()
 
+    @property
+    def key(self):
+        return (self.timestamp, self.message_id)
+
+class ReadMark(Tracked):
+    # the newest message a user has seen, one row of message_reads
+    __slots__ = ("username", "timestamp", "message_id")
+
+    def __init__(self, username, key):
+        self.username = username
+        self.timestamp, self.message_id = key
+
+    @property
+    def key(self):
+        return (self.timestamp, self.message_id)
+
+# ===== Sorted Lists =====
+def remove_sorted(items, key):
+    # remove one `key` from a bisect-sorted list, if present
+    i = bisect.bisect_left(items, key)
+    if i < len(items) and items[i] == key:
+        del items[i]
+        return True
+    return False
+
+# ===== Search Index =====
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+PHRASE_RE = re.compile(r'"([^"]*)"')
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text or "").lower())
+
+class SearchIndex:
+    # Inverted index: token -> {doc_id: weight}. `fields` maps attribute
+    # name -> boost. Query terms are prefix-matched against a sorted
+    # vocabulary and AND-ed together; results are ranked by boosted term
+    # weight times idf, exact token matches counting double a prefix match.
+    # "Quoted words" must appear as exact consecutive tokens in one field.
+    def __init__(self, fields):
+        self.fields = fields
+        self.postings = {}     # token -> {doc_id: weight}
+        self.vocab = []        # sorted tokens, for prefix lookups
+        self.doc_tokens = {}   # doc_id -> tokens, for removal
+        self.docs = {}         # doc_id -> doc
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, doc_id, doc):
+        if doc_id in self.docs:
+            self.remove(doc_id)
+        weights = {}
+        for field, boost in self.fields.items():
+            for token in tokenize(getattr(doc, field, "")):
+                weights[token] = weights.get(token, 0) + boost
+        for token, weight in weights.items():
+            posting = self.postings.get(token)
+            if posting is None:
+                posting = self.postings[token] = {}
+                bisect.insort(self.vocab, token)
+            posting[doc_id] = weight
+        self.doc_tokens[doc_id] = list(weights)
+        self.docs[doc_id] = doc
+
+    def remove(self, doc_id):
+        for token in self.doc_tokens.pop(doc_id, ()):
+            posting = self.postings[token]
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[token]
+                remove_sorted(self.vocab, token)
+        self.docs.pop(doc_id, None)
+
+    def expand(self, term):
+        # every indexed token that starts with `term`
+        i = bisect.bisect_left(self.vocab, term)
+        tokens = []
+        while i < len(self.vocab) and self.vocab[i].startswith(term):
+            tokens.append(self.vocab[i])
+            i += 1
+        return tokens
+
+    def term_scores(self, term, prefix=True):
+        scores = {}
+        tokens = self.expand(term) if prefix else ([term] if term in self.postings else [])
+        for token in tokens:
+            posting = self.postings[token]
+            idf = math.log(1 + len(self.docs) / len(posting))
+            factor = idf if token == term else idf / 2
+            for doc_id, weight in posting.items():
+                score = weight * factor
+                if score > scores.get(doc_id, 0):
+                    scores[doc_id] = score
+        return scores
+
+    def search_ids(self, query, prefix=True):
+        # {doc_id: score} of docs matching every term and phrase in `query`
+        phrases = [words for words in map(tokenize, PHRASE_RE.findall(query)) if words]
+        per_term = [self.term_scores(term, prefix) for term in dict.fromkeys(tokenize(PHRASE_RE.sub(" ", query)))]
+        per_term += [self.term_scores(term, prefix=False) for words in phrases for term in dict.fromkeys(words)]
+        if not per_term:
+            return {}
+        per_term.sort(key=len)
+        scores = per_term[0]
+        for other in per_term[1:]:
+            scores = {doc_id: score + other[doc_id] for doc_id, score in scores.items() if doc_id in other}
+            if not scores:
+                break
+        if phrases:
+            # only the candidates left after the AND are checked for adjacency
+            scores = {doc_id: score for doc_id, score in scores.items()
+                      if all(self.has_phrase(self.docs[doc_id], words) for words in phrases)}
+        return scores
+
+    def has_phrase(self, doc, words):
+        n = len(words)
+        for field in self.fields:
+            tokens = tokenize(getattr(doc, field, ""))
+            if any(tokens[i:i + n] == words for i in range(len(tokens) - n + 1)):
+                return True
+        return False
+
+    def search(self, query, limit=None, prefix=True):
+        scores = self.search_ids(query, prefix)
+        ranked = sorted(scores, key=lambda doc_id: (-scores[doc_id], -doc_id))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [self.docs[doc_id] for doc_id in ranked]
+
 # ===== Marketplace =====
-class Marketplace:
+MARKET_SORTS = ("newest", "price_asc", "price_desc")
+
+class Marketplace(Tracked):
     def __init__(self):
         self.products = []
+        self.products_by_id = {}
+        self.index = SearchIndex({"product_name": 3, "description": 1})
+        self.by_price = []     # sorted (price, post_id)
+        self.by_recency = []   # sorted (timestamp, post_id)
+        # post_ids added/removed since the last save_changes()
+        self._added = set()
+        self._removed = set()
 
-    def add_product(self, product):
+    def load_product(self, product):
+        # list it without recording a change, for loaders
         self.products.append(product)
+        self.products_by_id[int(product.post_id)] = product
+        self.index.add(int(product.post_id), product)
+        bisect.insort(self.by_price, price_key(product))
+        bisect.insort(self.by_recency, feed_key(product))
+
+    def add_product(self, product):
+        self.load_product(product)
+        self._removed.discard(product.post_id)
+        self._added.add(product.post_id)
+        self.mark_dirty()
+
+    def remove_product(self, product):
+        if product in self.products:
+            self.products.remove(product)
+            self.products_by_id.pop(int(product.post_id), None)
+            self.index.remove(int(product.post_id))
+            remove_sorted(self.by_price, price_key(product))
+            remove_sorted(self.by_recency, feed_key(product))
+            self._added.discard(product.post_id)
+            self._removed.add(product.post_id)
+            self.mark_dirty()
 
-    def search_by_keyword(self, keyword):
-        return [p for p in self.products if keyword.lower() in p.product_name.lower()]
+    def mark_clean(self):
+        super().mark_clean()
+        self._added.clear()
+        self._removed.clear()
+
+    def search_by_keyword(self, keyword, limit=None):
+        # ranked, every word must match (as a prefix) the name or description
+        return self.index.search(keyword, limit)
 
     def filter_by_price(self, min_price, max_price):
-        return [p for p in self.products if min_price <= p.price <= max_price]
+        # cheapest first, O(log n + k)
+        return [self.products_by_id[pid] for _, pid in self.price_range(min_price, max_price)]
+
+    def price_range(self, min_price=None, max_price=None):
+        lo = 0 if min_price is None else bisect.bisect_left(self.by_price, (float(min_price), -math.inf))
+        hi = len(self.by_price) if max_price is None else bisect.bisect_right(self.by_price, (float(max_price), math.inf))
+        return self.by_price[lo:hi]
+
+    def newest(self, limit=None):
+        keys = self.by_recency[::-1] if limit is None else self.by_recency[:-limit - 1:-1]
+        return [self.products_by_id[pid] for _, pid in keys]
+
+    def query(self, keyword="", min_price=None, max_price=None, sort=None):
+        # Listings matching every filter given. Keyword results default to
+        # relevance order, price-range results to cheapest first. With no
+        # filter and no sort this returns None and the caller picks an order.
+        if keyword:
+            scores = self.index.search_ids(keyword)
+            items = [self.products_by_id[pid] for pid in scores]
+            if min_price is not None or max_price is not None:
+                lo = -math.inf if min_price is None else float(min_price)
+                hi = math.inf if max_price is None else float(max_price)
+                items = [p for p in items if lo <= float(p.price) <= hi]
+            items.sort(key=lambda p: (-scores[int(p.post_id)], -int(p.post_id)))
+        elif min_price is not None or max_price is not None:
+            items = [self.products_by_id[pid] for _, pid in self.price_range(min_price, max_price)]
+        elif sort == "newest":
+            return self.newest()
+        elif sort == "price_asc":
+            return [self.products_by_id[pid] for _, pid in self.by_price]
+        elif sort == "price_desc":
+            return [self.products_by_id[pid] for _, pid in reversed(self.by_price)]
+        else:
+            return None
+        if sort == "newest":
+            items.sort(key=feed_key, reverse=True)
+        elif sort == "price_asc":
+            items.sort(key=price_key)
+        elif sort == "price_desc":
+            items.sort(key=price_key, reverse=True)
+        return items
+
+# ===== User Search =====
+USER_SEARCH_LIMIT = 20
+
+def ngrams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+class UserSearch:
+    # Infix search over usernames and display names. Every 2- and 3-gram of
+    # both (lower-cased) points at the usernames containing it; a query is
+    # answered by intersecting its grams and checking the few candidates.
+    # One-letter queries fall back to a prefix lookup in a sorted list.
+    def __init__(self):
+        self.grams = {}      # 2/3-gram -> usernames
+        self.prefixes = []   # sorted (lower text, username) for names and usernames
+        self.users = {}      # username -> user, in registration order
+
+    def texts(self, user):
+        return {user.account.username.lower(), user.name.lower()}
+
+    def add(self, user):
+        username = user.account.username
+        if username in self.users:
+            self.remove(self.users[username])
+        self.users[username] = user
+        for text in self.texts(user):
+            for gram in ngrams(text, 2) | ngrams(text, 3):
+                self.grams.setdefault(gram, set()).add(username)
+            bisect.insort(self.prefixes, (text, username))
+
+    def remove(self, user):
+        username = user.account.username
+        if self.users.pop(username, None) is None:
+            return
+        for text in self.texts(user):
+            for gram in ngrams(text, 2) | ngrams(text, 3):
+                holders = self.grams.get(gram)
+                if holders:
+                    holders.discard(username)
+                    if not holders:
+                        del self.grams[gram]
+            remove_sorted(self.prefixes, (text, username))
+
+    def candidates(self, q):
+        if len(q) == 1:
+            i = bisect.bisect_left(self.prefixes, (q,))
+            found = set()
+            while i < len(self.prefixes) and self.prefixes[i][0].startswith(q):
+                found.add(self.prefixes[i][1])
+                i += 1
+            return found
+        n = 3 if len(q) >= 3 else 2
+        sets = sorted((self.grams.get(g, set()) for g in ngrams(q, n)), key=len)
+        if not sets or not sets[0]:
+            return set()
+        return sets[0].intersection(*sets[1:])
+
+    def rank(self, user, q):
+        # 0 exact, 1 prefix, 2 infix, None if no match
+        best = None
+        for text in self.texts(user):
+            if text == q:
+                return 0
+            if text.startswith(q):
+                best = 1
+            elif q in text and best is None:
+                best = 2
+        return best
+
+    def search(self, query, limit=USER_SEARCH_LIMIT, offset=0, exclude=None):
+        # (page of users, has_more). Empty query pages through all users.
+        q = query.strip().lower()
+        if not q:
+            # registration order is the dict order; walk only as far as the page
+            rest = (user for username, user in self.users.items() if username != exclude)
+            window = list(islice(rest, offset, offset + limit + 1))
+            return window[:limit], len(window) > limit
+        hits = []
+        for username in self.candidates(q):
+            if username == exclude:
+                continue
+            user = self.users[username]
+            r = self.rank(user, q)
+            if r is not None:
+                hits.append((r, user.name.lower(), username))
+        hits.sort()
+        ranked = [self.users[username] for _, _, username in hits]
+        page = ranked[offset:offset + limit]
+        return page, len(ranked) > offset + limit
+
+# ===== Job Board =====
+class JobBoard:
+    def __init__(self):
+        self.jobs = []
+        self.jobs_by_id = {}
+        self.index = SearchIndex({"job_title": 3, "company": 2, "requirements": 1})
+
+    def add_job(self, job):
+        self.jobs.append(job)
+        self.jobs_by_id[int(job.post_id)] = job
+        self.index.add(int(job.post_id), job)
+
+    def remove_job(self, job):
+        if self.jobs_by_id.pop(int(job.post_id), None) is not None:
+            self.jobs.remove(job)
+            self.index.remove(int(job.post_id))
+
+    def get(self, post_id):
+        return self.jobs_by_id.get(int(post_id))
+
+    def search(self, query, limit=None):
+        # ranked by title > company > requirements; "quoted phrases" supported
+        return self.index.search(query, limit)
+
+# ===== Seeded Shuffling =====
+# Random listings use a keyed Feistel permutation of 0..n-1 instead of
+# random.shuffle: position i of the shuffled order is computed directly, so
+# page k costs O(page size) and the same seed always gives the same order
+# (stable paging, cacheable pages). Cycle walking folds the power-of-four
+# domain back onto 0..n-1; it needs fewer than four steps on average.
+SHUFFLE_WINDOW = int(os.environ.get("BLEX_SHUFFLE_WINDOW", "3600"))  # seconds an order stays fixed
+SHUFFLE_PAGE_SIZE = int(os.environ.get("BLEX_SHUFFLE_PAGE_SIZE", "24"))
+SHUFFLE_ROUNDS = 4
+MASK64 = (1 << 64) - 1
+
+def shuffle_window(now=None):
+    now = time.time() if now is None else now
+    return int(now // SHUFFLE_WINDOW) if SHUFFLE_WINDOW > 0 else 0
+
+def shuffle_seed(base, now=None):
+    # same base in the same time window -> same order
+    digest = hashlib.sha256(f"{base}:{shuffle_window(now)}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+def mix64(x):
+    # splitmix64 finalizer
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+class SeededPermutation:
+    def __init__(self, n, seed):
+        self.n = n
+        bits = max(2, (n - 1).bit_length())
+        self.half = (bits + 1) // 2
+        self.mask = (1 << self.half) - 1
+        self.keys = [mix64((seed + r * 0x9E3779B97F4A7C15) & MASK64) for r in range(SHUFFLE_ROUNDS)]
+
+    def __len__(self):
+        return self.n
+
+    def encrypt(self, x):
+        left, right = x >> self.half, x & self.mask
+        for key in self.keys:
+            left, right = right, left ^ (mix64((right + key) & MASK64) & self.mask)
+        return (left << self.half) | right
+
+    def at(self, i):
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        x = self.encrypt(i)
+        while x >= self.n:
+            x = self.encrypt(x)
+        return x
+
+    def __iter__(self):
+        return (self.at(i) for i in range(self.n))
+
+    def page(self, k, size):
+        # positions of page k (0-based)
+        start = k * size
+        return [self.at(i) for i in range(start, min(self.n, start + size))]
+
+def shuffled_page(items, seed, page=1, page_size=None):
+    # page is 1-based; returns (items, has_more)
+    page_size = page_size or SHUFFLE_PAGE_SIZE
+    perm = SeededPermutation(len(items), seed)
+    picked = [items[i] for i in perm.page(page - 1, page_size)]
+    return picked, page * page_size < len(items)
+
+def shuffled(items, seed):
+    perm = SeededPermutation(len(items), seed)
+    return (items[i] for i in perm)
+
+# ===== Feed =====
+FEED_PAGE_SIZE = int(os.environ.get("BLEX_FEED_PAGE_SIZE", "20"))
+
+def feed_key(post):
+    return (post.timestamp, int(post.post_id))
+
+def price_key(product):
+    return (float(product.price), int(product.post_id))
+
+def format_cursor(key):
+    timestamp, post_id = key
+    return f"{timestamp.isoformat()}_{post_id}"
+
+def parse_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        timestamp, post_id = cursor.rsplit("_", 1)
+        return (datetime.fromisoformat(timestamp), int(post_id))
+    except ValueError:
+        return None
+
+def parse_timestamp(ts):
+    # flat files store str(datetime)
+    try:
+        return datetime.fromisoformat(ts)
+    except (TypeError, ValueError):
+        return None
+
+# ===== Social Graph =====
+# Follow edges as adjacency sets in both directions, keyed by username.
+# A user's own `following`/`followers` attributes are the very same set
+# objects, so membership, insert and delete are O(1) either way.
+class SocialGraph:
+    def __init__(self):
+        self.following = {}   # username -> usernames they follow
+        self.followers = {}   # username -> usernames following them
+
+    def add_user(self, user):
+        username = user.account.username
+        self.following[username] = user._following
+        self.followers[username] = user._followers
+
+    def remove_user(self, username):
+        for followed in self.following.pop(username, set()):
+            self.followers.get(followed, set()).discard(username)
+        for follower in self.followers.pop(username, set()):
+            self.following.get(follower, set()).discard(username)
+
+    def follow(self, follower, followed):
+        # False if either user is unknown or the edge already exists
+        if follower == followed or followed not in self.followers or follower not in self.following:
+            return False
+        if followed in self.following[follower]:
+            return False
+        self.following[follower].add(followed)
+        self.followers[followed].add(follower)
+        return True
+
+    def unfollow(self, follower, followed):
+        if followed not in self.following.get(follower, ()):
+            return False
+        self.following[follower].discard(followed)
+        self.followers[followed].discard(follower)
+        return True
+
+    def is_following(self, follower, followed):
+        return followed in self.following.get(follower, ())
+
+    def following_of(self, username):
+        return self.following.get(username, set())
+
+    def followers_of(self, username):
+        return self.followers.get(username, set())
+
+    def following_count(self, username):
+        return len(self.following.get(username, ()))
+
+    def follower_count(self, username):
+        return len(self.followers.get(username, ()))
+
+    def clear_edges(self):
+        for targets in self.following.values():
+            targets.clear()
+        for sources in self.followers.values():
+            sources.clear()
+
+    def load_edges(self, pairs):
+        # bulk insert; unknown usernames and self-follows are skipped
+        following, followers = self.following, self.followers
+        for follower, followed in pairs:
+            if follower != followed and follower in following and followed in followers:
+                following[follower].add(followed)
+                followers[followed].add(follower)
+
+    def edges(self):
+        for follower, targets in self.following.items():
+            for followed in targets:
+                yield follower, followed
+
+    def edge_count(self):
+        return sum(len(targets) for targets in self.following.values())
+
+# ===== Messaging =====
+MESSAGE_PAGE_SIZE = int(os.environ.get("BLEX_MESSAGE_PAGE_SIZE", "20"))
+
+class MessageList:
+    # messages kept sorted by Message.key, with a parallel key list to bisect
+    def __init__(self):
+        self.keys = []
+        self.items = []
+
+    def add(self, message):
+        key = message.key
+        if not self.keys or key >= self.keys[-1]:
+            self.keys.append(key)
+            self.items.append(message)
+        else:
+            i = bisect.bisect_right(self.keys, key)
+            self.keys.insert(i, key)
+            self.items.insert(i, message)
+
+    def page(self, cursor=None, limit=None):
+        # newest first, older than `cursor`; returns (messages, next_cursor)
+        limit = limit or MESSAGE_PAGE_SIZE
+        end = len(self.keys)
+        key = parse_cursor(cursor)
+        if key:
+            end = bisect.bisect_left(self.keys, key)
+        start = max(0, end - limit)
+        next_cursor = format_cursor(self.keys[start]) if start > 0 else None
+        return self.items[start:end][::-1], next_cursor
+
+    def at(self, timestamp):
+        # messages sent at exactly `timestamp`
+        lo = bisect.bisect_left(self.keys, (timestamp,))
+        hi = bisect.bisect_left(self.keys, (timestamp, float("inf")))
+        return self.items[lo:hi]
+
+    def count_after(self, key):
+        if key is None:
+            return len(self.keys)
+        return len(self.keys) - bisect.bisect_right(self.keys, key)
+
+    def newest_key(self):
+        return self.keys[-1] if self.keys else None
+
+class MessageStore:
+    # Messages indexed by receiver and by conversation (unordered pair of
+    # usernames), so an inbox or thread only touches that user's messages.
+    # Read state is the key of the newest message a user has seen, saved to
+    # message_reads like any other change so every worker agrees on it.
+    def __init__(self):
+        self.messages = []      # arrival order, used for full syncs
+        self.by_receiver = {}   # username -> MessageList
+        self.by_pair = {}       # (username, username) sorted -> MessageList
+        self.last_read = {}     # username -> ReadMark
+
+    def __len__(self):
+        return len(self.messages)
+
+    def pair(self, a, b):
+        return (a, b) if a <= b else (b, a)
+
+    def add(self, message):
+        self.messages.append(message)
+        sender = message.sender.account.username
+        receiver = message.receiver.account.username
+        self.by_receiver.setdefault(receiver, MessageList()).add(message)
+        self.by_pair.setdefault(self.pair(sender, receiver), MessageList()).add(message)
+
+    def inbox(self, username, cursor=None, limit=None):
+        received = self.by_receiver.get(username)
+        return received.page(cursor, limit) if received else ([], None)
+
+    def conversation(self, a, b, cursor=None, limit=None):
+        thread = self.by_pair.get(self.pair(a, b))
+        return thread.page(cursor, limit) if thread else ([], None)
+
+    def has(self, sender, receiver, timestamp, content):
+        thread = self.by_pair.get(self.pair(sender, receiver))
+        return bool(thread) and any(
+            m.sender.account.username == sender and m.content == content for m in thread.at(timestamp)
+        )
+
+    def unread_count(self, username):
+        received = self.by_receiver.get(username)
+        if not received:
+            return 0
+        mark = self.last_read.get(username)
+        return received.count_after(mark.key if mark else None)
+
+    def mark_read(self, username):
+        # callers save_changes() afterwards
+        received = self.by_receiver.get(username)
+        if received and received.keys:
+            mark = self.set_read(username, received.newest_key())
+            if mark:
+                mark.mark_dirty()
+
+    def set_read(self, username, key):
+        # move the read mark forward without recording a change (loaders,
+        # replays); returns the mark if it moved
+        mark = self.last_read.get(username)
+        if mark is None:
+            mark = self.last_read[username] = ReadMark(username, key)
+        elif key > mark.key:
+            mark.timestamp, mark.message_id = key
+        else:
+            return None
+        return mark
+
+# ===== Repository =====
+DATA_COLLECTIONS = ("users", "posts", "market", "jobs", "graph", "messages")
+
+def collections_of(obj):
+    # data versions a written object invalidates
+    if isinstance(obj, User):
+        return ("users",)
+    if isinstance(obj, ProductPost):
+        return ("posts", "market")
+    if isinstance(obj, JobPost):
+        return ("posts", "jobs")
+    if isinstance(obj, (Post, Interaction)):
+        return ("posts",)
+    if isinstance(obj, Marketplace):
+        return ("market",)
+    if isinstance(obj, (Message, ReadMark)):
+        return ("messages",)
+    return ()
+
+# In-memory dataset plus the dict indexes used for lookups. Every create/delete
+# goes through add_*/remove_* so the indexes never drift from the lists.
+class Repository:
+    def __init__(self, users=None, posts=None, messages=None, marketplace=None):
+        self.users = []
+        self.posts = []
+        self.message_store = MessageStore()
+        self.messages = self.message_store.messages
+        self.marketplace = marketplace if marketplace is not None else Marketplace()
+        self.graph = SocialGraph()
+        self.job_board = JobBoard()
+        self.user_search = UserSearch()
+        self.users_by_username = {}   # lower-cased username -> user
+        self.users_by_name = {}       # lower-cased display name -> [users]
+        self.users_by_id = {}         # user_id -> user
+        self.posts_by_id = {}         # post_id -> post
+        self.posts_by_author = {}     # username -> [posts]
+        self.interactions = InteractionStore(self.users_by_id)   # likes and comments of every post
+        self.feed_keys = []           # sorted (timestamp, post_id) of every NormalPost
+        self.load_timings = {}        # seconds per table/phase of the last load_all()
+        self.media_store = None       # MediaStore keeping blob reference counts
+        # data versions, bumped by every committed or replayed write; pages
+        # build their ETags from the versions of the collections they show
+        self.epoch = f"{os.getpid()}-{random.getrandbits(32):08x}"
+        self.versions = dict.fromkeys(DATA_COLLECTIONS, 0)
+        for u in users or []:
+            self.add_user(u)
+        for p in posts or []:
+            self.add_post(p)
+        for m in messages or []:
+            self.add_message(m)
+
+    def replace(self, other):
+        # take over a freshly loaded dataset in place, since the app keeps
+        # this object; the new epoch retires every ETag handed out so far
+        store = self.media_store
+        self.__dict__.update(other.__dict__)
+        if store:
+            self.attach_media_store(store)
+
+    # --- data versions ---
+    def touch(self, *names):
+        for name in names:
+            self.versions[name] += 1
+
+    def etag(self, names, *parts):
+        # versions only count within this process, hence the epoch
+        raw = "|".join([self.epoch] + [f"{n}={self.versions[n]}" for n in names] + [str(p) for p in parts])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    # --- users ---
+    def rename_user(self, user, name):
+        same_name = self.users_by_name.get(user.name.lower(), [])
+        if user in same_name:
+            same_name.remove(user)
+            if not same_name:
+                del self.users_by_name[user.name.lower()]
+        self.user_search.remove(user)
+        user.name = name
+        self.users_by_name.setdefault(name.lower(), []).append(user)
+        self.user_search.add(user)
+
+    def add_user(self, user):
+        self.users.append(user)
+        self.users_by_username[user.account.username.lower()] = user
+        self.users_by_name.setdefault(user.name.lower(), []).append(user)
+        self.users_by_id[user.user_id] = user
+        self.graph.add_user(user)
+        self.user_search.add(user)
+
+    def remove_user(self, user):
+        self.users.remove(user)
+        self.users_by_username.pop(user.account.username.lower(), None)
+        same_name = self.users_by_name.get(user.name.lower(), [])
+        if user in same_name:
+            same_name.remove(user)
+            if not same_name:
+                del self.users_by_name[user.name.lower()]
+        self.users_by_id.pop(user.user_id, None)
+        self.graph.remove_user(user.account.username)
+        self.user_search.remove(user)
+
+    def get_user(self, username):
+        return self.users_by_username.get(username.strip().lower())
+
+    def get_user_by_id(self, user_id):
+        return self.users_by_id.get(user_id)
+
+    def find_user(self, identifier):
+        # exact username first, then exact display name (same as find_user)
+        identifier = identifier.strip().lower()
+        user = self.users_by_username.get(identifier)
+        if user:
+            return user
+        same_name = self.users_by_name.get(identifier)
+        return same_name[0] if same_name else None
+
+    # --- posts ---
+    def attach_media_store(self, store):
+        self.media_store = store
+        store.rebuild(self.posts)
+
+    def add_post(self, post):
+        self.posts.append(post)
+        post.attach(self.interactions)
+        if self.media_store:
+            self.media_store.acquire(post.media.url)
+        self.posts_by_id[int(post.post_id)] = post
+        if post.author:
+            self.posts_by_author.setdefault(post.author.account.username, []).append(post)
+        if isinstance(post, NormalPost):
+            bisect.insort(self.feed_keys, feed_key(post))
+        elif isinstance(post, JobPost):
+            self.job_board.add_job(post)
+
+    def remove_post(self, post, keep_interactions=False):
+        # keep_interactions: the post is about to be replaced by a newer copy
+        self.posts.remove(post)
+        if not keep_interactions:
+            self.interactions.drop_post(int(post.post_id))
+        if self.media_store:
+            self.media_store.release(post.media.url)
+        self.posts_by_id.pop(int(post.post_id), None)
+        if post.author:
+            own = self.posts_by_author.get(post.author.account.username, [])
+            if post in own:
+                own.remove(post)
+        if isinstance(post, ProductPost):
+            self.marketplace.remove_product(post)
+        if isinstance(post, NormalPost):
+            remove_sorted(self.feed_keys, feed_key(post))
+        elif isinstance(post, JobPost):
+            self.job_board.remove_job(post)
+
+    def get_post(self, post_id):
+        return self.posts_by_id.get(int(post_id))
+
+    def user_posts(self, user):
+        return self.posts_by_author.get(user.account.username, [])
+
+    def likes_received(self, user):
+        return sum(p.like_count for p in self.user_posts(user))
+
+    def likes_by_author(self):
+        # username -> likes received over all of their posts
+        def author_of(post_id):
+            post = self.posts_by_id.get(post_id)
+            return post.author.account.username if post and post.author else None
+        return self.interactions.author_totals(author_of)
+
+    def top_liked_posts(self, n=10):
+        return [(self.posts_by_id[pid], count) for pid, count in self.interactions.top_liked(n)
+                if pid in self.posts_by_id]
+
+    def feed_page(self, cursor=None, page_size=None):
+        # Newest-first page of NormalPosts older than `cursor`.
+        # Returns (posts, next_cursor); next_cursor is None on the last page.
+        page_size = page_size or FEED_PAGE_SIZE
+        end = len(self.feed_keys)
+        key = parse_cursor(cursor)
+        if key:
+            end = bisect.bisect_left(self.feed_keys, key)
+        start = max(0, end - page_size)
+        page = [self.posts_by_id[pid] for _, pid in reversed(self.feed_keys[start:end])]
+        next_cursor = format_cursor(self.feed_keys[start]) if start > 0 else None
+        return page, next_cursor
+
+    # --- messages ---
+    def add_message(self, message):
+        self.message_store.add(message)
 
 # --- USERS ---
 def clear_users_db():
-    db = get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM users")
-    db.commit()
-    db.close()
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM users")
+        db.commit()
 
-def save_users_db(users):
-    db = get_db_connection()
-    cursor = db.cursor()
-    sql = """
-    INSERT INTO users
-      (user_id, username, password_hash, role, name, bio, profile_pic)
-    VALUES (%s, %s, %s, %s, %s, %s, %s)
+USER_INSERT = "INSERT INTO users (user_id, username, password_hash, role, name, bio, profile_pic)"
+USER_UPSERT_TAIL = """
     ON DUPLICATE KEY UPDATE
       password_hash = VALUES(password_hash),
       role          = VALUES(role),
@@ -260,34 +2198,37 @@ def save_users_db(users):
       bio           = VALUES(bio),
       profile_pic   = VALUES(profile_pic)
     """
-    for user in users:
-        cursor.execute(sql, (
-            user.user_id,
-            user.account.username,
-            user.account._password_hash,
-            user.account.role,
-            user.name,
-            user.bio,
-            user.profile_pic
-        ))
-    db.commit()
-    db.close()
-
-
-def load_users_db():
-    users = []
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM users")
-    for row in cursor.fetchall():
-        acc = Account(row['username'], "dummy", row['role'], password_hash=row['password_hash'])
-        if row['role'] == "professional":
-            user = ProfessionalUser(row['user_id'], row['name'], row['bio'], row['profile_pic'], acc)
-        else:
-            user = RegisteredUser(row['user_id'], row['name'], row['bio'], row['profile_pic'], acc)
-        users.append(user)
-    db.close()
-    return users
+
+def user_row(user):
+    return (
+        user.user_id,
+        user.account.username,
+        user.account._password_hash,
+        user.account.role,
+        user.name,
+        user.bio,
+        user.profile_pic
+    )
+
+def save_users_db(users):
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        insert_many(cursor, USER_INSERT, (user_row(u) for u in users), USER_UPSERT_TAIL)
+        db.commit()
+
+
+USER_COLUMNS = ("user_id", "username", "password_hash", "role", "name", "bio", "profile_pic")
+
+def user_from_row(row):
+    acc = Account(row['username'], "dummy", row['role'], password_hash=row['password_hash'])
+    if row['role'] == "professional":
+        return ProfessionalUser(row['user_id'], row['name'], row['bio'], row['profile_pic'], acc)
+    return RegisteredUser(row['user_id'], row['name'], row['bio'], row['profile_pic'], acc)
+
+def load_users_db(rows=None):
+    if rows is None:
+        rows = fetch_rows("SELECT * FROM users")
+    return [user_from_row(row) for row in rows]
 
 def save_users_file(users, filename="users.txt"):
     with open(filename, "w") as f:
@@ -312,92 +2253,63 @@ def load_users_file(filename="users.txt"):
 
 # --- POSTS ---
 def clear_posts_db():
-    db = get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM posts")
-    db.commit()
-    db.close()
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM posts")
+        db.commit()
+
+def post_columns(post):
+    # column -> value for one posts row; the key order decides the INSERT shape
+    cols = {
+        "post_id": post.post_id,
+        "post_type": None,
+        "caption": post.caption,
+        "author_username": post.author.account.username,
+        "media_id": post.media.media_id,
+        "media_type": post.media.media_type,
+        "media_url": post.media.url,
+    }
+    if isinstance(post, NormalPost):
+        cols["post_type"] = 'normal'
+    elif isinstance(post, ProductPost):
+        cols["post_type"] = 'product'
+        cols["product_name"] = post.product_name
+        cols["price"] = post.price
+        cols["description"] = post.description
+    elif isinstance(post, JobPost):
+        cols["post_type"] = 'job'
+        cols["job_title"] = post.job_title
+        cols["company"] = post.company
+        cols["requirements"] = post.requirements
+    cols["timestamp"] = post.timestamp
+    return cols
 
 def save_posts_db(posts):
-    db = get_db_connection()
-    cursor = db.cursor()
+    # one batch stream per INSERT shape (normal / product / job)
+    shapes = {}
     for post in posts:
-        if isinstance(post, NormalPost):
-            cursor.execute(
-                "INSERT INTO posts "
-                "(post_id, post_type, caption, author_username, media_id, media_type, media_url, timestamp) "
-                "VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
-                (
-                    post.post_id,
-                    'normal',
-                    post.caption,
-                    post.author.account.username,
-                    post.media.media_id,
-                    post.media.media_type,
-                    post.media.url,
-                    post.timestamp
-                )
-            )
-        elif isinstance(post, ProductPost):
-            cursor.execute(
-                "INSERT INTO posts "
-                "(post_id, post_type, caption, author_username, media_id, media_type, media_url, "
-                "product_name, price, description, timestamp) "
-                "VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)",
-                (
-                    post.post_id,
-                    'product',
-                    post.caption,
-                    post.author.account.username,
-                    post.media.media_id,
-                    post.media.media_type,
-                    post.media.url,
-                    post.product_name,
-                    post.price,
-                    post.description,
-                    post.timestamp
-                )
-            )
-        elif isinstance(post, JobPost):
-            cursor.execute(
-                "INSERT INTO posts "
-                "(post_id, post_type, caption, author_username, media_id, media_type, media_url, "
-                "job_title, company, requirements, timestamp) "
-                "VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)",
-                (
-                    post.post_id,
-                    'job',
-                    post.caption,
-                    post.author.account.username,
-                    post.media.media_id,
-                    post.media.media_type,
-                    post.media.url,
-                    post.job_title,
-                    post.company,
-                    post.requirements,
-                    post.timestamp
-                )
-            )
-    db.commit()
-    db.close()
+        cols = post_columns(post)
+        shapes.setdefault(tuple(cols), []).append(tuple(cols.values()))
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        for columns, rows in shapes.items():
+            insert_many(cursor, "INSERT INTO posts (" + ", ".join(columns) + ")", rows)
+        db.commit()
 
-def load_posts_db(users):
-    posts = []
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM posts")
-    for row in cursor.fetchall():
-        author = next((u for u in users if u.account.username == row['author_username']), None)
-        media = Media(row['media_id'], row['media_type'], row['media_url'])
-        if row['post_type'] == 'normal':
-            post = NormalPost(row['caption'], media, author, post_id=row['post_id'], timestamp=row['timestamp'])
-        elif row['post_type'] == 'product':
-            post = ProductPost(row['product_name'], row['price'], row['description'], media, author, post_id=row['post_id'], timestamp=row['timestamp'])
-        elif row['post_type'] == 'job':
-            post = JobPost(row['job_title'], row['company'], row['requirements'], media, author, post_id=row['post_id'], timestamp=row['timestamp'])
-        posts.append(post)
-    db.close()
-    return posts
+def post_from_row(repo, row):
+    author = repo.get_user(row['author_username'])
+    media = Media(row['media_id'], row['media_type'], row['media_url'])
+    if row['post_type'] == 'normal':
+        return NormalPost(row['caption'], media, author, post_id=row['post_id'], timestamp=row['timestamp'])
+    elif row['post_type'] == 'product':
+        return ProductPost(row['product_name'], row['price'], row['description'], media, author, post_id=row['post_id'], timestamp=row['timestamp'])
+    elif row['post_type'] == 'job':
+        return JobPost(row['job_title'], row['company'], row['requirements'], media, author, post_id=row['post_id'], timestamp=row['timestamp'])
+
+def load_posts_db(repo, rows=None):
+    if rows is None:
+        rows = fetch_rows("SELECT * FROM posts")
+    return [post_from_row(repo, row) for row in rows]
 
 def save_posts_file(posts, filename="posts.txt"):
     with open(filename, "w") as f:
@@ -409,7 +2321,7 @@ def save_posts_file(posts, filename="posts.txt"):
             elif isinstance(p, JobPost):
                 f.write(f"JobPost|{p.post_id}|{p.caption}|{p.author.account.username}|{p.media.media_id},{p.media.media_type},{p.media.url}|{p.job_title},{p.company},{p.requirements}|{p.timestamp}\n")
 
-def load_posts_file(users, filename="posts.txt"):
+def load_posts_file(repo, filename="posts.txt"):
     posts = []
     if not os.path.exists(filename):
         return posts
@@ -421,264 +2333,1419 @@ def load_posts_file(users, filename="posts.txt"):
                 _, pid, caption, author_username, media_str, ts = parts
                 media_id, media_type, media_url = media_str.split(",")
                 media = Media(media_id, media_type, media_url)
-                author = next((u for u in users if u.account.username == author_username), None)
-                post = NormalPost(caption, media, author, post_id=int(pid), timestamp=ts)
+                author = repo.get_user(author_username)
+                post = NormalPost(caption, media, author, post_id=int(pid), timestamp=parse_timestamp(ts))
                 posts.append(post)
             elif ptype == "ProductPost":
                 _, pid, caption, author_username, media_str, info, ts = parts
                 media_id, media_type, media_url = media_str.split(",")
                 product_name, price, description = info.split(",", 2)
                 media = Media(media_id, media_type, media_url)
-                author = next((u for u in users if u.account.username == author_username), None)
-                post = ProductPost(product_name, float(price), description, media, author, post_id=int(pid), timestamp=ts)
+                author = repo.get_user(author_username)
+                post = ProductPost(product_name, float(price), description, media, author, post_id=int(pid), timestamp=parse_timestamp(ts))
                 posts.append(post)
             elif ptype == "JobPost":
                 _, pid, caption, author_username, media_str, info, ts = parts
                 media_id, media_type, media_url = media_str.split(",")
                 job_title, company, requirements = info.split(",", 2)
                 media = Media(media_id, media_type, media_url)
-                author = next((u for u in users if u.account.username == author_username), None)
-                post = JobPost(job_title, company, requirements, media, author, post_id=int(pid), timestamp=ts)
+                author = repo.get_user(author_username)
+                post = JobPost(job_title, company, requirements, media, author, post_id=int(pid), timestamp=parse_timestamp(ts))
                 posts.append(post)
     return posts
 
 # --- FOLLOWERS ---
-def save_followers_file(users, filename="followers.txt"):
+def save_followers_file(graph, filename="followers.txt"):
     with open(filename, "w") as f:
-        for user in users:
-            for followed_username in user.following:
-                f.write(f"{user.account.username}|{followed_username}\n")
+        for follower_username, followed_username in graph.edges():
+            f.write(f"{follower_username}|{followed_username}\n")
+
+def canonical_edges(repo, pairs):
+    # map stored usernames onto the registered spelling, drop unknown users
+    for follower_username, followed_username in pairs:
+        follower = repo.get_user(follower_username)
+        followed = repo.get_user(followed_username)
+        if follower and followed:
+            yield follower.account.username, followed.account.username
 
-def load_followers_file(users, filename="followers.txt"):
+def load_followers_file(repo, filename="followers.txt"):
     if not os.path.exists(filename):
         return
-    for user in users:
-        user.followers.clear()
-        user.following.clear()
+    repo.graph.clear_edges()
     with open(filename, "r") as f:
-        for line in f:
-            follower_username, followed_username = line.strip().split("|")
-            follower = next((u for u in users if u.account.username == follower_username), None)
-            followed = next((u for u in users if u.account.username == followed_username), None)
-            if follower and followed:
-                if followed_username not in follower.following:
-                    follower.following.append(followed_username)
-                if follower_username not in followed.followers:
-                    followed.followers.append(follower_username)
+        pairs = (line.strip().split("|") for line in f if line.strip())
+        repo.graph.load_edges(canonical_edges(repo, pairs))
 
 def clear_followers_db():
-    db = get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM followers")
-    db.commit()
-    db.close()
-
-def save_followers_db(users):
-    db = get_db_connection()
-    cursor = db.cursor()
-    for user in users:
-        for followed_username in user.following:
-            cursor.execute(
-                "INSERT INTO followers (follower_username, followed_username) VALUES (%s, %s)",
-                (user.account.username, followed_username)
-            )
-    db.commit()
-    db.close()
-
-def load_followers_db(users):
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM followers")
-    data = cursor.fetchall()
-    for user in users:
-        user.followers.clear()
-        user.following.clear()
-    for row in data:
-        follower = next((u for u in users if u.account.username == row['follower_username']), None)
-        followed = next((u for u in users if u.account.username == row['followed_username']), None)
-        if follower and followed:
-            if row['followed_username'] not in follower.following:
-                follower.following.append(row['followed_username'])
-            if row['follower_username'] not in followed.followers:
-                followed.followers.append(row['follower_username'])
-    db.close()
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM followers")
+        db.commit()
+
+def save_followers_db(graph):
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        insert_many(
+            cursor,
+            "INSERT INTO followers (follower_username, followed_username)",
+            graph.edges()
+        )
+        db.commit()
+
+def load_followers_db(repo, rows=None):
+    if rows is None:
+        rows = fetch_rows("SELECT * FROM followers")
+    repo.graph.clear_edges()
+    repo.graph.load_edges(canonical_edges(
+        repo, ((row['follower_username'], row['followed_username']) for row in rows)
+    ))
 
 # --- LIKES ---
 def clear_likes_db():
-    db = get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM likes")
-    db.commit()
-    db.close()
-
-def save_likes_db(posts):
-    db = get_db_connection()
-    cursor = db.cursor()
-    for post in posts:
-        for like in [i for i in getattr(post, "interactions", []) if isinstance(i, Like)]:
-            cursor.execute(
-                "INSERT INTO likes (post_id, username, timestamp) VALUES (%s, %s, %s)",
-                (post.post_id, like.user.account.username, like.timestamp)
-            )
-    db.commit()
-    db.close()
-
-def load_likes_db(posts, users):
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM likes")
-    for post in posts:
-        post.interactions = [i for i in getattr(post, "interactions", []) if not isinstance(i, Like)]
-    for row in cursor.fetchall():
-        post = next((p for p in posts if p.post_id == row['post_id']), None)
-        user = next((u for u in users if u.account.username == row['username']), None)
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM likes")
+        db.commit()
+
+def save_likes_db(repo):
+    users = repo.users_by_id
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        insert_many(
+            cursor,
+            "INSERT INTO likes (post_id, username, timestamp)",
+            ((post_id, users[user_id].account.username, ts)
+             for post_id, user_id, ts in repo.interactions.iter_likes()
+             if user_id in users)
+        )
+        db.commit()
+
+def load_likes_db(repo, rows=None):
+    # straight into the store's columns, no Like objects
+    if rows is None:
+        rows = fetch_rows("SELECT * FROM likes")
+    store = repo.interactions
+    store.clear_likes()
+    for row in rows:
+        post = repo.get_post(row['post_id'])
+        user = repo.get_user(row['username'])
         if post and user:
-            like = Like(user, post, timestamp=row['timestamp'])
-            post.interactions.append(like)
-    db.close()
+            store.add_like(int(post.post_id), user.user_id, row['timestamp'])
 
 # --- COMMENTS ---
 def clear_comments_db():
-    db = get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM comments")
-    db.commit()
-    db.close()
-
-def save_comments_db(posts):
-    db = get_db_connection()
-    cursor = db.cursor()
-    for post in posts:
-        for comment in [i for i in getattr(post, "interactions", []) if isinstance(i, Comment)]:
-            cursor.execute(
-                "INSERT INTO comments (post_id, username, content, timestamp) VALUES (%s, %s, %s, %s)",
-                (post.post_id, comment.user.account.username, comment.content, comment.timestamp)
-            )
-    db.commit()
-    db.close()
-
-def load_comments_db(posts, users):
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM comments")
-    for post in posts:
-        post.interactions = [i for i in getattr(post, "interactions", []) if not isinstance(i, Comment)]
-    for row in cursor.fetchall():
-        post = next((p for p in posts if p.post_id == row['post_id']), None)
-        user = next((u for u in users if u.account.username == row['username']), None)
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM comments")
+        db.commit()
+
+def save_comments_db(repo):
+    users = repo.users_by_id
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        insert_many(
+            cursor,
+            "INSERT INTO comments (post_id, username, content, timestamp)",
+            ((post_id, users[user_id].account.username, content, ts)
+             for post_id, user_id, content, ts in repo.interactions.iter_comments()
+             if user_id in users)
+        )
+        db.commit()
+
+def load_comments_db(repo, rows=None):
+    if rows is None:
+        rows = fetch_rows("SELECT * FROM comments")
+    store = repo.interactions
+    store.clear_comments()
+    for row in rows:
+        post = repo.get_post(row['post_id'])
+        user = repo.get_user(row['username'])
         if post and user:
-            comment = Comment(user, post, row['content'], timestamp=row['timestamp'])
-            post.interactions.append(comment)
-    db.close()
+            store.add_comment(int(post.post_id), user.user_id, row['content'], row['timestamp'])
 
 # --- MESSAGES ---
 def clear_messages_db():
-    db = get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM messages")
-    db.commit()
-    db.close()
-
-def save_messages_db(messages):
-    db = get_db_connection()
-    cursor = db.cursor()
-    for m in messages:
-        cursor.execute(
-            "INSERT INTO messages (sender_username, receiver_username, content, timestamp) VALUES (%s, %s, %s, %s)",
-            (m.sender.account.username, m.receiver.account.username, m.content, m.timestamp)
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM messages")
+        db.commit()
+
+def save_messages_db(store):
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        insert_many(
+            cursor,
+            "INSERT INTO messages (message_id, sender_username, receiver_username, content, timestamp)",
+            ((m.message_id, m.sender.account.username, m.receiver.account.username, m.content, m.timestamp)
+             for m in store.messages)
         )
-    db.commit()
-    db.close()
+        db.commit()
 
-def load_messages_db(users):
+def load_messages_db(repo, rows=None):
+    # oldest first, the order add_message() keeps them in
+    if rows is None:
+        rows = fetch_rows("SELECT * FROM messages")
     messages = []
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM messages")
-    for row in cursor.fetchall():
-        sender = next((u for u in users if u.account.username == row['sender_username']), None)
-        receiver = next((u for u in users if u.account.username == row['receiver_username']), None)
+    for row in rows:
+        sender = repo.get_user(row['sender_username'])
+        receiver = repo.get_user(row['receiver_username'])
         if sender and receiver:
-            msg = Message(sender, receiver, row['content'], timestamp=row['timestamp'])
+            message_id = row.get('message_id') or id_allocator.next_id("messages")
+            msg = Message(message_id, sender, receiver, row['content'], timestamp=row['timestamp'])
             messages.append(msg)
-    db.close()
+    messages.sort(key=lambda m: m.key)
     return messages
 
+# Message ids and read marks. Older databases have a messages table without
+# message_id: the column is added and filled oldest first, guarded by
+# "message_id IS NULL", so workers starting together end up with the same ids.
+MESSAGE_READS_CREATE = ("CREATE TABLE IF NOT EXISTS message_reads ("
+                        "username VARCHAR(255) PRIMARY KEY, last_read_at DATETIME(6) NOT NULL, "
+                        "last_read_id BIGINT NOT NULL)")
+MESSAGE_READS_UPSERT = ("ON DUPLICATE KEY UPDATE last_read_at=VALUES(last_read_at), "
+                        "last_read_id=VALUES(last_read_id)")
+
+def ensure_message_tables():
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute(MESSAGE_READS_CREATE)
+        cursor.execute("SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+                       "AND TABLE_NAME = 'messages' AND COLUMN_NAME = 'message_id'")
+        if not cursor.fetchone()[0]:
+            try:
+                cursor.execute("ALTER TABLE messages ADD COLUMN message_id BIGINT NULL, "
+                               "ADD INDEX messages_message_id (message_id)")
+            except mysql.connector.Error as err:
+                print(f"messages.message_id not added (another worker may have): {err}")
+        cursor.execute("SELECT sender_username, receiver_username, content, timestamp FROM messages "
+                       "WHERE message_id IS NULL ORDER BY timestamp")
+        legacy = cursor.fetchall()
+        for sender, receiver, content, ts in legacy:
+            cursor.execute("UPDATE messages SET message_id=%s WHERE sender_username=%s AND receiver_username=%s "
+                           "AND content=%s AND timestamp=%s AND message_id IS NULL LIMIT 1",
+                           (id_allocator.next_id("messages"), sender, receiver, content, ts))
+        db.commit()
+
+def ensure_media_index():
+    # MediaStore.collect() looks posts up by media_url
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("SELECT COUNT(*) FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() "
+                       "AND TABLE_NAME = 'posts' AND COLUMN_NAME = 'media_url'")
+        if cursor.fetchone()[0]:
+            return
+        cursor.execute("SELECT CHARACTER_MAXIMUM_LENGTH FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() "
+                       "AND TABLE_NAME = 'posts' AND COLUMN_NAME = 'media_url'")
+        row = cursor.fetchone()
+        # TEXT columns can only be indexed by a prefix; urls are far shorter
+        prefix = min(row[0] or 191, 191) if row else 191
+        try:
+            cursor.execute(f"ALTER TABLE posts ADD INDEX posts_media_url (media_url({prefix}))")
+        except mysql.connector.Error as err:
+            print(f"posts.media_url index not added (another worker may have): {err}")
+
+def clear_message_reads_db():
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM message_reads")
+        db.commit()
+
+def save_message_reads_db(store):
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        insert_many(
+            cursor,
+            "INSERT INTO message_reads (username, last_read_at, last_read_id)",
+            ((mark.username, mark.timestamp, mark.message_id) for mark in store.last_read.values())
+        )
+        db.commit()
+
+def load_message_reads_db(repo, rows=None):
+    if rows is None:
+        rows = fetch_rows("SELECT * FROM message_reads")
+    store = repo.message_store
+    for row in rows:
+        store.set_read(row['username'], (row['last_read_at'], row['last_read_id']))
+
 # --- MARKETPLACE ---
 def clear_marketplace_db():
-    db = get_db_connection()
-    cursor = db.cursor()
-    cursor.execute("DELETE FROM marketplace")
-    db.commit()
-    db.close()
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM marketplace")
+        db.commit()
 
 def save_marketplace_db(marketplace):
-    db = get_db_connection()
-    cursor = db.cursor()
-    for product in marketplace.products:
-        cursor.execute(
-            "INSERT INTO marketplace (post_id) VALUES (%s)",
-            (product.post_id,)
-        )
-    db.commit()
-    db.close()
+    with db_pool.connection() as db:
+        cursor = db.cursor()
+        insert_many(cursor, "INSERT INTO marketplace (post_id)", ((p.post_id,) for p in marketplace.products))
+        db.commit()
 
-def load_marketplace_db(posts):
+def load_marketplace_db(posts, rows=None):
     marketplace = Marketplace()
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-
     # Optional: load existing post_ids from marketplace table
-    cursor.execute("SELECT post_id FROM marketplace")
-    existing_ids = set(row['post_id'] for row in cursor.fetchall())
+    if rows is None:
+        rows = fetch_rows("SELECT post_id FROM marketplace")
+    existing_ids = set(row['post_id'] for row in rows)
 
+    missing = []
     for p in posts:
         if isinstance(p, ProductPost):
             # Add to in-memory marketplace
             marketplace.add_product(p)
             # If not saved before, insert it now
             if p.post_id not in existing_ids:
-                cursor2 = db.cursor()
-                cursor2.execute("INSERT INTO marketplace (post_id) VALUES (%s)", (p.post_id,))
-                db.commit()
+                missing.append((p.post_id,))
+    if missing:
+        with db_pool.connection() as db:
+            insert_many(db.cursor(), "INSERT INTO marketplace (post_id)", missing)
+            db.commit()
 
-    db.close()
     return marketplace
 
+# --- INCREMENTAL SAVE ---
+def write_order(obj):
+    # parents before children on insert, children before parents on delete
+    ranks = [User, Post, Marketplace, Interaction, Message, ReadMark]
+    rank = next(i for i, cls in enumerate(ranks) if isinstance(obj, cls))
+    return -rank if obj._state == DELETED else rank
+
+def write_user(cursor, user):
+    if user._state == NEW:
+        insert_many(cursor, USER_INSERT, [user_row(user)], USER_UPSERT_TAIL)
+    elif user._state == DIRTY:
+        cursor.execute(
+            "UPDATE users SET password_hash=%s, role=%s, name=%s, bio=%s, profile_pic=%s WHERE username=%s",
+            (user.account._password_hash, user.account.role, user.name, user.bio, user.profile_pic, user.account.username)
+        )
+    elif user._state == DELETED:
+        cursor.execute("DELETE FROM followers WHERE follower_username=%s OR followed_username=%s",
+                       (user.account.username, user.account.username))
+        cursor.execute("DELETE FROM users WHERE username=%s", (user.account.username,))
+
+def write_post(cursor, post):
+    cols = post_columns(post)
+    if post._state == NEW:
+        cursor.execute(
+            "INSERT INTO posts (" + ", ".join(cols) + ") VALUES (" + ",".join(["%s"] * len(cols)) + ")",
+            tuple(cols.values())
+        )
+    elif post._state == DIRTY:
+        del cols["post_id"]
+        cursor.execute(
+            "UPDATE posts SET " + ", ".join(f"{c}=%s" for c in cols) + " WHERE post_id=%s",
+            tuple(cols.values()) + (post.post_id,)
+        )
+    elif post._state == DELETED:
+        for table in ("likes", "comments", "marketplace", "posts"):
+            cursor.execute(f"DELETE FROM {table} WHERE post_id=%s", (post.post_id,))
+
+def write_interaction(cursor, interaction):
+    username = interaction.user.account.username
+    post_id = interaction.post.post_id
+    if isinstance(interaction, Like):
+        if interaction._state == NEW:
+            cursor.execute("INSERT INTO likes (post_id, username, timestamp) VALUES (%s, %s, %s)",
+                           (post_id, username, interaction.timestamp))
+        elif interaction._state == DELETED:
+            cursor.execute("DELETE FROM likes WHERE post_id=%s AND username=%s", (post_id, username))
+    elif isinstance(interaction, Comment):
+        if interaction._state == NEW:
+            cursor.execute("INSERT INTO comments (post_id, username, content, timestamp) VALUES (%s, %s, %s, %s)",
+                           (post_id, username, interaction.content, interaction.timestamp))
+        elif interaction._state == DIRTY:
+            cursor.execute("UPDATE comments SET content=%s WHERE post_id=%s AND username=%s AND timestamp=%s",
+                           (interaction.content, post_id, username, interaction.timestamp))
+        elif interaction._state == DELETED:
+            cursor.execute("DELETE FROM comments WHERE post_id=%s AND username=%s AND timestamp=%s",
+                           (post_id, username, interaction.timestamp))
+
+def write_message(cursor, m):
+    if m._state == NEW:
+        cursor.execute(
+            "INSERT INTO messages (message_id, sender_username, receiver_username, content, timestamp) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            (m.message_id, m.sender.account.username, m.receiver.account.username, m.content, m.timestamp)
+        )
+    elif m._state == DELETED:
+        cursor.execute("DELETE FROM messages WHERE message_id=%s", (m.message_id,))
+
+def write_read_mark(cursor, mark):
+    insert_many(cursor, "INSERT INTO message_reads (username, last_read_at, last_read_id)",
+                [(mark.username, mark.timestamp, mark.message_id)], MESSAGE_READS_UPSERT)
+
+def write_marketplace(cursor, marketplace):
+    for post_id in marketplace._removed:
+        cursor.execute("DELETE FROM marketplace WHERE post_id=%s", (post_id,))
+    for post_id in marketplace._added:
+        cursor.execute("INSERT INTO marketplace (post_id) VALUES (%s)", (post_id,))
+
+def write_object(cursor, obj):
+    if isinstance(obj, User):
+        write_user(cursor, obj)
+    elif isinstance(obj, Post):
+        write_post(cursor, obj)
+    elif isinstance(obj, Marketplace):
+        write_marketplace(cursor, obj)
+    elif isinstance(obj, Interaction):
+        write_interaction(cursor, obj)
+    elif isinstance(obj, Message):
+        write_message(cursor, obj)
+    elif isinstance(obj, ReadMark):
+        write_read_mark(cursor, obj)
+
+def save_changes(repo):
+    with metrics.timer("blex_persistence_seconds", phase="save_changes"):
+        _save_changes(repo)
+
+def _save_changes(repo):
+    # Write everything registered in `changes` in a single transaction.
+    # On failure the transaction is rolled back and the changes stay pending.
+    with changes.lock:
+        if changes.is_empty():
+            return
+        objs = sorted(changes.pending.values(), key=write_order)
+        edges = changes.edges[:]
+        entries = list(change_rows(objs, edges))
+        if FILES_BACKEND:
+            # one journal append, still under the lock so the journal
+            # keeps commit order
+            file_journal.append(entries)
+        else:
+            with db_pool.connection() as db:
+                cursor = db.cursor()
+                try:
+                    for obj in objs:
+                        write_object(cursor, obj)
+                    for op, follower, followed in edges:
+                        if op == "add":
+                            cursor.execute(
+                                "INSERT INTO followers (follower_username, followed_username) VALUES (%s, %s)",
+                                (follower, followed)
+                            )
+                        else:
+                            cursor.execute(
+                                "DELETE FROM followers WHERE follower_username=%s AND followed_username=%s",
+                                (follower, followed)
+                            )
+                    # same transaction, so other workers see the log iff the data
+                    change_feed.write(cursor, entries)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+        changes.reset()
+    for obj in objs:
+        repo.touch(*collections_of(obj))
+    if edges:
+        repo.touch("graph")
+    # blobs of deleted posts can go once the delete is committed
+    if repo.media_store:
+        repo.media_store.collect()
+
+# --- CHANGE LOG ---
+# Every worker serves requests from its own in-memory Repository. save_changes()
+# appends one change_log row per written object in the same transaction, and
+# each worker polls the log (at most every CHANGE_POLL_INTERVAL seconds) and
+# replays other workers' entries onto its Repository, so a write shows up
+# everywhere within about one poll interval without a full reload.
+CHANGE_POLL_INTERVAL = float(os.environ.get("BLEX_CHANGE_POLL_INTERVAL", "1.0"))
+CHANGE_LOG_RETENTION = 3600  # seconds a log entry is kept
+CHANGE_LOOKBACK = 100        # re-read this many ids back: ids commit out of order
+ENTITY_COLLECTIONS = {
+    "user": ("users",),
+    "post": ("posts", "market", "jobs"),
+    "market": ("market",),
+    "follow": ("graph",),
+    "like": ("posts",),
+    "comment": ("posts",),
+    "message": ("messages",),
+    "read": ("messages",),
+}
+
+def change_entries(obj):
+    # (entity, op, payload) rows describing one written object
+    state = obj._state
+    op = "delete" if state == DELETED else "upsert"
+    if isinstance(obj, User):
+        if state == DELETED:
+            return [("user", op, {"username": obj.account.username})]
+        return [("user", op, dict(zip(USER_COLUMNS, user_row(obj))))]
+    if isinstance(obj, Post):
+        if state == DELETED:
+            return [("post", op, {"post_id": obj.post_id})]
+        return [("post", op, post_columns(obj))]
+    if isinstance(obj, Marketplace):
+        return ([("market", "delete", {"post_id": pid}) for pid in obj._removed] +
+                [("market", "upsert", {"post_id": pid}) for pid in obj._added])
+    if isinstance(obj, Like):
+        return [("like", op, {"post_id": obj.post.post_id, "username": obj.user.account.username,
+                              "timestamp": obj.timestamp})]
+    if isinstance(obj, Comment):
+        return [("comment", op, {"post_id": obj.post.post_id, "username": obj.user.account.username,
+                                 "content": obj.content, "timestamp": obj.timestamp})]
+    if isinstance(obj, Message) and state == NEW:
+        return [("message", op, {"message_id": obj.message_id, "sender": obj.sender.account.username,
+                                 "receiver": obj.receiver.account.username,
+                                 "content": obj.content, "timestamp": obj.timestamp})]
+    if isinstance(obj, ReadMark):
+        return [("read", op, {"username": obj.username, "timestamp": obj.timestamp,
+                              "message_id": obj.message_id})]
+    return []
+
+def change_rows(objs, edges):
+    # (entity, op, payload) for one save_changes() batch, in write order
+    for obj in objs:
+        yield from change_entries(obj)
+    for op, follower, followed in edges:
+        yield "follow", "upsert" if op == "add" else "delete", {"follower": follower, "followed": followed}
+
+class ChangeFeed:
+    CREATE = ("CREATE TABLE IF NOT EXISTS change_log ("
+              "change_id BIGINT AUTO_INCREMENT PRIMARY KEY, origin VARCHAR(64) NOT NULL, "
+              "entity VARCHAR(16) NOT NULL, op VARCHAR(8) NOT NULL, payload TEXT NOT NULL, "
+              "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+
+    def __init__(self, interval=CHANGE_POLL_INTERVAL):
+        self.origin = f"{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}"
+        self.interval = interval
+        self.last_id = 0
+        self.seen = set()      # applied/skipped ids within the lookback window
+        self.polled = 0.0
+        self.pruned = 0.0
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = {"polls": 0, "applied": 0, "failed": 0, "reloads": 0}
+
+    def start(self):
+        # called before load_all fetches, so nothing committed after the
+        # snapshot is missed; entries already in it replay idempotently
+        try:
+            with db_pool.connection() as db:
+                cursor = db.cursor()
+                cursor.execute(self.CREATE)
+                cursor.execute("SELECT COALESCE(MAX(change_id), 0) FROM change_log")
+                self.last_id = cursor.fetchone()[0] or 0
+            self.enabled = True
+        except mysql.connector.Error as err:
+            print(f"Change log unavailable, workers will not sync: {err}")
+            self.enabled = False
+        self.seen.clear()
+        self.polled = time.monotonic()
+
+    def resume_from(self, change_id):
+        # replay everything after `change_id` (where a snapshot was taken) on
+        # the next poll; False when the log no longer reaches back that far
+        if not self.enabled or not change_id or change_id > self.last_id:
+            return False
+        if change_id < self.last_id:
+            rows = fetch_rows("SELECT COALESCE(MIN(change_id), 0) AS oldest FROM change_log")
+            oldest = rows[0]['oldest'] if rows else 0
+            if not oldest or oldest > change_id + 1:
+                return False
+        self.last_id = change_id
+        self.seen.clear()
+        self.polled = 0.0
+        return True
+
+    def write(self, cursor, entries):
+        if not self.enabled:
+            return
+        rows = [(self.origin, entity, op, json.dumps(payload, default=str)) for entity, op, payload in entries]
+        insert_many(cursor, "INSERT INTO change_log (origin, entity, op, payload)", rows)
+
+    def poll(self, repo, force=False):
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        if not force and now - self.polled < self.interval:
+            return 0
+        # one poller per process; other threads just serve what they have
+        if not self.lock.acquire(blocking=False):
+            return 0
+        try:
+            self.polled = now
+            self.counters["polls"] += 1
+            try:
+                rows = fetch_rows(
+                    "SELECT change_id, origin, entity, op, payload FROM change_log "
+                    "WHERE change_id > %s ORDER BY change_id",
+                    (max(0, self.last_id - CHANGE_LOOKBACK),)
+                )
+                # entries right after last_id were pruned before we saw them
+                # (e.g. a worker idle for longer than the retention)
+                gap = False
+                if not rows or rows[0]['change_id'] > self.last_id + 1:
+                    oldest = fetch_rows("SELECT COALESCE(MIN(change_id), 0) AS oldest FROM change_log")
+                    gap = bool(oldest) and oldest[0]['oldest'] > self.last_id + 1
+            except mysql.connector.Error as err:
+                # pages are served from memory; keep serving what we have
+                self.counters["failed"] += 1
+                print(f"Change log poll failed, serving stale data: {err}")
+                return 0
+            if gap:
+                return self.reload(repo)
+            applied = 0
+            with changes.lock:
+                for row in rows:
+                    if row['change_id'] in self.seen:
+                        continue
+                    self.seen.add(row['change_id'])
+                    self.last_id = max(self.last_id, row['change_id'])
+                    if row['origin'] == self.origin:
+                        continue
+                    try:
+                        apply_change(repo, row['entity'], row['op'], json.loads(row['payload']))
+                        repo.touch(*ENTITY_COLLECTIONS.get(row['entity'], ()))
+                        applied += 1
+                    except Exception as err:
+                        self.counters["failed"] += 1
+                        print(f"Could not apply change {row['change_id']}: {err}")
+            if applied and repo.media_store:
+                repo.media_store.collect()
+            floor = self.last_id - CHANGE_LOOKBACK
+            self.seen = {cid for cid in self.seen if cid > floor}
+            self.counters["applied"] += applied
+            if now - self.pruned > CHANGE_LOG_RETENTION / 10:
+                try:
+                    self.prune()
+                except mysql.connector.Error as err:
+                    self.counters["failed"] += 1
+                    print(f"Change log prune failed: {err}")
+                self.pruned = now
+            return applied
+        finally:
+            self.lock.release()
+
+    def reload(self, repo):
+        # the log cannot bring repo up to date any more; load everything
+        # again (load_all restarts the feed at the current end of the log)
+        print(f"Change log no longer reaches change {self.last_id + 1}, reloading")
+        with changes.lock:
+            repo.replace(load_all())
+            repo.touch(*DATA_COLLECTIONS)
+        self.counters["reloads"] += 1
+        return 0
+
+    def prune(self):
+        # keeps the newest entry we have seen, so a log that went quiet
+        # still shows later pollers how far it got
+        with db_pool.connection() as db:
+            cursor = db.cursor()
+            cursor.execute("DELETE FROM change_log WHERE created_at < NOW() - INTERVAL %s SECOND "
+                           "AND change_id < %s", (CHANGE_LOG_RETENTION, self.last_id))
+            db.commit()
+
+change_feed = ChangeFeed()
+
+def quiet_market(marketplace, post_id, action):
+    # apply a remote listing change without queueing it to be written again;
+    # under the lock no save_changes() sees the marketplace registered meanwhile
+    with changes.lock:
+        was_clean = marketplace._state == CLEAN
+        action()
+        marketplace._added.discard(post_id)
+        marketplace._removed.discard(post_id)
+        if was_clean:
+            marketplace.mark_clean()
+            changes.discard(marketplace)
+
+def apply_change(repo, entity, op, data):
+    # Replays one change_log entry. Every branch is idempotent because the
+    # lookback window and the startup snapshot can replay an entry twice.
+    if "timestamp" in data:
+        data["timestamp"] = parse_timestamp(data["timestamp"])
+    if entity == "user":
+        user = repo.get_user(data["username"])
+        if op == "delete":
+            if user:
+                repo.remove_user(user)
+        elif not user:
+            repo.add_user(user_from_row(data))
+        else:
+            user.account = Account(data["username"], "dummy", data["role"], password_hash=data["password_hash"])
+            user.bio = data["bio"]
+            user.profile_pic = data["profile_pic"]
+            if user.name != data["name"]:
+                repo.rename_user(user, data["name"])
+    elif entity == "post":
+        if data.get("price") is not None:
+            data["price"] = float(data["price"])
+        old = repo.get_post(data["post_id"])
+        if old:
+            listed = int(old.post_id) in repo.marketplace.products_by_id
+            quiet_market(repo.marketplace, old.post_id,
+                         lambda: repo.remove_post(old, keep_interactions=(op == "upsert")))
+        if op == "upsert":
+            post = post_from_row(repo, data)
+            repo.add_post(post)
+            if old and listed:
+                quiet_market(repo.marketplace, post.post_id, lambda: repo.marketplace.add_product(post))
+    elif entity == "market":
+        post = repo.get_post(data["post_id"])
+        if op == "delete" and post:
+            quiet_market(repo.marketplace, post.post_id, lambda: repo.marketplace.remove_product(post))
+        elif op == "upsert" and post and int(post.post_id) not in repo.marketplace.products_by_id:
+            quiet_market(repo.marketplace, post.post_id, lambda: repo.marketplace.add_product(post))
+    elif entity == "follow":
+        if op == "delete":
+            repo.graph.unfollow(data["follower"], data["followed"])
+        else:
+            repo.graph.follow(data["follower"], data["followed"])
+    elif entity in ("like", "comment"):
+        post = repo.get_post(data["post_id"])
+        user = repo.get_user(data["username"])
+        if not post or not user:
+            return
+        store, post_id = repo.interactions, int(post.post_id)
+        if entity == "like":
+            if op == "delete":
+                store.remove_like(post_id, user.user_id)
+            else:
+                store.add_like(post_id, user.user_id, data["timestamp"])
+        elif op == "delete":
+            store.remove_comment(post_id, user.user_id, data["timestamp"])
+        elif not store.edit_comment(post_id, user.user_id, data["timestamp"], data["content"]):
+            store.add_comment(post_id, user.user_id, data["content"], data["timestamp"])
+    elif entity == "message":
+        sender = repo.get_user(data["sender"])
+        receiver = repo.get_user(data["receiver"])
+        if sender and receiver and not repo.message_store.has(
+                sender.account.username, receiver.account.username, data["timestamp"], data["content"]):
+            message_id = data.get("message_id") or id_allocator.next_id("messages")
+            repo.add_message(Message(message_id, sender, receiver, data["content"], timestamp=data["timestamp"]))
+    elif entity == "read":
+        repo.message_store.set_read(data["username"], (data["timestamp"], data["message_id"]))
+
+# --- SNAPSHOT ---
+# The whole object graph in one binary file, written atomically and read back
+# through mmap. Layout (little endian):
+#   header   magic(8) version(u16) sections(u16) change_id(i64) created(i64)
+#   strings  count(u32), then length(u32) + utf-8 bytes each; index 0 is None
+#   sections tag(4) records(u32) bytes(u64), then per record length(u32) +
+#            fields packed as SNAPSHOT_RECORDS[tag]; text fields are indexes
+#            into the string table
+#   trailer  crc32(u32) of everything before it
+# Readers skip sections they do not know and fields appended after the ones
+# they do, so a newer writer only needs a new version for incompatible changes.
+SNAPSHOT_MAGIC = b"BLEXSNAP"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_PATH = os.environ.get("BLEX_SNAPSHOT", "blex.snap")
+SNAPSHOT_STARTUP = os.environ.get("BLEX_SNAPSHOT_STARTUP", "0") == "1"
+SNAPSHOT_HEADER = struct.Struct("<8sHHqq")
+SNAPSHOT_SECTION = struct.Struct("<4sIQ")
+U32 = struct.Struct("<I")
+NULL_TIME = -2 ** 63
+POST_TYPES = ("normal", "product", "job")   # POST record kind -> post_type
+SNAPSHOT_RECORDS = {
+    # user_id, username, role, password_hash, name, bio, profile_pic
+    b"USER": struct.Struct("<q6I"),
+    # post_id, kind, caption, author, media_id, media_type, media_url, timestamp,
+    # price, then product_name/description or job_title/company/requirements
+    b"POST": struct.Struct("<qB5Iqd3I"),
+    # follower, followed
+    b"FOLL": struct.Struct("<2I"),
+    # post_id, user_id, time
+    b"LIKE": struct.Struct("<3q"),
+    # post_id, user_id, time, content
+    b"CMNT": struct.Struct("<3qI"),
+    # sender, receiver, content, timestamp, message_id
+    b"MESG": struct.Struct("<3Iqq"),
+    # post_id of a listed product
+    b"MRKT": struct.Struct("<q"),
+    # username, timestamp and message_id of the newest message read
+    b"READ": struct.Struct("<Iqq"),
+}
+# version 1 messages had no id; repo_from_snapshot() hands out fresh ones
+SNAPSHOT_V1_RECORDS = {b"MESG": struct.Struct("<3Iq")}
+SNAPSHOT_NAMES = {b"USER": "users", b"POST": "posts", b"FOLL": "follows", b"LIKE": "likes",
+                  b"CMNT": "comments", b"MESG": "messages", b"MRKT": "listings", b"READ": "read marks"}
+
+def snapshot_time(ts):
+    return to_micros(ts) if ts else NULL_TIME
+
+def snapshot_datetime(us):
+    return None if us == NULL_TIME else from_micros(us)
+
+def write_snapshot(repo, path=None, change_id=0):
+    path = path or SNAPSHOT_PATH
+    strings = {}
+
+    def s(value):
+        if value is None:
+            return 0
+        value = str(value)
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings) + 1
+        return index
+
+    sections = {tag: [] for tag in SNAPSHOT_RECORDS}
+    pack = {tag: rec.pack for tag, rec in SNAPSHOT_RECORDS.items()}
+    for u in repo.users:
+        a = u.account
+        sections[b"USER"].append(pack[b"USER"](
+            int(u.user_id), s(a.username), s(a.role), s(a._password_hash), s(u.name), s(u.bio), s(u.profile_pic)))
+    for p in repo.posts:
+        kind = 1 if isinstance(p, ProductPost) else 2 if isinstance(p, JobPost) else 0
+        extra, price = (0, 0, 0), 0.0
+        if kind == 1:
+            extra, price = (s(p.product_name), s(p.description), 0), float(p.price or 0)
+        elif kind == 2:
+            extra = (s(p.job_title), s(p.company), s(p.requirements))
+        m = p.media
+        sections[b"POST"].append(pack[b"POST"](
+            int(p.post_id), kind, s(p.caption), s(p.author.account.username if p.author else None),
+            s(m.media_id), s(m.media_type), s(m.url), snapshot_time(p.timestamp), price, *extra))
+    for follower, followed in repo.graph.edges():
+        sections[b"FOLL"].append(pack[b"FOLL"](s(follower), s(followed)))
+    likes, comments = repo.interactions.likes, repo.interactions.comments
+    for row in likes.live_rows():
+        sections[b"LIKE"].append(pack[b"LIKE"](likes.post[row], likes.user[row], likes.time[row]))
+    for row in comments.live_rows():
+        sections[b"CMNT"].append(pack[b"CMNT"](
+            comments.post[row], comments.user[row], comments.time[row], s(comments.text[row])))
+    for msg in repo.messages:
+        sections[b"MESG"].append(pack[b"MESG"](
+            s(msg.sender.account.username), s(msg.receiver.account.username), s(msg.content),
+            snapshot_time(msg.timestamp), int(msg.message_id)))
+    for post_id in repo.marketplace.products_by_id:
+        sections[b"MRKT"].append(pack[b"MRKT"](int(post_id)))
+    for mark in repo.message_store.last_read.values():
+        sections[b"READ"].append(pack[b"READ"](s(mark.username), snapshot_time(mark.timestamp), int(mark.message_id)))
+
+    chunks = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(sections),
+                                   int(change_id or 0), to_micros(datetime.now())),
+              U32.pack(len(strings))]
+    for value in strings:   # insertion order == index order
+        data = value.encode("utf-8", "surrogatepass")
+        chunks.append(U32.pack(len(data)))
+        chunks.append(data)
+    for tag, records in sections.items():
+        body = b"".join(U32.pack(len(r)) + r for r in records)
+        chunks.append(SNAPSHOT_SECTION.pack(tag, len(records), len(body)))
+        chunks.append(body)
+
+    # write a temp file next to the target and rename it over, so readers
+    # only ever see a complete snapshot
+    tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    crc = 0
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in chunks:
+                crc = zlib.crc32(chunk, crc)
+                f.write(chunk)
+            f.write(U32.pack(crc))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return {SNAPSHOT_NAMES[tag]: len(records) for tag, records in sections.items()}
+
+class Snapshot:
+    # A snapshot file mapped read-only. Opening checks the header and decodes
+    # the string table; records(tag) unpacks one section.
+    def __init__(self, path=None):
+        self.path = path or SNAPSHOT_PATH
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < SNAPSHOT_HEADER.size + U32.size * 2:
+                raise ValueError("file too short for a snapshot")
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.parse()
+        except (struct.error, UnicodeDecodeError) as err:
+            self.close()
+            raise ValueError(f"truncated or corrupt snapshot: {err}")
+        except ValueError:
+            self.close()
+            raise
+
+    def parse(self):
+        buf = self.buf
+        magic, version, count, self.change_id, created = SNAPSHOT_HEADER.unpack_from(buf, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("not a snapshot file")
+        if version > SNAPSHOT_VERSION:
+            raise ValueError(f"snapshot version {version} is newer than supported ({SNAPSHOT_VERSION})")
+        self.version = version
+        self.created = from_micros(created)
+        pos = SNAPSHOT_HEADER.size
+        (n,) = U32.unpack_from(buf, pos)
+        pos += U32.size
+        strings = [None]
+        for _ in range(n):
+            (size,) = U32.unpack_from(buf, pos)
+            pos += U32.size
+            strings.append(buf[pos:pos + size].decode("utf-8", "surrogatepass"))
+            pos += size
+        self.strings = strings
+        self.sections = {}   # tag -> (offset, records, bytes)
+        end = len(buf) - U32.size
+        for _ in range(count):
+            tag, records, size = SNAPSHOT_SECTION.unpack_from(buf, pos)
+            pos += SNAPSHOT_SECTION.size
+            if pos + size > end:
+                raise ValueError(f"section {tag!r} runs past the end of the file")
+            self.sections[tag] = (pos, records, size)
+            pos += size
+        if pos != end:
+            raise ValueError("unexpected data after the last section")
+
+    def crc_ok(self):
+        (stored,) = U32.unpack_from(self.buf, len(self.buf) - U32.size)
+        with memoryview(self.buf) as mv, mv[:-U32.size] as body:
+            return zlib.crc32(body) == stored
+
+    def records(self, tag):
+        # list of field tuples; unknown trailing fields are ignored
+        if tag not in self.sections:
+            return []
+        offset, count, size = self.sections[tag]
+        rec = SNAPSHOT_V1_RECORDS.get(tag, SNAPSHOT_RECORDS[tag]) if self.version == 1 else SNAPSHOT_RECORDS[tag]
+        framed = struct.Struct("<I" + rec.format[1:])
+        if size == count * framed.size:
+            # every record has exactly the fields we know: unpack in one go
+            with memoryview(self.buf) as mv, mv[offset:offset + size] as body:
+                rows = [fields for fields in framed.iter_unpack(body)]
+            if all(fields[0] == rec.size for fields in rows):
+                return [fields[1:] for fields in rows]
+        rows = []
+        pos = offset
+        for _ in range(count):
+            (length,) = U32.unpack_from(self.buf, pos)
+            if length < rec.size or pos + U32.size + length > offset + size:
+                raise ValueError(f"bad record length in section {tag!r}")
+            rows.append(rec.unpack_from(self.buf, pos + U32.size))
+            pos += U32.size + length
+        return rows
+
+    def close(self):
+        if self.buf is not None:
+            self.buf.close()
+            self.buf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def repo_from_snapshot(snap):
+    # leaves `changes` alone: compaction builds throwaway repos with this, and
+    # startup resets the change set itself
+    S = snap.strings
+    repo = Repository(users=[
+        user_from_row({"user_id": user_id, "username": S[username], "role": S[role],
+                       "password_hash": S[password_hash], "name": S[name], "bio": S[bio],
+                       "profile_pic": S[pic]})
+        for user_id, username, role, password_hash, name, bio, pic in snap.records(b"USER")
+    ])
+    for (post_id, kind, caption, author, media_id, media_type, media_url, ts, price,
+         a, b, c) in snap.records(b"POST"):
+        row = {"post_id": post_id, "post_type": POST_TYPES[kind], "caption": S[caption],
+               "author_username": S[author] or "", "media_id": S[media_id], "media_type": S[media_type],
+               "media_url": S[media_url], "timestamp": snapshot_datetime(ts)}
+        if kind == 1:
+            row.update(product_name=S[a], description=S[b], price=price)
+        elif kind == 2:
+            row.update(job_title=S[a], company=S[b], requirements=S[c])
+        repo.add_post(post_from_row(repo, row))
+    repo.graph.load_edges(canonical_edges(
+        repo, ((S[follower], S[followed]) for follower, followed in snap.records(b"FOLL"))
+    ))
+    posts, users = repo.posts_by_id, repo.users_by_id
+    likes, comments = repo.interactions.likes, repo.interactions.comments
+    for post_id, user_id, us in snap.records(b"LIKE"):
+        if post_id in posts and user_id in users:
+            likes.append(post_id, user_id, us)
+    for post_id, user_id, us, content in snap.records(b"CMNT"):
+        if post_id in posts and user_id in users:
+            comments.append(post_id, user_id, us, S[content])
+    messages = []
+    for sender, receiver, content, ts, *message_id in snap.records(b"MESG"):
+        sender, receiver = repo.get_user(S[sender]), repo.get_user(S[receiver])
+        if sender and receiver:
+            message_id = message_id[0] if message_id else id_allocator.next_id("messages")
+            messages.append(Message(message_id, sender, receiver, S[content], timestamp=snapshot_datetime(ts)))
+    messages.sort(key=lambda m: m.key)
+    for m in messages:
+        repo.add_message(m)
+    for (post_id,) in snap.records(b"MRKT"):
+        post = repo.get_post(post_id)
+        if isinstance(post, ProductPost):
+            repo.marketplace.load_product(post)
+    for username, ts, message_id in snap.records(b"READ"):
+        repo.message_store.set_read(S[username], (snapshot_datetime(ts), message_id))
+    return repo
+
+def load_snapshot(path=None):
+    # (repo, change_id the snapshot was taken at); ValueError if the file does
+    # not match its checksum. Restoring allocates a few objects per record and
+    # none of them are garbage yet, so the cyclic collector is paused instead
+    # of rescanning them over and over.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        with Snapshot(path) as snap:
+            if not snap.crc_ok():
+                raise ValueError("checksum mismatch")
+            return repo_from_snapshot(snap), snap.change_id
+    finally:
+        if collecting:
+            gc.enable()
+
+def verify_snapshot(path=None):
+    # (record counts, problems); an empty problem list means the file is sound
+    try:
+        snap = Snapshot(path)
+    except (OSError, ValueError) as err:
+        return {}, [str(err)]
+    problems = []
+    counts = {}
+    with snap:
+        if not snap.crc_ok():
+            problems.append("checksum mismatch")
+        n = len(snap.strings)
+        try:
+            sections = {tag: snap.records(tag) for tag in SNAPSHOT_RECORDS}
+        except (ValueError, struct.error) as err:
+            return counts, problems + [str(err)]
+        for tag, rows in sections.items():
+            counts[SNAPSHOT_NAMES[tag]] = len(rows)
+        text_fields = {b"USER": range(1, 7), b"POST": (2, 3, 4, 5, 6, 9, 10, 11),
+                       b"FOLL": (0, 1), b"CMNT": (3,), b"MESG": (0, 1, 2), b"READ": (0,)}
+        for tag, fields in text_fields.items():
+            bad = sum(1 for row in sections[tag] for i in fields if row[i] >= n)
+            if bad:
+                problems.append(f"{tag.decode()}: {bad} string references out of range")
+        user_ids = [row[0] for row in sections[b"USER"]]
+        post_ids = [row[0] for row in sections[b"POST"]]
+        if len(set(user_ids)) != len(user_ids):
+            problems.append("USER: duplicate user ids")
+        if len(set(post_ids)) != len(post_ids):
+            problems.append("POST: duplicate post ids")
+        if any(row[1] not in (0, 1, 2) for row in sections[b"POST"]):
+            problems.append("POST: unknown post kind")
+        user_ids, post_ids = set(user_ids), set(post_ids)
+        for tag in (b"LIKE", b"CMNT"):
+            dangling = sum(1 for row in sections[tag] if row[0] not in post_ids or row[1] not in user_ids)
+            if dangling:
+                problems.append(f"{tag.decode()}: {dangling} rows point at missing posts or users")
+        missing = sum(1 for (post_id,) in sections[b"MRKT"] if post_id not in post_ids)
+        if missing:
+            problems.append(f"MRKT: {missing} listings point at missing posts")
+    return counts, problems
+
+def snapshot_is_current(path=None, files=("users.txt", "posts.txt", "followers.txt")):
+    # newer than every flat file, i.e. nothing was saved only to the text files
+    path = path or SNAPSHOT_PATH
+    if not os.path.exists(path):
+        return False
+    stamp = os.path.getmtime(path)
+    return all(os.path.getmtime(f) <= stamp for f in files if os.path.exists(f))
+
+def restore_snapshot(path=None):
+    # repo from the snapshot, or None when it is missing, unreadable or older
+    # than what the change log still holds
+    path = path or SNAPSHOT_PATH
+    if not os.path.exists(path):
+        return None
+    try:
+        repo, change_id = load_snapshot(path)
+    except (OSError, ValueError) as err:
+        print(f"Snapshot {path} unusable, loading from the database: {err}")
+        return None
+    if not change_feed.resume_from(change_id):
+        print(f"Snapshot {path} is older than the change log, loading from the database.")
+        return None
+    return repo
+
+def snapshot_command(args):
+    # python finalcode.py snapshot write|verify [path]
+    if not args or args[0] not in ("write", "verify") or len(args) > 2:
+        print("Usage: python finalcode.py snapshot write|verify [path]")
+        return 2
+    path = args[1] if len(args) > 1 else SNAPSHOT_PATH
+    if args[0] == "write":
+        repo = load_all(snapshot=False)
+        start = time.perf_counter()
+        counts = write_snapshot(repo, path, change_feed.last_id)
+        print(f"Wrote {path} in {time.perf_counter() - start:.2f}s: "
+              + ", ".join(f"{n} {name}" for name, n in counts.items()))
+        return 0
+    counts, problems = verify_snapshot(path)
+    for problem in problems:
+        print(f"{path}: {problem}")
+    if problems:
+        return 1
+    print(f"{path} ok: " + ", ".join(f"{n} {name}" for name, n in counts.items()))
+    return 0
+
+# --- JOURNAL ---
+# The flat-file backend is a base snapshot plus an append-only journal of the
+# committed changes (the same entity/op/payload entries as change_log), so a
+# save_changes() costs one append instead of rewriting whole files.
+# A record is length(u32) crc32(u32) + JSON [entity, op, payload]. Replay
+# stops at the first torn or damaged record, which only a crash in the middle
+# of an append leaves behind. Appends reach the OS right away; fsync is
+# batched to at most one per JOURNAL_FSYNC_INTERVAL seconds (0: every batch).
+# Past JOURNAL_COMPACT_BYTES the journal is sealed and a background thread
+# folds the sealed segments into a fresh base snapshot. The base is a file of
+# its own, not the startup snapshot (whose change_id the change feed resumes
+# from). Changes are only journaled with BLEX_BACKEND=files; with MySQL,
+# save_all() rebases, and an empty database is filled from the flat files.
+JOURNAL_PATH = os.environ.get("BLEX_JOURNAL", "blex.journal")
+JOURNAL_BASE = os.environ.get("BLEX_JOURNAL_BASE", "blex.base")
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get("BLEX_JOURNAL_FSYNC_INTERVAL", "0.5"))
+JOURNAL_COMPACT_BYTES = int(os.environ.get("BLEX_JOURNAL_COMPACT_BYTES", str(8 * 1024 * 1024)))
+JOURNAL_RECORD = struct.Struct("<II")
+
+def journal_record(entity, op, payload):
+    data = json.dumps([entity, op, payload], default=str).encode()
+    return JOURNAL_RECORD.pack(len(data), zlib.crc32(data)) + data
+
+def read_journal(path):
+    # ([(entity, op, payload)], offset just past the last intact record)
+    entries = []
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return entries, 0
+    pos = 0
+    while pos + JOURNAL_RECORD.size <= len(data):
+        size, crc = JOURNAL_RECORD.unpack_from(data, pos)
+        start = pos + JOURNAL_RECORD.size
+        body = data[start:start + size]
+        if len(body) < size or zlib.crc32(body) != crc:
+            break
+        try:
+            entity, op, payload = json.loads(body)
+        except ValueError:
+            break
+        entries.append((entity, op, payload))
+        pos = start + size
+    return entries, pos
+
+def replay_journal(repo, entries):
+    for entity, op, payload in entries:
+        try:
+            apply_change(repo, entity, op, payload)
+        except Exception as err:
+            print(f"Skipping journal entry {entity}/{op}: {err}")
+
+@contextmanager
+def file_lock(path, shared=False, blocking=True):
+    # advisory lock between processes sharing the flat files; yields whether
+    # it was taken (always True without fcntl, i.e. one process only)
+    if fcntl is None:
+        yield True
+        return
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class Journal:
+    def __init__(self, path=JOURNAL_PATH, base=JOURNAL_BASE,
+                 fsync_interval=JOURNAL_FSYNC_INTERVAL, compact_bytes=JOURNAL_COMPACT_BYTES):
+        self.path = path
+        self.base = base
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+        self.file = None
+        self.unsynced = 0       # records written since the last fsync
+        self.timer = None       # pending batched fsync
+        self.compactor = None   # background compaction thread
+        self.lock = threading.Lock()
+        self.counters = {"records": 0, "fsyncs": 0, "compactions": 0, "failed": 0}
+
+    # appends and sealing take <path>.lock, compaction and loading <path>.compact
+    def append_lock(self):
+        return file_lock(self.path + ".lock")
+
+    def compact_lock(self, shared=False, blocking=True):
+        return file_lock(self.path + ".compact", shared=shared, blocking=blocking)
+
+    def sealed(self):
+        # sealed segments waiting to be folded into the base, oldest first
+        return sorted(glob.glob(glob.escape(self.path) + ".*.sealed"))
+
+    def segments(self):
+        return self.sealed() + [self.path]
+
+    def _open(self):
+        # (re)open the active segment, dropping a torn tail left by a crash
+        if self.file is not None:
+            try:
+                if os.fstat(self.file.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return
+            except FileNotFoundError:
+                pass
+            self.file.close()   # sealed by another process
+        _, intact = read_journal(self.path)
+        self.file = open(self.path, "ab")
+        if self.file.tell() > intact:
+            self.file.truncate(intact)
+
+    def _sync(self):
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+            self.counters["fsyncs"] += 1
+
+    def append(self, entries):
+        records = [journal_record(entity, op, payload) for entity, op, payload in entries]
+        if not records:
+            return
+        with self.lock, self.append_lock():
+            self._open()
+            self.file.write(b"".join(records))
+            self.file.flush()
+            self.counters["records"] += len(records)
+            self.unsynced += len(records)
+            if self.fsync_interval <= 0:
+                self._sync()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.fsync_interval, self.sync)
+                self.timer.daemon = True
+                self.timer.start()
+            full = self.file.tell() >= self.compact_bytes
+        if full:
+            self.compact_async()
+
+    def sync(self):
+        with self.lock:
+            self.timer = None
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self._sync()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def seal(self):
+        # move the active segment aside; appends start a new one
+        with self.lock, self.append_lock():
+            if self.file is not None:
+                self._sync()
+                self.file.close()
+                self.file = None
+            if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+                return False
+            os.replace(self.path, f"{self.path}.{time.time_ns():020d}-{os.getpid()}.sealed")
+            return True
+
+    def compact(self):
+        # fold every sealed segment into a fresh base snapshot
+        with self.compact_lock(blocking=False) as locked:
+            if not locked:
+                return False   # another process is compacting or loading
+            self.seal()
+            sealed = self.sealed()
+            if not sealed:
+                return False
+            repo = load_base(self.base)
+            for segment in sealed:
+                replay_journal(repo, read_journal(segment)[0])
+            write_snapshot(repo, self.base)
+            # a crash before this point only means replaying these again
+            for segment in sealed:
+                os.remove(segment)
+            self.counters["compactions"] += 1
+            return True
+
+    def compact_async(self):
+        if self.compactor is not None and self.compactor.is_alive():
+            return
+        self.compactor = threading.Thread(target=self.run_compaction, name="journal-compact", daemon=True)
+        self.compactor.start()
+
+    def run_compaction(self):
+        try:
+            self.compact()
+        except Exception as err:
+            self.counters["failed"] += 1
+            print(f"Journal compaction failed, will retry: {err}")
+
+    def rebase(self, repo, change_id=0):
+        # write the full dataset as the new base and drop everything journaled
+        with self.compact_lock(), self.lock, self.append_lock():
+            write_snapshot(repo, self.base, change_id)
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.unsynced = 0
+            for segment in self.segments():
+                if os.path.exists(segment):
+                    os.remove(segment)
+
+file_journal = Journal()
+atexit.register(file_journal.close)
+
+def load_base(path=None):
+    # the flat files without the journal: the base snapshot, or the text files
+    # of older versions while they are newer than any snapshot. A damaged base
+    # raises rather than being replayed onto (or compacted over).
+    if snapshot_is_current(path):
+        return load_snapshot(path)[0]
+    repo = Repository(users=load_users_file())
+    for p in load_posts_file(repo):
+        repo.add_post(p)
+    load_followers_file(repo)
+    return repo
+
+def load_files(journal=None):
+    # flat-file backend: base plus every journal segment, oldest first
+    journal = journal or file_journal
+    with journal.compact_lock(shared=True):
+        repo = load_base(journal.base)
+        for segment in journal.segments():
+            replay_journal(repo, read_journal(segment)[0])
+    changes.reset()
+    return repo
+
 # --- GLUE LOGIC ---
-def save_all(users, posts, messages, marketplace):
-    clear_users_db()
-    clear_posts_db()
-    clear_followers_db()
-    clear_likes_db()
-    clear_comments_db()
-    clear_messages_db()
-    clear_marketplace_db()
-    save_users_db(users)
-    save_posts_db(posts)
-    save_followers_db(users)
-    save_likes_db(posts)
-    save_comments_db(posts)
-    save_messages_db(messages)
-    save_marketplace_db(marketplace)
-    save_users_file(users)
-    save_posts_file(posts)
-    save_followers_file(users)
-
-def load_all():
-    users = load_users_db()
-    posts = load_posts_db(users)
-    messages = load_messages_db(users)
-    marketplace = load_marketplace_db(posts)
-    load_followers_db(users)
-    load_likes_db(posts, users)
-    load_comments_db(posts, users)
-    if not users:
-        users = load_users_file()
-    if not posts:
-        posts = load_posts_file(users)
-    load_followers_file(users)
-    return users, posts, messages, marketplace
+def save_all(repo):
+    steps = [
+        ("clear_users", clear_users_db),
+        ("clear_posts", clear_posts_db),
+        ("clear_followers", clear_followers_db),
+        ("clear_likes", clear_likes_db),
+        ("clear_comments", clear_comments_db),
+        ("clear_messages", clear_messages_db),
+        ("clear_marketplace", clear_marketplace_db),
+        ("clear_message_reads", clear_message_reads_db),
+        ("users", lambda: save_users_db(repo.users)),
+        ("posts", lambda: save_posts_db(repo.posts)),
+        ("followers", lambda: save_followers_db(repo.graph)),
+        ("likes", lambda: save_likes_db(repo)),
+        ("comments", lambda: save_comments_db(repo)),
+        ("messages", lambda: save_messages_db(repo.message_store)),
+        ("marketplace", lambda: save_marketplace_db(repo.marketplace)),
+        ("message_reads", lambda: save_message_reads_db(repo.message_store)),
+    ]
+    if not FILES_BACKEND:
+        with db_pool.scope():
+            for name, step in steps:
+                with metrics.timer("blex_persistence_seconds", phase="save_all." + name):
+                    step()
+    with metrics.timer("blex_persistence_seconds", phase="save_all.files"):
+        file_journal.rebase(repo, change_feed.last_id)
+    changes.reset()
+
+# Tables read by load_all(). The fetches do not depend on each other, so in
+# parallel mode they run on a thread pool (one pooled connection each) and
+# cold start costs about as much as the slowest table.
+LOAD_PARALLEL = os.environ.get("BLEX_PARALLEL_LOAD", "1") != "0"
+LOAD_QUERIES = {
+    "users": "SELECT * FROM users",
+    "posts": "SELECT * FROM posts",
+    "messages": "SELECT * FROM messages",
+    "marketplace": "SELECT post_id FROM marketplace",
+    "followers": "SELECT * FROM followers",
+    "likes": "SELECT * FROM likes",
+    "comments": "SELECT * FROM comments",
+    "message_reads": "SELECT * FROM message_reads",
+}
+
+def timed_fetch(table):
+    start = time.perf_counter()
+    rows = fetch_rows(LOAD_QUERIES[table])
+    return rows, time.perf_counter() - start
+
+def fetch_tables(parallel, timings):
+    rows = {}
+    if parallel:
+        workers = max(1, min(len(LOAD_QUERIES), db_pool.size))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="load") as ex:
+            futures = {table: ex.submit(timed_fetch, table) for table in LOAD_QUERIES}
+            for table, future in futures.items():
+                rows[table], timings[table] = future.result()
+    else:
+        for table in LOAD_QUERIES:
+            rows[table], timings[table] = timed_fetch(table)
+    return rows
+
+def load_db(parallel, snapshot, timings, start):
+    # the MySQL backend; an empty database is filled from the flat files
+    with db_pool.scope():
+        change_feed.start()
+        ensure_message_tables()
+        ensure_media_index()
+        repo = restore_snapshot() if snapshot else None
+        restored = repo is not None
+        if restored:
+            timings["snapshot"] = time.perf_counter() - start
+        else:
+            rows = fetch_tables(parallel, timings)
+            timings["fetch"] = time.perf_counter() - start
+
+            # link everything in one pass, users first
+            link_start = time.perf_counter()
+            repo = Repository(users=load_users_db(rows["users"]))
+            for p in load_posts_db(repo, rows["posts"]):
+                repo.add_post(p)
+            for m in load_messages_db(repo, rows["messages"]):
+                repo.add_message(m)
+            repo.marketplace = load_marketplace_db(repo.posts, rows["marketplace"])
+            load_followers_db(repo, rows["followers"])
+            load_likes_db(repo, rows["likes"])
+            load_comments_db(repo, rows["comments"])
+            load_message_reads_db(repo, rows["message_reads"])
+            timings["link"] = time.perf_counter() - link_start
+    if not restored and not repo.users and not repo.posts:
+        # empty database: start from the flat files, if there are any
+        files_start = time.perf_counter()
+        repo = load_files()
+        timings["files"] = time.perf_counter() - files_start
+        # save_changes() only writes changed rows, so the database has to
+        # hold everything else before the first one
+        import_start = time.perf_counter()
+        save_all(repo)
+        timings["import"] = time.perf_counter() - import_start
+    return repo
+
+def load_all(parallel=None, snapshot=None):
+    # snapshot=True (BLEX_SNAPSHOT_STARTUP=1) restores from the binary snapshot
+    # instead of querying every table; the change feed then replays whatever
+    # was committed after the snapshot was taken
+    if parallel is None:
+        parallel = LOAD_PARALLEL
+    if snapshot is None:
+        snapshot = SNAPSHOT_STARTUP
+    timings = {}
+    start = time.perf_counter()
+    if FILES_BACKEND:
+        # base snapshot (or legacy text files) plus the journal
+        repo = load_files()
+        timings["files"] = time.perf_counter() - start
+    else:
+        repo = load_db(parallel, snapshot, timings, start)
+    id_allocator.seed("users", max([int(u.user_id) for u in repo.users] + [0]) + 1)
+    id_allocator.seed("posts", max([int(p.post_id) for p in repo.posts] + [0]) + 1)
+    id_allocator.seed("messages", max([int(m.message_id) for m in repo.messages] + [0]) + 1)
+    # loading is not a change
+    changes.reset()
+    timings["total"] = time.perf_counter() - start
+    repo.load_timings = timings
+    for phase, seconds in timings.items():
+        if phase in LOAD_QUERIES:
+            phase = "fetch." + phase
+        metrics.observe("blex_persistence_seconds", seconds, phase="load_all." + phase)
+    return repo
 
 def find_user(users, identifier):
     identifier = identifier.strip().lower()
@@ -724,14 +3791,19 @@ def print_user_menu(user):
         print("10. View Inbox")
         print("11. Logout")
 
-def show_marketplace(current_user, users, posts, messages, marketplace):
+CLI_SESSION = random.getrandbits(32)
+
+def cli_seed():
+    # one order per CLI run and time window
+    return shuffle_seed(CLI_SESSION)
+
+def show_marketplace(current_user, repo):
+    marketplace = repo.marketplace
     print("\n--- Marketplace: All Products ---")
     if not marketplace.products:
         print("No products yet.")
     else:
-        products_list = marketplace.products[:]
-        random.shuffle(products_list)
-        for product in products_list:
+        for product in shuffled(marketplace.products, cli_seed()):
             print(f"ID: {product.post_id} | {product.product_name} | ${product.price} | Seller: {product.author.name}")
 
     keyword = input("Search products (leave blank to skip): ").strip()
@@ -740,7 +3812,6 @@ def show_marketplace(current_user, users, posts, messages, marketplace):
         if not matches:
             print("No products matched your search.")
         else:
-            random.shuffle(matches)
             for product in matches:
                 print(f"ID: {product.post_id} | {product.product_name} | ${product.price} | Seller: {product.author.name}")
 
@@ -761,31 +3832,29 @@ def show_marketplace(current_user, users, posts, messages, marketplace):
                 print("Please enter a valid number, without $ or text.")
         desc = input("Description: ")
         media = Media(1, "image", input("Media URL: "))
-        post = ProductPost(pname, price, desc, media, current_user)
-        posts.append(post)
+        post = ProductPost(pname, price, desc, media, current_user, id_allocator.next_id("posts"))
+        repo.add_post(post)
+        post.mark_new()
         marketplace.add_product(post)
-        save_all(users, posts, messages, marketplace)
+        save_changes(repo)
         print("Product added!")
 
 
-def show_job_board(current_user, users, posts, messages, marketplace):
+def show_job_board(current_user, repo):
     print("\n--- Job Board: All Jobs ---")
-    job_posts = [p for p in posts if isinstance(p, JobPost)]
+    job_posts = repo.job_board.jobs
     if not job_posts:
         print("No job postings yet.")
     else:
-        jobs_list = job_posts[:]
-        random.shuffle(jobs_list)
-        for job in jobs_list:
+        for job in shuffled(job_posts, cli_seed()):
             print(f"ID: {job.post_id} | {job.job_title} at {job.company} | Poster: {job.author.name}")
 
     keyword = input("Search jobs (leave blank to skip): ").strip()
     if keyword:
-        matches = [job for job in job_posts if keyword.lower() in job.job_title.lower()]
+        matches = repo.job_board.search(keyword)
         if not matches:
             print("No jobs matched your search.")
         else:
-            random.shuffle(matches)
             for job in matches:
                 print(f"ID: {job.post_id} | {job.job_title} at {job.company} | Poster: {job.author.name}")
 
@@ -800,9 +3869,10 @@ def show_job_board(current_user, users, posts, messages, marketplace):
             company = input("Company: ")
             req = input("Requirements: ")
             media = Media(1, "image", input("Media URL: "))
-            post = JobPost(jtitle, company, req, media, current_user)
-            posts.append(post)
-            save_all(users, posts, messages, marketplace)
+            post = JobPost(jtitle, company, req, media, current_user, id_allocator.next_id("posts"))
+            repo.add_post(post)
+            post.mark_new()
+            save_changes(repo)
             print("Job post added!")
     else:
         while True:
@@ -812,15 +3882,15 @@ def show_job_board(current_user, users, posts, messages, marketplace):
             print("Please enter 'y' for yes or 'n' for no.")
         if apply_job == "y":
             pid = int(input("Enter Job Post ID to apply: "))
-            job = next((j for j in job_posts if j.post_id == pid), None)
+            job = repo.job_board.get(pid)
             if job:
                 print("Application sent! (Feature can be expanded)")
             else:
                 print("Invalid Job Post ID.")
 
-def show_posts_menu(current_user, users, posts, messages, marketplace):
+def show_posts_menu(current_user, repo):
     print(f"\n--- {current_user.name}'s Posts ---")
-    my_posts = [p for p in posts if p.author == current_user]
+    my_posts = repo.user_posts(current_user)[:]
     if not my_posts:
         print("You haven't posted anything yet.")
         return
@@ -842,11 +3912,10 @@ def show_posts_menu(current_user, users, posts, messages, marketplace):
                 pid = int(input("Enter Post ID to delete: "))
                 post_to_delete = next((p for p in my_posts if p.post_id == pid), None)
                 if post_to_delete:
-                    posts.remove(post_to_delete)
-                    if isinstance(post_to_delete, ProductPost) and post_to_delete in marketplace.products:
-                        marketplace.products.remove(post_to_delete)
+                    repo.remove_post(post_to_delete)
+                    post_to_delete.mark_deleted()
                     print("Post deleted.")
-                    save_all(users, posts, messages, marketplace)
+                    save_changes(repo)
                     break
                 else:
                     print("You don't have a post with that ID.")
@@ -861,11 +3930,8 @@ def show_main_logo():
     print("=" * width)
 
 def main():
-    users, posts, messages, marketplace = load_all()
-    if posts:
-        Post._id_counter = max(int(p.post_id) for p in posts) + 1
-    else:
-        Post._id_counter = 1
+    repo = load_all()
+    repo.attach_media_store(MediaStore(os.path.join("static", "media"), "/static/media"))
     current_user = None
 
     while True:
@@ -878,7 +3944,7 @@ def main():
                 name = input("Name: ")
                 while True:
                     username = input("Username: ")
-                    if username_exists(username):
+                    if username_exists(username, repo):
                         print("Username already exists. Please choose another username.")
                     else:
                         break
@@ -888,21 +3954,25 @@ def main():
                     print("Invalid role. Please enter 'regular' or 'professional'.")
                     role = input("Role (regular/professional): ").strip().lower()
                 acc = Account(username, password, role)
-                user = ProfessionalUser(len(users)+1, name, "", "", acc) if role == "professional" else RegisteredUser(len(users)+1, name, "", "", acc)
-                users.append(user)
-                save_all(users, posts, messages, marketplace)
+                uid = id_allocator.next_id("users")
+                user = ProfessionalUser(uid, name, "", "", acc) if role == "professional" else RegisteredUser(uid, name, "", "", acc)
+                repo.add_user(user)
+                user.mark_new()
+                save_changes(repo)
                 print("Registered. Now login.")
             elif choice == "2":
                 username = input("Username: ")
                 password = input("Password: ")
-                user = find_user(users, username)
+                user = repo.find_user(username)
                 if user and user.account.login(password):
                     print(f"Logged in as {user.name}")
                     if not user.bio:
                         user.bio = input("Bio: ")
+                        user.mark_dirty()
                     if not user.profile_pic:
                         user.profile_pic = input("Profile Pic URL: ")
-                    save_all(users, posts, messages, marketplace)
+                        user.mark_dirty()
+                    save_changes(repo)
                     current_user = user
                 else:
                     print("Invalid login. Try again.")
@@ -917,328 +3987,251 @@ def main():
                 if choice == "1":
                     cap = input("Caption: ")
                     media = Media(1, "image", input("Media URL: "))
-                    post = NormalPost(cap, media, current_user)
-                    posts.append(post)
-                    save_all(users, posts, messages, marketplace)
+                    post = NormalPost(cap, media, current_user, id_allocator.next_id("posts"))
+                    repo.add_post(post)
+                    post.mark_new()
+                    save_changes(repo)
 
                 elif isinstance(current_user, ProfessionalUser):
                     if choice == "2":  # Marketplace
-                        print("\n--- Marketplace: All Products ---")
-                        if not marketplace.products:
-                            print("No products yet.")
-                        else:
-                            products_list = marketplace.products[:]
-                            random.shuffle(products_list)
-                            for product in products_list:
-                                print(f"ID: {product.post_id} | {product.product_name} | ${product.price} | Seller: {product.author.name}")
-
-                        keyword = input("Search products (leave blank to skip): ").strip()
-                        if keyword:
-                            matches = marketplace.search_by_keyword(keyword)
-                            if not matches:
-                                print("No products matched your search.")
-                            else:
-                                random.shuffle(matches)
-                                for product in matches:
-                                    print(f"ID: {product.post_id} | {product.product_name} | ${product.price} | Seller: {product.author.name}")
-
-                        while True:
-                            add_choice = input("Add a product? (y/n): ").strip().lower()
-                            if add_choice in ["y", "n"]:
-                                break
-                            print("Please enter 'y' for yes or 'n' for no.")
-                        if add_choice == "y":
-                            pname = input("Product name: ")
-                            while True:
-                                price_input = input("Price (numbers only, no $): ")
-                                try:
-                                    price = float(price_input)
-                                    break
-                                except ValueError:
-                                    print("Please enter a valid number, without $ or text.")
-                            desc = input("Description: ")
-                            media = Media(1, "image", input("Media URL: "))
-                            post = ProductPost(pname, price, desc, media, current_user)
-                            posts.append(post)
-                            marketplace.add_product(post)
-                            save_all(users, posts, messages, marketplace)
-                            print("Product added!")
+                        show_marketplace(current_user, repo)
 
                     elif choice == "3":  # Job Board
-                        print("\n--- Job Board: All Jobs ---")
-                        job_posts = [p for p in posts if isinstance(p, JobPost)]
-                        if not job_posts:
-                            print("No job postings yet.")
-                        else:
-                            jobs_list = job_posts[:]
-                            random.shuffle(jobs_list)
-                            for job in jobs_list:
-                                print(f"ID: {job.post_id} | {job.job_title} at {job.company} | Poster: {job.author.name}")
-
-                        keyword = input("Search jobs (leave blank to skip): ").strip()
-                        if keyword:
-                            matches = [job for job in job_posts if keyword.lower() in job.job_title.lower()]
-                            if not matches:
-                                print("No jobs matched your search.")
-                            else:
-                                random.shuffle(matches)
-                                for job in matches:
-                                    print(f"ID: {job.post_id} | {job.job_title} at {job.company} | Poster: {job.author.name}")
-
-                        while True:
-                            add_job = input("Add a job? (y/n): ").strip().lower()
-                            if add_job in ["y", "n"]:
-                                break
-                            print("Please enter 'y' for yes or 'n' for no.")
-                        if add_job == "y":
-                            jtitle = input("Job title: ")
-                            company = input("Company: ")
-                            req = input("Requirements: ")
-                            media = Media(1, "image", input("Media URL: "))
-                            post = JobPost(jtitle, company, req, media, current_user)
-                            posts.append(post)
-                            save_all(users, posts, messages, marketplace)
-                            print("Job post added!")
+                        show_job_board(current_user, repo)
 
                     elif choice == "4":
                         uname = input("Follow who: ")
-                        current_user.follow(uname, users)
-                        save_all(users, posts, messages, marketplace)
+                        current_user.follow(uname, repo)
+                        save_changes(repo)
                     elif choice == "5":
                         uname = input("Unfollow who: ")
-                        current_user.unfollow(uname, users)
-                        save_all(users, posts, messages, marketplace)
+                        current_user.unfollow(uname, repo)
+                        save_changes(repo)
                     elif choice == "6":
                         uname = input("Enter username of post author: ")
-                        user = find_user(users, uname)
+                        user = repo.find_user(uname)
                         if user:
-                            user_posts = [p for p in posts if p.author == user]
+                            user_posts = repo.user_posts(user)
                             if not user_posts:
                                 print("This user has no posts.")
                             else:
-                                user_posts_list = user_posts[:]
-                                random.shuffle(user_posts_list)
                                 print("Posts by", uname)
-                                for p in user_posts_list:
+                                for p in shuffled(user_posts, cli_seed()):
                                     print(f"ID: {p.post_id} | {p.caption}")
                                 pid = int(input("Enter Post ID to like: "))
-                                post = find_post(user_posts, pid)
-                                if post:
+                                post = repo.get_post(pid)
+                                if post and post.author is user:
                                     current_user.like_post(post)
-                                    save_all(users, posts, messages, marketplace)
+                                    save_changes(repo)
                                 else:
                                     print("Invalid Post ID.")
                         else:
                             print("User not found.")
                     elif choice == "7":
                         uname = input("Enter username of post author: ")
-                        user = find_user(users, uname)
+                        user = repo.find_user(uname)
                         if user:
-                            user_posts = [p for p in posts if p.author == user]
+                            user_posts = repo.user_posts(user)
                             if not user_posts:
                                 print("This user has no posts.")
                             else:
-                                user_posts_list = user_posts[:]
-                                random.shuffle(user_posts_list)
                                 print("Posts by", uname)
-                                for p in user_posts_list:
+                                for p in shuffled(user_posts, cli_seed()):
                                     print(f"ID: {p.post_id} | {p.caption}")
                                 pid = int(input("Enter Post ID to comment on: "))
-                                post = find_post(user_posts, pid)
-                                if post:
+                                post = repo.get_post(pid)
+                                if post and post.author is user:
                                     content = input("Your comment: ")
                                     current_user.comment_on_post(post, content)
-                                    save_all(users, posts, messages, marketplace)
+                                    save_changes(repo)
                                 else:
                                     print("Invalid Post ID.")
                         else:
                             print("User not found.")
                     elif choice == "8":
                         # If you want to randomize "Show My Posts" and "Show Posts by Others" menus here, update that logic as above.
-                        show_posts_menu(current_user, users, posts, messages, marketplace)
+                        show_posts_menu(current_user, repo)
                     elif choice == "9":
                         receiver_name = input("Send to username: ")
-                        receiver = find_user(users, receiver_name)
+                        receiver = repo.find_user(receiver_name)
                         if receiver:
                             content = input("Message: ")
-                            msg = Message(current_user, receiver, content)
-                            messages.append(msg)
-                            save_all(users, posts, messages, marketplace)
+                            msg = Message(id_allocator.next_id("messages"), current_user, receiver, content)
+                            repo.add_message(msg)
+                            msg.mark_new()
+                            save_changes(repo)
                             print("Message sent.")
                         else:
                             print("User not found.")
                     elif choice == "10":
-                        inbox = [m for m in messages if m.receiver == current_user]
+                        inbox, _ = repo.message_store.inbox(current_user.account.username)
                         if not inbox:
                             print("No messages.")
                         else:
-                            print("Your inbox:")
+                            print(f"Your inbox ({repo.message_store.unread_count(current_user.account.username)} new):")
+                            repo.message_store.mark_read(current_user.account.username)
+                            save_changes(repo)
                             for m in inbox:
                                 print(f"From {m.sender.name} ({m.sender.account.username}) at {m.timestamp.strftime('%Y-%m-%d %H:%M')}:\n  {m.content}\n")
                     elif choice == "11":
                         current_user.account.logout()
-                        save_all(users, posts, messages, marketplace)
+                        save_changes(repo)
                         current_user = None
                         print("Logged out.")
 
                 else:  # RegisteredUser
                     if choice == "2":  # Marketplace
-                        print("\n--- Marketplace: All Products ---")
-                        if not marketplace.products:
-                            print("No products yet.")
-                        else:
-                            products_list = marketplace.products[:]
-                            random.shuffle(products_list)
-                            for product in products_list:
-                                print(f"ID: {product.post_id} | {product.product_name} | ${product.price} | Seller: {product.author.name}")
-
-                        keyword = input("Search products (leave blank to skip): ").strip()
-                        if keyword:
-                            matches = marketplace.search_by_keyword(keyword)
-                            if not matches:
-                                print("No products matched your search.")
-                            else:
-                                random.shuffle(matches)
-                                for product in matches:
-                                    print(f"ID: {product.post_id} | {product.product_name} | ${product.price} | Seller: {product.author.name}")
-
-                        while True:
-                            add_choice = input("Add a product? (y/n): ").strip().lower()
-                            if add_choice in ["y", "n"]:
-                                break
-                            print("Please enter 'y' for yes or 'n' for no.")
-                        if add_choice == "y":
-                            pname = input("Product name: ")
-                            while True:
-                                price_input = input("Price (numbers only, no $): ")
-                                try:
-                                    price = float(price_input)
-                                    break
-                                except ValueError:
-                                    print("Please enter a valid number, without $ or text.")
-                            desc = input("Description: ")
-                            media = Media(1, "image", input("Media URL: "))
-                            post = ProductPost(pname, price, desc, media, current_user)
-                            posts.append(post)
-                            marketplace.add_product(post)
-                            save_all(users, posts, messages, marketplace)
-                            print("Product added!")
+                        show_marketplace(current_user, repo)
 
                     elif choice == "3":  # Job Board
-                        print("\n--- Job Board: All Jobs ---")
-                        job_posts = [p for p in posts if isinstance(p, JobPost)]
-                        if not job_posts:
-                            print("No job postings yet.")
-                        else:
-                            jobs_list = job_posts[:]
-                            random.shuffle(jobs_list)
-                            for job in jobs_list:
-                                print(f"ID: {job.post_id} | {job.job_title} at {job.company} | Poster: {job.author.name}")
-
-                        keyword = input("Search jobs (leave blank to skip): ").strip()
-                        if keyword:
-                            matches = [job for job in job_posts if keyword.lower() in job.job_title.lower()]
-                            if not matches:
-                                print("No jobs matched your search.")
-                            else:
-                                random.shuffle(matches)
-                                for job in matches:
-                                    print(f"ID: {job.post_id} | {job.job_title} at {job.company} | Poster: {job.author.name}")
-
-                        while True:
-                            apply_job = input("Apply to a job? (y/n): ").strip().lower()
-                            if apply_job in ["y", "n"]:
-                                break
-                            print("Please enter 'y' for yes or 'n' for no.")
-                        if apply_job == "y":
-                            pid = int(input("Enter Job Post ID to apply: "))
-                            job = next((j for j in job_posts if j.post_id == pid), None)
-                            if job:
-                                print("Application sent! (Feature can be expanded)")
-                            else:
-                                print("Invalid Job Post ID.")
+                        show_job_board(current_user, repo)
 
                     elif choice == "4":
                         uname = input("Follow who: ")
-                        current_user.follow(uname, users)
-                        save_all(users, posts, messages, marketplace)
+                        current_user.follow(uname, repo)
+                        save_changes(repo)
                     elif choice == "5":
                         uname = input("Unfollow who: ")
-                        current_user.unfollow(uname, users)
-                        save_all(users, posts, messages, marketplace)
+                        current_user.unfollow(uname, repo)
+                        save_changes(repo)
                     elif choice == "6":
                         uname = input("Enter username of post author: ")
-                        user = find_user(users, uname)
+                        user = repo.find_user(uname)
                         if user:
-                            user_posts = [p for p in posts if p.author == user]
+                            user_posts = repo.user_posts(user)
                             if not user_posts:
                                 print("This user has no posts.")
                             else:
-                                user_posts_list = user_posts[:]
-                                random.shuffle(user_posts_list)
                                 print("Posts by", uname)
-                                for p in user_posts_list:
+                                for p in shuffled(user_posts, cli_seed()):
                                     print(f"ID: {p.post_id} | {p.caption}")
                                 pid = int(input("Enter Post ID to like: "))
-                                post = find_post(user_posts, pid)
-                                if post:
+                                post = repo.get_post(pid)
+                                if post and post.author is user:
                                     current_user.like_post(post)
-                                    save_all(users, posts, messages, marketplace)
+                                    save_changes(repo)
                                 else:
                                     print("Invalid Post ID.")
                         else:
                             print("User not found.")
                     elif choice == "7":
                         uname = input("Enter username of post author: ")
-                        user = find_user(users, uname)
+                        user = repo.find_user(uname)
                         if user:
-                            user_posts = [p for p in posts if p.author == user]
+                            user_posts = repo.user_posts(user)
                             if not user_posts:
                                 print("This user has no posts.")
                             else:
-                                user_posts_list = user_posts[:]
-                                random.shuffle(user_posts_list)
                                 print("Posts by", uname)
-                                for p in user_posts_list:
+                                for p in shuffled(user_posts, cli_seed()):
                                     print(f"ID: {p.post_id} | {p.caption}")
                                 pid = int(input("Enter Post ID to comment on: "))
-                                post = find_post(user_posts, pid)
-                                if post:
+                                post = repo.get_post(pid)
+                                if post and post.author is user:
                                     content = input("Your comment: ")
                                     current_user.comment_on_post(post, content)
-                                    save_all(users, posts, messages, marketplace)
+                                    save_changes(repo)
                                 else:
                                     print("Invalid Post ID.")
                         else:
                             print("User not found.")
                     elif choice == "8":
-                        show_posts_menu(current_user, users, posts, messages, marketplace)
+                        show_posts_menu(current_user, repo)
                     elif choice == "9":
                         receiver_name = input("Send to username: ")
-                        receiver = find_user(users, receiver_name)
+                        receiver = repo.find_user(receiver_name)
                         if receiver:
                             content = input("Message: ")
-                            msg = Message(current_user, receiver, content)
-                            messages.append(msg)
-                            save_all(users, posts, messages, marketplace)
+                            msg = Message(id_allocator.next_id("messages"), current_user, receiver, content)
+                            repo.add_message(msg)
+                            msg.mark_new()
+                            save_changes(repo)
                             print("Message sent.")
                         else:
                             print("User not found.")
                     elif choice == "10":
-                        inbox = [m for m in messages if m.receiver == current_user]
+                        inbox, _ = repo.message_store.inbox(current_user.account.username)
                         if not inbox:
                             print("No messages.")
                         else:
-                            print("Your inbox:")
+                            print(f"Your inbox ({repo.message_store.unread_count(current_user.account.username)} new):")
+                            repo.message_store.mark_read(current_user.account.username)
+                            save_changes(repo)
                             for m in inbox:
                                 print(f"From {m.sender.name} ({m.sender.account.username}) at {m.timestamp.strftime('%Y-%m-%d %H:%M')}:\n  {m.content}\n")
                     elif choice == "11":
                         current_user.account.logout()
-                        save_all(users, posts, messages, marketplace)
+                        save_changes(repo)
                         current_user = None
                         print("Logged out.")
             except Exception as e:
                 print("Error:", e)
 
+# --- MEMORY FOOTPRINT ---
+FOOTPRINT_TYPES = (Account, User, Post, Media, Like, Comment, Message)
+
+def slot_values(obj):
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if name.startswith("__") and not name.endswith("__"):
+                name = f"_{cls.__name__.lstrip('_')}{name}"
+            if hasattr(obj, name):
+                yield getattr(obj, name)
+
+def object_size(obj, seen):
+    # the object plus the containers and values it owns; other domain objects
+    # it points at are counted under their own type, shared values once
+    size = sys.getsizeof(obj)
+    values = list(slot_values(obj))
+    attrs = getattr(obj, "__dict__", None)
+    if attrs is not None:
+        size += sys.getsizeof(attrs)
+        values.extend(attrs.values())
+    while values:
+        value = values.pop()
+        if id(value) in seen or isinstance(value, FOOTPRINT_TYPES) or value is None:
+            continue
+        seen.add(id(value))
+        size += sys.getsizeof(value)
+        if isinstance(value, dict):
+            values.extend(value.keys())
+            values.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            values.extend(value)
+    return size
+
+def memory_footprint(repo):
+    # {type name: (count, bytes)} for the domain objects held by `repo`
+    objects = []
+    for u in repo.users:
+        objects += [u, u.account]
+    for p in repo.posts:
+        objects.append(p)
+        objects.append(p.media)
+    objects.extend(repo.messages)
+    seen = set()
+    report = {}
+    for obj in objects:
+        count, size = report.get(type(obj).__name__, (0, 0))
+        report[type(obj).__name__] = (count + 1, size + object_size(obj, seen))
+    # likes and comments are array rows, not objects
+    store = repo.interactions
+    report["InteractionStore"] = (len(store.likes) + len(store.comments), store.nbytes())
+    return report
+
+def print_footprint(report):
+    print(f"{'type':<18}{'objects':>10}{'bytes':>14}{'bytes/obj':>11}")
+    total_count = total_size = 0
+    for name, (count, size) in sorted(report.items(), key=lambda kv: -kv[1][1]):
+        print(f"{name:<18}{count:>10}{size:>14}{size // max(count, 1):>11}")
+        total_count += count
+        total_size += size
+    print(f"{'total':<18}{total_count:>10}{total_size:>14}")
+
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["footprint"]:
+        print_footprint(memory_footprint(load_all()))
+    elif sys.argv[1:2] == ["snapshot"]:
+        sys.exit(snapshot_command(sys.argv[2:]))
+    else:
+        main()